@@ -0,0 +1,695 @@
+'''
+Alien ships for asteroids games.
+
+An AlienFleet keeps a number of alien ships in a World. Each alien
+hunts the player's ship: it keeps a short distance away from it, fires
+bullets at the point where the ship will be when the bullet gets there
+(lead prediction), and steers around rocks which are on course to hit
+it. Aliens die if they touch a rock or are hit by one of the player's
+bullets, which scores ALIEN_SCORE points, and new aliens arrive a
+little later, somewhere clear of the rocks and the ship. The game ends
+if an alien or an alien's bullet hits the player's ship. Aliens'
+bullets pass through rocks, but aliens do not fire when a rock is in
+the way.
+
+The decisions of an alien are split in two:
+
+    - Planning is expensive. It tests the alien's course and line of
+      fire against every rock, and works out where to aim. The plans of
+      all the aliens are made by a PlanScheduler, which spends at most a
+      fixed budget of time on planning in each time step. Aliens whose
+      plans are oldest are planned first; those that do not fit in the
+      budget keep their old plans until a later time step.
+    - Steering is cheap. Every alien steers every time step, towards
+      the ship and away from the rocks in its plan, and fires if its
+      plan says the way is clear.
+
+A plan is only trusted for ALIEN_MAX_PLAN_AGE time steps. An alien
+whose plan is older than that flies straight at the ship and holds its
+fire until it is planned again. So adding aliens makes their plans
+older, rather than making time steps longer. The scheduler counts the
+plans made, the aliens that wanted a plan but were deferred and the
+aliens left with stale plans, and records how long plans take and how
+old they get, so that the budget can be tuned:
+
+    python aliens.py --aliens 1 10 100 1000 --ticks 400
+
+Everything else an alien does in a time step (steering, moving, firing,
+moving its bullets and colliding with the ship, the rocks and the
+player's bullets) is done for the whole fleet at once with NumPy
+arrays, and at most ALIEN_SPAWNS_PER_TICK new aliens arrive in a time
+step. So outside the planning budget a time step costs a few
+microseconds per alien, and the fleet is limited to MAX_ALIENS aliens,
+which keeps a whole time step of the fleet well inside a frame.
+
+The time budget makes the aliens depend on the speed of the machine, so
+games with aliens cannot be recorded and replayed.
+'''
+
+import argparse
+import random
+import time
+
+import numpy as np
+import pygame
+from pygame.math import Vector2
+
+from asteroids import (World, MAX_X, MAX_Y, FPS, GREEN, RED, BULLET_SPEED,
+    BULLET_LENGTH, BULLET_WIDTH, MAX_BULLET_AGE, MAX_ROCK_SPEED,
+    SHIP_SIZE_MINOR, ACTION_LEFT, ACTION_RIGHT, ACTION_UP, ACTION_FIRE,
+    spawn_offscreen_rocks, wrap_positions, interpolate_positions)
+
+# Radius of an alien ship, for collisions and drawing.
+ALIEN_RADIUS = 12
+# Maximum speed of an alien ship.
+MAX_ALIEN_SPEED = 4
+# Largest change in the velocity of an alien ship in one time step.
+ALIEN_ACCELERATION = 0.4
+# Distance that aliens try to keep from the player's ship.
+ALIEN_STANDOFF = 180
+# Number of time steps ahead that aliens look for rocks on their course.
+ALIEN_AVOID_HORIZON = 30
+# Extra distance that aliens try to keep between themselves and rocks.
+ALIEN_AVOID_MARGIN = 10
+# Weight of rock avoidance against flying towards the ship in steering.
+ALIEN_AVOID_WEIGHT = 2.0
+# Number of time steps an alien waits between firing bullets.
+ALIEN_FIRE_INTERVAL = 20
+# Maximum number of bullets of each alien which can be alive at once.
+MAX_ALIEN_BULLETS = 1
+# Points scored for shooting an alien ship.
+ALIEN_SCORE = 200
+# Number of time steps before a new alien replaces one that died.
+ALIEN_RESPAWN_TICKS = 3 * FPS
+# Smallest gap between a new alien and any rock: as far as the fastest
+# rock moves in five time steps, which gives the alien time to be
+# planned and to start steering away.
+ALIEN_SPAWN_MARGIN = 5 * MAX_ROCK_SPEED
+# Number of random places tried for each new alien in a time step. If
+# none is clear of the rocks and the ship the alien waits for the next
+# time step.
+ALIEN_SPAWN_TRIES = 16
+# Largest number of new aliens which arrive in one time step. The rest
+# of those due wait for later time steps, so that a whole fleet
+# arriving at once does not make one time step long.
+ALIEN_SPAWNS_PER_TICK = 10
+# Largest number of aliens in a fleet. With 1000 aliens a time step of
+# the fleet takes about 7 ms at the 99th percentile on a typical
+# desktop machine (run main to measure it), including the planning
+# budget: under a third of the 1 / FPS seconds of a frame, leaving
+# room for the World and drawing.
+MAX_ALIENS = 1000
+# Time spent planning for the aliens in each time step, in seconds. This
+# is a small part of the 1 / FPS seconds of a time step.
+ALIEN_PLAN_BUDGET = 0.1 / FPS
+# Number of time steps after which an alien would like a new plan.
+ALIEN_PLAN_INTERVAL = 4
+# Number of time steps after which a plan is too old to be used.
+ALIEN_MAX_PLAN_AGE = 2 * FPS
+# Number of plans and time steps kept by the scheduler for statistics.
+PLAN_SAMPLES = 4096
+# Weight of the latest plan in the scheduler's running mean of the time
+# a plan takes.
+PLAN_TIME_SMOOTHING = 0.05
+# The distance a bullet travels in its life.
+BULLET_RANGE = BULLET_SPEED * MAX_BULLET_AGE
+# The size of the screen, for wrapping differences in position.
+SCREEN_SIZE = np.array([MAX_X, MAX_Y], dtype=float)
+
+
+def wrapped_offset(origin, target):
+    '''Return the offset from origin to target (Vector2 objects) the
+    short way around the screen.'''
+    offset = target - origin
+    if offset.x > MAX_X / 2:
+        offset.x -= MAX_X
+    elif offset.x < -MAX_X / 2:
+        offset.x += MAX_X
+    if offset.y > MAX_Y / 2:
+        offset.y -= MAX_Y
+    elif offset.y < -MAX_Y / 2:
+        offset.y += MAX_Y
+    return offset
+
+
+def wrap_offsets(offsets):
+    '''Change an array of offsets, whose last axis holds (x, y), in
+    place to go the short way around the screen. Returns the offsets.'''
+    offsets -= SCREEN_SIZE * np.round(offsets / SCREEN_SIZE)
+    return offsets
+
+
+def limit_lengths(vectors, limit):
+    '''Return an array of vectors (shape (n, 2)) with those longer than
+    limit scaled down to that length.'''
+    lengths = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    scale = np.minimum(1.0, limit / np.maximum(lengths, 1e-12))
+    return vectors * scale[:, np.newaxis]
+
+
+def intercept_time(offset, velocity, speed):
+    '''Return the time at which a bullet fired now at the given speed
+    can meet a target at the given offset moving with the given
+    velocity, or None if the bullet can never catch it. This is the
+    smallest positive t with |offset + velocity * t| = speed * t.'''
+    a = velocity.dot(velocity) - speed * speed
+    b = 2.0 * offset.dot(velocity)
+    c = offset.dot(offset)
+    if abs(a) < 1e-9:
+        # The target moves as fast as the bullet.
+        if b >= 0:
+            return None
+        return -c / b
+    discriminant = b * b - 4.0 * a * c
+    if discriminant < 0:
+        return None
+    root = discriminant ** 0.5
+    times = [t for t in ((-b - root) / (2.0 * a), (-b + root) / (2.0 * a))
+        if t > 0]
+    return min(times) if times else None
+
+
+def alien_points(x, y):
+    '''Return the four corners of the diamond drawn for an alien
+    centred on (x, y).'''
+    return ((x, y - ALIEN_RADIUS), (x + ALIEN_RADIUS, y),
+        (x, y + ALIEN_RADIUS), (x - ALIEN_RADIUS, y))
+
+
+class PlanScheduler(object):
+    '''Share out a time budget for planning between many agents.
+
+    Agents are numbered, and an array of plan ticks holds the time step
+    of the latest plan of each agent (-1 if it has never been planned).
+    Each time step, run plans the agents whose plans are oldest first,
+    for as long as the next plan is predicted to fit in budget seconds.
+    The prediction is a running mean of the time plans have taken. At
+    least one agent is planned per time step, so planning never stops
+    however small the budget.
+
+    An agent is due for a new plan once its plan is interval time steps
+    old, and its plan is stale once it is more than max_age time steps
+    old. The scheduler keeps counts of:
+       - ticks: time steps run
+       - plans: plans made
+       - deferred: due agents left unplanned at the end of a time step
+       - stale: stale agents left at the end of a time step
+       - overruns: time steps whose planning went over the budget by
+         more than the predicted time of a plan, or went over it with
+         no agent deferred
+    and, for the last num_samples plans and time steps, the time each
+    plan took, the age of the plan that each plan replaced (first plans
+    of agents, which replace nothing, are left out), and the time spent
+    planning in each time step.
+    '''
+    def __init__(self, budget=ALIEN_PLAN_BUDGET, interval=ALIEN_PLAN_INTERVAL,
+            max_age=ALIEN_MAX_PLAN_AGE, num_samples=PLAN_SAMPLES,
+            clock=time.perf_counter):
+        self.budget = budget
+        self.interval = interval
+        self.max_age = max_age
+        self.num_samples = num_samples
+        self.clock = clock
+        self.plan_times = np.zeros(num_samples)
+        self.plan_ages = np.zeros(num_samples, dtype=np.int64)
+        self.tick_times = np.zeros(num_samples)
+        self.reset_counters()
+
+
+    def reset_counters(self):
+        '''Forget all the counts and samples.'''
+        self.ticks = 0
+        self.plans = 0
+        # The number of plans which replaced an earlier plan.
+        self.replans = 0
+        self.deferred = 0
+        self.stale = 0
+        self.overruns = 0
+        # The running mean of the time a plan takes.
+        self.predicted = 0.0
+
+
+    def run(self, plan_ticks, tick, plan, agents=None):
+        '''Call plan(agent) for as many of the given agents (an array of
+        indices into plan_ticks, by default every agent) as fit in the
+        budget in time step tick, oldest plans first, and set the plan
+        tick of each agent planned. Returns the number of agents
+        planned.'''
+        clock = self.clock
+        start = clock()
+        if agents is None:
+            agents = np.arange(len(plan_ticks))
+        # Never planned agents have the oldest plans of all.
+        order = agents[np.argsort(plan_ticks[agents], kind='stable')]
+        num_planned = 0
+        for agent in order.tolist():
+            if (num_planned > 0 and
+                    clock() - start + self.predicted > self.budget):
+                break
+            previous = int(plan_ticks[agent])
+            if previous >= 0 and tick - previous < self.interval:
+                # The rest of the agents have newer plans still.
+                break
+            plan_start = clock()
+            plan(agent)
+            plan_time = clock() - plan_start
+            self.plan_times[self.plans % self.num_samples] = plan_time
+            if self.plans == 0:
+                self.predicted = plan_time
+            else:
+                self.predicted += PLAN_TIME_SMOOTHING * (plan_time
+                    - self.predicted)
+            if previous >= 0:
+                self.plan_ages[self.replans % self.num_samples] = (tick
+                    - previous)
+                self.replans += 1
+            plan_ticks[agent] = tick
+            self.plans += 1
+            num_planned += 1
+        elapsed = clock() - start
+        left = plan_ticks[order[num_planned:]]
+        never = left < 0
+        ages = tick - left
+        self.stale += int(np.count_nonzero(never | (ages > self.max_age)))
+        deferred = int(np.count_nonzero(never | (ages >= self.interval)))
+        self.deferred += deferred
+        self.tick_times[self.ticks % self.num_samples] = elapsed
+        over = elapsed - self.budget
+        if over > 0 and (over > self.predicted or deferred == 0):
+            self.overruns += 1
+        self.ticks += 1
+        return num_planned
+
+
+    def is_stale(self, plan_ticks, tick):
+        '''Return an array which is True for the agents whose plans are
+        too old to use in time step tick.'''
+        return (plan_ticks < 0) | (tick - plan_ticks > self.max_age)
+
+
+    def stats(self):
+        '''Return a dictionary of the counters, and (p50, p99) pairs
+        for the time per plan and per time step in seconds and the age
+        of replaced plans in time steps.'''
+        result = {'ticks': self.ticks, 'plans': self.plans,
+            'deferred': self.deferred, 'stale': self.stale,
+            'overruns': self.overruns}
+        for name, values, count in (
+                ('plan_time', self.plan_times, self.plans),
+                ('plan_age', self.plan_ages, self.replans),
+                ('tick_time', self.tick_times, self.ticks)):
+            count = min(count, self.num_samples)
+            if count:
+                result[name] = tuple(np.percentile(values[:count], (50, 99)))
+        return result
+
+
+class AlienFleet(object):
+    '''The alien ships in a game, and their bullets.
+
+    The fleet keeps up to num_aliens aliens (at most MAX_ALIENS) in the
+    game; one that dies is replaced respawn_ticks time steps later by a
+    new alien, which appears at a random place clear of the rocks and
+    away from the player's ship. The fleet uses its own random number
+    generator, and its plans are made by a PlanScheduler.
+
+    Like a RockField, the fleet keeps its state in NumPy arrays, with
+    one slot per alien whether it is alive or not:
+       - positions, previous_positions and velocities (shape (n, 2))
+       - alive, and the time step at which a dead alien is replaced
+       - the state of each alien's most recent plan (see plan): its
+         plan tick, the direction to aim bullets in, whether the line of
+         fire is clear of rocks and the direction to steer to avoid
+         rocks (of zero length if there is nothing to avoid)
+       - the number of time steps until each alien may fire again
+    and each alien has MAX_ALIEN_BULLETS bullet slots, with the
+    position, previous position, direction, age and alive flag of each
+    bullet (shape (n, MAX_ALIEN_BULLETS, ...)).
+
+    Call step after each World.step, and draw when drawing the world.
+    '''
+    def __init__(self, num_aliens, scheduler=None, seed=None,
+            respawn_ticks=ALIEN_RESPAWN_TICKS):
+        if num_aliens > MAX_ALIENS:
+            raise ValueError('at most {} aliens are allowed, not {}'.format(
+                MAX_ALIENS, num_aliens))
+        if scheduler is None:
+            scheduler = PlanScheduler()
+        self.num_aliens = num_aliens
+        self.respawn_ticks = respawn_ticks
+        self.scheduler = scheduler
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+
+    def reset(self):
+        '''Remove all the aliens and their bullets, ready for a new
+        game. New aliens arrive straight away.'''
+        num_aliens = self.num_aliens
+        self.tick = 0
+        self.positions = np.zeros((num_aliens, 2))
+        self.previous_positions = np.zeros((num_aliens, 2))
+        self.velocities = np.zeros((num_aliens, 2))
+        self.alive = np.zeros(num_aliens, dtype=bool)
+        self.arrivals = np.zeros(num_aliens, dtype=np.int64)
+        self.plan_ticks = np.full(num_aliens, -1, dtype=np.int64)
+        self.aims = np.zeros((num_aliens, 2))
+        self.fire_clear = np.zeros(num_aliens, dtype=bool)
+        self.avoids = np.zeros((num_aliens, 2))
+        self.cooldowns = np.zeros(num_aliens, dtype=np.int64)
+        shape = (num_aliens, MAX_ALIEN_BULLETS)
+        self.bullet_positions = np.zeros(shape + (2,))
+        self.bullet_previous_positions = np.zeros(shape + (2,))
+        self.bullet_directions = np.zeros(shape + (2,))
+        self.bullet_ages = np.zeros(shape, dtype=np.int64)
+        self.bullet_alive = np.zeros(shape, dtype=bool)
+
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+
+    def spawn(self, world):
+        '''Bring in up to ALIEN_SPAWNS_PER_TICK of the aliens which are
+        due. Each new alien appears at the first of ALIEN_SPAWN_TRIES
+        random places which is at least ALIEN_SPAWN_MARGIN from every
+        rock and ALIEN_STANDOFF from the player's ship, drifting in a
+        random direction. Aliens with no such place, or beyond the
+        limit, wait for a later time step.'''
+        due = np.flatnonzero(~self.alive & (self.arrivals <= self.tick))
+        due = due[:ALIEN_SPAWNS_PER_TICK]
+        if not len(due):
+            return
+        rng = self.rng
+        candidates = rng.uniform((0, 0), (MAX_X, MAX_Y),
+            size=(len(due), ALIEN_SPAWN_TRIES, 2))
+        ship = world.ship.position
+        offsets = wrap_offsets(candidates - (ship.x, ship.y))
+        clear = np.einsum('dck,dck->dc', offsets, offsets) >= (
+            ALIEN_STANDOFF * ALIEN_STANDOFF)
+        rocks = world.rocks
+        if len(rocks):
+            offsets = wrap_offsets(rocks.positions
+                - candidates[:, :, np.newaxis, :])
+            distance = np.sqrt(np.einsum('dcrk,dcrk->dcr', offsets, offsets))
+            clear &= (distance > rocks.radii + ALIEN_RADIUS
+                + ALIEN_SPAWN_MARGIN).all(axis=2)
+        placed = clear.any(axis=1)
+        new = due[placed]
+        if not len(new):
+            return
+        places = candidates[placed, clear[placed].argmax(axis=1)]
+        angles = rng.uniform(0, 2 * np.pi, len(new))
+        self.positions[new] = places
+        self.previous_positions[new] = places
+        self.velocities[new] = np.stack((np.cos(angles), np.sin(angles)),
+            axis=1)
+        self.alive[new] = True
+        self.plan_ticks[new] = -1
+        self.aims[new] = (1, 0)
+        self.fire_clear[new] = False
+        self.avoids[new] = 0
+        self.cooldowns[new] = ALIEN_FIRE_INTERVAL
+
+
+    def plan(self, alien, world):
+        '''Make a new plan for the alien with the given index. Every
+        rock is seen from the alien, the short way around the screen,
+        and tested for:
+           - coming within ALIEN_AVOID_MARGIN of the alien in the next
+             ALIEN_AVOID_HORIZON time steps if neither changes course;
+             the alien will steer away from the point of closest
+             approach of each such rock, more strongly the sooner it is
+           - blocking the line of fire to the point where a bullet
+             fired now would meet the player's ship.'''
+        ship = world.ship
+        origin = self.positions[alien]
+        offset = wrapped_offset(Vector2(origin[0], origin[1]), ship.position)
+        time_to_hit = intercept_time(offset, ship.velocity, BULLET_SPEED)
+        if time_to_hit is None:
+            aim = offset
+            fire_range = offset.length()
+        else:
+            aim = offset + ship.velocity * time_to_hit
+            fire_range = BULLET_SPEED * time_to_hit
+        if aim.length_squared() > 0:
+            aim.normalize_ip()
+            self.aims[alien] = (aim.x, aim.y)
+        fire_clear = fire_range <= BULLET_RANGE
+        self.avoids[alien] = 0
+        rocks = world.rocks
+        if len(rocks) == 0:
+            self.fire_clear[alien] = fire_clear
+            return
+        positions = wrap_offsets(rocks.positions - origin)
+        velocities = rocks.velocities - self.velocities[alien]
+        reach = rocks.radii + (ALIEN_RADIUS + ALIEN_AVOID_MARGIN)
+        # The time of closest approach of each rock, within the horizon.
+        speed_squared = np.einsum('ij,ij->i', velocities, velocities)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            closest = (-np.einsum('ij,ij->i', positions, velocities)
+                / speed_squared)
+        closest = np.clip(np.nan_to_num(closest), 0, ALIEN_AVOID_HORIZON)
+        nearest = positions + velocities * closest[:, np.newaxis]
+        distance = np.sqrt(np.einsum('ij,ij->i', nearest, nearest))
+        threats = np.flatnonzero(distance < reach)
+        if len(threats):
+            urgency = 1.0 - closest[threats] / (ALIEN_AVOID_HORIZON + 1)
+            away = -nearest[threats] / np.maximum(distance[threats],
+                1.0)[:, np.newaxis]
+            avoid = (away * urgency[:, np.newaxis]).sum(axis=0)
+            length = float(np.hypot(*avoid))
+            if length > 0:
+                self.avoids[alien] = avoid / length
+        if fire_clear:
+            # Does the line of fire pass through a rock? Bullets are
+            # much faster than rocks, so the rocks are taken to stand
+            # still.
+            direction = self.aims[alien]
+            along = np.clip(positions @ direction, 0, fire_range)
+            across = positions - along[:, np.newaxis] * direction
+            blocked = (np.einsum('ij,ij->i', across, across)
+                <= rocks.radii * rocks.radii)
+            fire_clear = not blocked.any()
+        self.fire_clear[alien] = fire_clear
+
+
+    def steer(self, ship, stale):
+        '''Accelerate every alien towards a point ALIEN_STANDOFF away
+        from the player's ship, and away from the rocks in its plan
+        unless its plan is stale (an array of flags, one per alien).'''
+        offsets = wrap_offsets((ship.position.x, ship.position.y)
+            - self.positions)
+        distance = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+        # Close in when far away and back off when too near.
+        scale = np.zeros(len(distance))
+        np.divide(distance - ALIEN_STANDOFF, distance, out=scale,
+            where=distance > 0)
+        desired = limit_lengths(offsets * scale[:, np.newaxis],
+            MAX_ALIEN_SPEED)
+        desired += (self.avoids * (ALIEN_AVOID_WEIGHT * MAX_ALIEN_SPEED)
+            * ~stale[:, np.newaxis])
+        change = limit_lengths(desired - self.velocities, ALIEN_ACCELERATION)
+        self.velocities = limit_lengths(self.velocities + change,
+            MAX_ALIEN_SPEED)
+
+
+    def fire(self, stale):
+        '''Fire a bullet from each alien which has cooled down since its
+        last shot, has a fresh plan with a clear line of fire and a free
+        bullet slot; the others cool down by a time step.'''
+        alive = self.alive
+        cooling = alive & (self.cooldowns > 0)
+        self.cooldowns[cooling] -= 1
+        free = ~self.bullet_alive
+        ready = (alive & ~cooling & ~stale & self.fire_clear
+            & free.any(axis=1))
+        shooters = np.flatnonzero(ready)
+        if not len(shooters):
+            return
+        slots = free[shooters].argmax(axis=1)
+        positions = self.positions[shooters]
+        self.bullet_positions[shooters, slots] = positions
+        self.bullet_previous_positions[shooters, slots] = positions
+        self.bullet_directions[shooters, slots] = self.aims[shooters]
+        self.bullet_ages[shooters, slots] = 0
+        self.bullet_alive[shooters, slots] = True
+        self.cooldowns[shooters] = ALIEN_FIRE_INTERVAL
+
+
+    def step(self, world):
+        '''Advance the aliens and their bullets by one time step in the
+        given world, after World.step. Aliens and their bullets that hit
+        the player's ship end the game (setting world.done), and those
+        hit by the player's bullets add to world.score. Returns the
+        number of points scored.'''
+        self.tick += 1
+        tick = self.tick
+        self.spawn(world)
+        scheduler = self.scheduler
+        scheduler.run(self.plan_ticks, tick,
+            lambda alien: self.plan(alien, world), np.flatnonzero(self.alive))
+        stale = scheduler.is_stale(self.plan_ticks, tick)
+        self.steer(world.ship, stale)
+        # Dead aliens move too; it is cheaper than leaving them out.
+        self.previous_positions[:] = self.positions
+        self.positions += self.velocities
+        wrap_positions(self.positions)
+        self.fire(stale)
+        self.move_bullets()
+        return self.collide(world)
+
+
+    def move_bullets(self):
+        '''Age and move the aliens' bullets, freeing the slots of those
+        which have died.'''
+        alive = self.bullet_alive
+        self.bullet_ages[alive] += 1
+        alive &= self.bullet_ages <= MAX_BULLET_AGE
+        self.bullet_previous_positions[:] = self.bullet_positions
+        self.bullet_positions += self.bullet_directions * BULLET_SPEED
+        wrap_positions(self.bullet_positions)
+
+
+    def collide(self, world):
+        '''Remove the aliens which touch a rock or the front of one of
+        the player's bullets, and end the game if an alien or the front
+        of an alien's bullet touches the player's ship. Returns the
+        number of points scored.'''
+        ship = world.ship
+        ship_position = (ship.position.x, ship.position.y)
+        ship_reach = ALIEN_RADIUS + SHIP_SIZE_MINOR
+        alive = self.bullet_alive
+        fronts = (self.bullet_positions[alive]
+            + self.bullet_directions[alive] * BULLET_LENGTH)
+        offsets = wrap_offsets(fronts - ship_position)
+        if (np.einsum('bk,bk->b', offsets, offsets)
+                <= SHIP_SIZE_MINOR * SHIP_SIZE_MINOR).any():
+            world.done = True
+        live = np.flatnonzero(self.alive)
+        if not len(live):
+            return 0
+        positions = self.positions[live]
+        dead = np.zeros(len(live), dtype=bool)
+        rocks = world.rocks
+        if len(rocks):
+            offsets = wrap_offsets(rocks.positions[np.newaxis, :, :]
+                - positions[:, np.newaxis, :])
+            distance = np.sqrt(np.einsum('ark,ark->ar', offsets, offsets))
+            dead |= (distance <= rocks.radii + ALIEN_RADIUS).any(axis=1)
+        points = 0
+        player_bullets = world.bullets
+        if player_bullets:
+            fronts = np.array([bullet.front() for bullet in player_bullets])
+            offsets = wrap_offsets(fronts[np.newaxis, :, :]
+                - positions[:, np.newaxis, :])
+            hits = np.einsum('abk,abk->ab', offsets, offsets) <= (
+                ALIEN_RADIUS * ALIEN_RADIUS)
+            shot = hits.any(axis=1) & ~dead
+            points = ALIEN_SCORE * int(shot.sum())
+            dead |= shot
+            # Each bullet which hit an alien is used up.
+            spent = set(np.flatnonzero(hits.any(axis=0)).tolist())
+            if spent:
+                world.bullets = [bullet for index, bullet in
+                    enumerate(player_bullets) if index not in spent]
+                world.bullet_pool.extend(player_bullets[index]
+                    for index in spent)
+        offsets = wrap_offsets(positions - ship_position)
+        if (np.einsum('ak,ak->a', offsets, offsets)[~dead]
+                <= ship_reach * ship_reach).any():
+            world.done = True
+        if dead.any():
+            gone = live[dead]
+            self.alive[gone] = False
+            self.arrivals[gone] = self.tick + self.respawn_ticks
+        world.score += points
+        return points
+
+
+    def draw(self, window_surface, alpha=1.0):
+        '''Draw the aliens and their bullets on the supplied surface,
+        a fraction alpha of the way through their most recent moves.
+        Returns the list of rectangles of the surface that were drawn
+        on.'''
+        rects = []
+        alive = self.bullet_alive
+        starts = self.bullet_positions[alive]
+        if alpha < 1.0:
+            starts = interpolate_positions(
+                self.bullet_previous_positions[alive], starts, alpha)
+        ends = starts + self.bullet_directions[alive] * BULLET_LENGTH
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            rects.append(pygame.draw.line(window_surface, RED, start, end,
+                BULLET_WIDTH))
+        positions = self.positions[self.alive]
+        if alpha < 1.0:
+            positions = interpolate_positions(
+                self.previous_positions[self.alive], positions, alpha)
+        for x, y in positions.tolist():
+            rects.append(pygame.draw.polygon(window_surface, GREEN,
+                alien_points(x, y)))
+        return rects
+
+
+def main():
+    '''Report the cost of running fleets of aliens, and how the plan
+    scheduler shares out its budget between them. Aliens which die are
+    replaced on the next time step, so the fleet stays close to full;
+    the mean number alive is reported alongside. Time steps are timed
+    after a warm up, during which the fleet arrives.'''
+    parser = argparse.ArgumentParser(
+        description='Measure the cost of alien ships.')
+    parser.add_argument('--aliens', type=int, nargs='+', default=[1, 10, 100],
+        help='numbers of aliens in the game (at most {})'.format(MAX_ALIENS))
+    parser.add_argument('--rocks', type=int, default=50,
+        help='number of rocks in the game')
+    parser.add_argument('--ticks', type=int, default=400,
+        help='number of time steps to time')
+    parser.add_argument('--warmup', type=int, default=100,
+        help='number of time steps to run before timing')
+    parser.add_argument('--budget', type=float, default=ALIEN_PLAN_BUDGET,
+        help='seconds of planning per time step')
+    parser.add_argument('--seed', type=int, default=1,
+        help='seed for the game and the aliens')
+    args = parser.parse_args()
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    print('frame budget {:.1f} ms, planning budget {:.2f} ms'.format(
+        1e3 / FPS, args.budget * 1e3))
+    print('aliens  alive  step p50/p99 ms  plan p50/p99 us  plan age p50/p99  '
+        'deferred  stale  overruns')
+    for num_aliens in args.aliens:
+        world = World(args.seed)
+        scheduler = PlanScheduler(budget=args.budget)
+        fleet = AlienFleet(num_aliens, scheduler, args.seed, respawn_ticks=0)
+        player = random.Random(args.seed)
+        step_times = []
+        alive = []
+        for count in range(args.warmup + args.ticks):
+            if count == args.warmup:
+                scheduler.reset_counters()
+            world.step(player.randint(0, max_action))
+            # Keep the scene busy and the game going, so every time step
+            # does the same amount of work.
+            world.done = False
+            missing = args.rocks - len(world.rocks)
+            if missing > 0:
+                world.rocks.extend(spawn_offscreen_rocks(missing, player))
+            start = time.perf_counter()
+            fleet.step(world)
+            if count >= args.warmup:
+                step_times.append(time.perf_counter() - start)
+                alive.append(len(fleet))
+        stats = scheduler.stats()
+        step_p50, step_p99 = np.percentile(step_times, (50, 99))
+        plan_p50, plan_p99 = stats.get('plan_time', (0.0, 0.0))
+        age_p50, age_p99 = stats.get('plan_age', (0, 0))
+        print('{:6d} {:6.0f}  {:6.2f} {:6.2f}     {:6.0f} {:6.0f}   {:7.0f}'
+            ' {:7.0f}   {:8d} {:6d} {:9d}'.format(num_aliens, np.mean(alive),
+            step_p50 * 1e3, step_p99 * 1e3, plan_p50 * 1e6,
+            plan_p99 * 1e6, age_p50, age_p99, stats['deferred'],
+            stats['stale'], stats['overruns']))
+
+
+if __name__ == '__main__':
+    main()
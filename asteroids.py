@@ -21,9 +21,13 @@ side, maintaining its velocity.
 If the number of rocks on the screen falls before some threshold value then
 new rocks are spawned off screen.
 
-The game relies on the pygame library to draw graphics and handle player input.
+The game relies on the pygame library to draw graphics and handle player input,
+and on the numpy library to store and update the rocks in bulk.
 
-The game high score is kept in a text file called asteroids_high_score.txt.
+The best scores, and when they were scored, are kept in an SQLite database
+called asteroids_scores.db, which several copies of the game can share. A high
+score in the text file asteroids_high_score.txt used by older versions is
+copied into the database the first time it is opened.
 
 To quit the game press the escape key, or close the game window.
 
@@ -38,25 +42,43 @@ Desirable things to add in future versions
 
     - Sound effects.
     - Pretty graphics for the sprites (replace the geometric graphics).
-    - Explosion effects.
     - More interesting levels.
-    - Alien ships.
-    - Multi-player mode.
-    - Rocks to collide and bounce off each other.
-    - Rock explosions to conserve momentum of exploded rock.
 
-Future code improvements:
+The rules of the game live in the World class, which does not need a
+display. It can be stepped much faster than real time, which is useful
+for testing automated players:
 
-    - Refactor the game_loop function. It is far too complex.
-    - Package up the game state into an object.
+    python asteroids.py --headless 100000
+
+On a single core of a typical desktop machine the headless mode runs at
+roughly 9000 time steps per second, about 220 times faster than the
+interactive game at FPS frames per second.
 '''
 
+import time
+# When the game started, before the slow imports, for measuring the
+# time it takes to start up (see StartupTimer).
+START_TIME = time.perf_counter()
 import pygame
+import os
+import pathlib
 import sys
+import random
+import argparse
+import struct
+import csv
+import json
+import zlib
+import sqlite3
+import threading
+import queue
+from array import array
+from contextlib import contextmanager
+import numpy as np
+from collections import namedtuple, OrderedDict, deque
 from pygame.math import Vector2
-from pygame.locals import (QUIT, KEYDOWN, K_RETURN,
-   K_LEFT, K_RIGHT, K_UP, K_DOWN, K_SPACE, K_ESCAPE)
-from random import choice, randint 
+from pygame.locals import (QUIT, KEYDOWN, KEYUP, NOEVENT, K_RETURN,
+   K_LEFT, K_RIGHT, K_UP, K_DOWN, K_SPACE, K_ESCAPE, K_F3)
 
 # Maximum X (horizontal) coordinate.
 MAX_X = 800
@@ -78,7 +100,8 @@ GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 # Maximum speed of the ship.
 MAX_SHIP_SPEED = 10
-# Frames per second refresh rate for the game.
+# Time steps per second of the game. This is also the default number
+# of frames drawn per second.
 FPS = 40 
 # Speed of ship bullets.
 BULLET_SPEED = 15 
@@ -118,6 +141,85 @@ SCORE_FONT = 30
 ROTATE_ANGLE = 10
 # Name of the text file containing the high score.
 HIGH_SCORE_FILE = 'asteroids_high_score.txt'
+# Database of the best scores.
+SCORE_DATABASE = 'asteroids_scores.db'
+# Major and minor axis sizes of the space ship.
+SHIP_SIZE_MAJOR = 20
+SHIP_SIZE_MINOR = 10
+# Number of best scores kept in the database.
+MAX_SCORES = 10
+# Seconds to wait for another copy of the game to finish writing the
+# score database.
+SCORE_LOCK_TIMEOUT = 5.0
+# Version of the score database schema, kept in its user_version.
+SCORE_SCHEMA_VERSION = 1
+# Maximum number of rendered text surfaces kept in the text cache.
+TEXT_CACHE_SIZE = 64
+# Maximum number of pre-rendered rock sprites kept in the sprite cache.
+# Every rock has its own random colour, so this should be larger than
+# the number of rocks on the screen, or the cache will keep discarding
+# sprites that are needed again in the next frame.
+ROCK_SPRITE_CACHE_SIZE = 1024
+# Maximum number of time steps simulated before drawing a frame. If the
+# game falls further behind than this it slows down rather than trying
+# to catch up.
+MAX_CATCH_UP_STEPS = 5
+# Number of frames kept by the frame profiler.
+PROFILE_FRAMES = 1024
+# Number of frames between updates of the profiler overlay statistics.
+PROFILE_OVERLAY_INTERVAL = 20
+# Size of the font for the profiler overlay.
+PROFILE_FONT_SIZE = 20
+# The phases of a frame timed by the frame profiler, in order.
+PROFILE_PHASES = ('input', 'spawn', 'bullets', 'rocks', 'aliens', 'particles',
+    'draw', 'score', 'overlay', 'display')
+# Maximum number of explosion particles alive at once.
+MAX_PARTICLES = 8192
+# Number of particles thrown out by an exploding rock for each unit of
+# its radius.
+PARTICLES_PER_RADIUS = 0.5
+# Range of the lifetimes of particles, in time steps.
+MIN_PARTICLE_AGE = 10
+MAX_PARTICLE_AGE = 30
+# Range of the speeds of particles, relative to the rock they came from.
+MIN_PARTICLE_SPEED = 1
+MAX_PARTICLE_SPEED = 6
+# Particles keep this fraction of their velocity from one time step to
+# the next.
+PARTICLE_DRAG = 0.95
+# Width and height of a particle in pixels.
+PARTICLE_SIZE = 2
+# If True bullets hit any rock that the front of the bullet passed
+# through during a time step (swept collision), not just rocks that
+# contain the front of the bullet at the end of the time step. This stops
+# fast bullets from passing through rocks without hitting them.
+SWEPT_BULLETS = False
+# Minimum number of rocks before collision tests use the UniformGrid
+# broadphase. With fewer rocks it is faster to test every rock.
+BROADPHASE_MIN_ROCKS = 50
+# If True rocks bounce off each other in elastic collisions.
+ROCK_COLLISIONS = True
+# Minimum number of rocks before rock to rock collisions are found with
+# sort and sweep. With fewer rocks it is faster to test every pair.
+SWEEP_MIN_ROCKS = 40
+# Action bit for rotating the ship left in one time step.
+ACTION_LEFT = 1
+# Action bit for rotating the ship right in one time step.
+ACTION_RIGHT = 2
+# Action bit for accelerating the ship in one time step.
+ACTION_UP = 4
+# Action bit for firing a bullet in one time step.
+ACTION_FIRE = 8
+# Action value meaning the player did nothing in one time step.
+ACTION_NONE = 0
+# The action bit for each key which controls the ship.
+KEY_ACTIONS = {K_LEFT: ACTION_LEFT, K_RIGHT: ACTION_RIGHT, K_UP: ACTION_UP,
+    K_SPACE: ACTION_FIRE}
+# Names of the action bits, for input latency statistics.
+ACTION_NAMES = OrderedDict(((ACTION_LEFT, 'left'), (ACTION_RIGHT, 'right'),
+    (ACTION_UP, 'up'), (ACTION_FIRE, 'fire')))
+# Number of inputs kept by the input queue for latency statistics.
+INPUT_SAMPLES = 4096
 
 
 class GameObject(object):
@@ -126,29 +228,96 @@ class GameObject(object):
     move about the screen. When game objects reach the edge of the
     screen they move to the opposite site, preserving all their
     other state.
+
+    A game object owns its position vector, which move updates in
+    place, so the position passed to the constructor is copied.
     '''
+    # Game objects are created and moved many times a second, so they
+    # use slots rather than a dictionary for their attributes.
+    __slots__ = ('position', 'velocity', 'previous_position')
+
     def __init__(self, position, velocity):
-        self.position = position
+        self.position = Vector2(position)
         self.velocity = velocity
+        # The position before the most recent move, used to draw the
+        # object between time steps.
+        self.previous_position = Vector2(position)
 
     def move(self):
         '''Update the current position of the object based on its
         old position and its velocity. If the object crosses the edge of
         the screen it will move to the opposite side.
+        The position is updated in place, without allocating a new
+        vector.
         '''
-        self.position = self.position + self.velocity
-        if self.position.x >= MAX_X:
+        position = self.position
+        self.previous_position.update(position)
+        position += self.velocity
+        if position.x >= MAX_X:
             # Object crossed the right side of screen.
-            self.position.x = 0
-        elif self.position.x < 0:
+            position.x = 0
+        elif position.x < 0:
             # Object crossed the left side of screen.
-            self.position.x = MAX_X - 1
-        if self.position.y >= MAX_Y:
+            position.x = MAX_X - 1
+        if position.y >= MAX_Y:
             # Object crossed the bottom side of screen.
-            self.position.y = 0
-        elif self.position.y < 0:
+            position.y = 0
+        elif position.y < 0:
             # Object crossed the top side of screen.
-            self.position.y = MAX_Y - 1
+            position.y = MAX_Y - 1
+
+
+    def interpolated_position(self, alpha):
+        '''Return the position of the object a fraction alpha (between
+        0 and 1) of the way through its most recent move. If the object
+        wrapped around the screen in that move, its current position is
+        returned instead, rather than a point somewhere in the middle of
+        the screen.'''
+        previous = self.previous_position
+        delta = self.position - previous
+        if abs(delta.x) > MAX_X / 2 or abs(delta.y) > MAX_Y / 2:
+            return Vector2(self.position)
+        return previous + delta * alpha
+
+
+def interpolate_positions(previous, current, alpha):
+    '''Return the positions a fraction alpha (between 0 and 1) of the
+    way from the previous to the current positions, which are NumPy
+    arrays whose last axis holds (x, y) coordinates. Objects that
+    wrapped around the screen are placed at their current positions,
+    as in GameObject.interpolated_position.'''
+    delta = current - previous
+    result = previous + delta * alpha
+    wrapped = ((np.abs(delta[..., 0]) > MAX_X / 2)
+        | (np.abs(delta[..., 1]) > MAX_Y / 2))
+    result[wrapped] = current[wrapped]
+    return result
+
+
+def wrap_positions(positions):
+    '''Move positions which have crossed the edge of the screen to the
+    opposite side, following the same rule as GameObject.move.
+    The positions are a NumPy array whose last axis holds (x, y)
+    coordinates, and are updated in place.'''
+    x = positions[..., 0]
+    y = positions[..., 1]
+    # Compute both masks before changing anything, as in
+    # GameObject.move.
+    x_high = x >= MAX_X
+    x_low = x < 0
+    x[x_high] = 0
+    x[x_low] = MAX_X - 1
+    y_high = y >= MAX_Y
+    y_low = y < 0
+    y[y_high] = 0
+    y[y_low] = MAX_Y - 1
+
+
+def rock_mass(radius):
+    '''Return the mass of a rock with the given radius (a number or a
+    NumPy array of numbers). Rocks are flat discs of the same density,
+    so their mass is proportional to their area.'''
+    return radius * radius
 
 
 class Rock(GameObject):
@@ -164,6 +333,7 @@ class Rock(GameObject):
     Rocks keep moving with the same velocity (direction and
     speed) indefinitely.
     '''
+    __slots__ = ('radius', 'colour')
 
     def __init__(self, position, velocity, radius, colour):
         super(Rock, self).__init__(position, velocity)
@@ -173,9 +343,629 @@ class Rock(GameObject):
 
     def draw(self, windowSurface):
         '''Draw the rock at its current position on the supplied
-        windowSurface.'''
+        windowSurface. Returns the rectangle of the surface that
+        was drawn on.'''
         center = (int(self.position.x), int(self.position.y))
-        pygame.draw.circle(windowSurface, self.colour, center, self.radius)
+        return pygame.draw.circle(windowSurface, self.colour, center,
+            self.radius)
+
+
+class RockView(Rock):
+    '''A view of one rock stored in a RockField. A RockView behaves
+    like a Rock, so the Rock methods (such as draw) work on it, but its
+    position, velocity, radius and colour are read from and written to
+    the arrays of the field.
+
+    A view refers to a rock by its index in the field, so it is only
+    valid until rocks are removed from the field.
+    '''
+    __slots__ = ('field', 'index')
+
+    def __init__(self, field, index):
+        self.field = field
+        self.index = index
+
+
+    def move(self):
+        '''Move the rock in the arrays of the field, as RockField.move
+        does for all rocks.'''
+        field = self.field
+        index = self.index
+        field.previous_positions[index] = field.positions[index]
+        field.positions[index] += field.velocities[index]
+        wrap_positions(field.positions[index])
+
+
+    @property
+    def position(self):
+        x, y = self.field.positions[self.index]
+        return Vector2(float(x), float(y))
+
+
+    @position.setter
+    def position(self, position):
+        self.field.positions[self.index] = (position[0], position[1])
+
+
+    @property
+    def previous_position(self):
+        x, y = self.field.previous_positions[self.index]
+        return Vector2(float(x), float(y))
+
+
+    @previous_position.setter
+    def previous_position(self, position):
+        self.field.previous_positions[self.index] = (position[0], position[1])
+
+
+    @property
+    def velocity(self):
+        x, y = self.field.velocities[self.index]
+        return Vector2(float(x), float(y))
+
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self.field.velocities[self.index] = (velocity[0], velocity[1])
+
+
+    @property
+    def radius(self):
+        return int(self.field.radii[self.index])
+
+
+    @radius.setter
+    def radius(self, radius):
+        self.field.radii[self.index] = radius
+
+
+    @property
+    def colour(self):
+        return tuple(int(c) for c in self.field.colours[self.index])
+
+
+    @colour.setter
+    def colour(self, colour):
+        self.field.colours[self.index] = colour
+
+
+class RockField(object):
+    '''A collection of rocks stored as a structure of arrays.
+
+    Rather than one Rock object per rock, a RockField keeps the state
+    of all its rocks in contiguous NumPy arrays:
+       - positions of rock centres (float array of shape (n, 2))
+       - velocities (float array of shape (n, 2))
+       - radii (integer array of shape (n,))
+       - colours (unsigned byte array of shape (n, 3))
+
+    This lets the rocks be moved and tested for collisions with a few
+    vectorized operations, instead of a Python loop over every rock.
+    The order of the rocks is preserved when rocks are removed, so a
+    RockField can be used wherever a list of rocks was used before.
+
+    Indexing or iterating over a RockField yields RockView objects.
+    '''
+    def __init__(self, capacity=64):
+        self.count = 0
+        self._positions = np.zeros((capacity, 2))
+        self._previous_positions = np.zeros((capacity, 2))
+        self._velocities = np.zeros((capacity, 2))
+        self._radii = np.zeros(capacity, dtype=np.int64)
+        self._colours = np.zeros((capacity, 3), dtype=np.uint8)
+
+
+    @property
+    def positions(self):
+        return self._positions[:self.count]
+
+
+    @property
+    def previous_positions(self):
+        return self._previous_positions[:self.count]
+
+
+    @property
+    def velocities(self):
+        return self._velocities[:self.count]
+
+
+    @property
+    def radii(self):
+        return self._radii[:self.count]
+
+
+    @property
+    def colours(self):
+        return self._colours[:self.count]
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('rock index out of range')
+        return RockView(self, index)
+
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield RockView(self, index)
+
+
+    def _reserve(self, capacity):
+        '''Make sure there is room for at least capacity rocks.
+        The arrays grow by doubling so that adding rocks is cheap on
+        average.'''
+        old_capacity = len(self._radii)
+        if capacity <= old_capacity:
+            return
+        new_capacity = max(capacity, 2 * old_capacity)
+        for name in ('_positions', '_previous_positions', '_velocities',
+                '_radii', '_colours'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+
+    def add(self, positions, velocities, radii, colours):
+        '''Add a batch of rocks to the end of the field. The arguments
+        are array-like with one entry per new rock.'''
+        radii = np.asarray(radii)
+        num_rocks = len(radii)
+        if num_rocks == 0:
+            return
+        start = self.count
+        end = start + num_rocks
+        self._reserve(end)
+        self._positions[start:end] = positions
+        # New rocks have not moved yet.
+        self._previous_positions[start:end] = positions
+        self._velocities[start:end] = velocities
+        self._radii[start:end] = radii
+        self._colours[start:end] = colours
+        self.count = end
+
+
+    def extend(self, rocks):
+        '''Add a list of Rock objects to the end of the field, such
+        as those returned by spawn_offscreen_rocks and
+        spawn_rocks_explosion.'''
+        if not rocks:
+            return
+        self.add([(rock.position.x, rock.position.y) for rock in rocks],
+            [(rock.velocity.x, rock.velocity.y) for rock in rocks],
+            [rock.radius for rock in rocks],
+            [rock.colour for rock in rocks])
+
+
+    def append(self, rock):
+        '''Add a single Rock object to the end of the field.'''
+        self.extend([rock])
+
+
+    def remove(self, indices):
+        '''Remove the rocks at the given indices (or where the given
+        boolean mask is True). The remaining rocks keep their order.'''
+        keep = np.ones(self.count, dtype=bool)
+        keep[indices] = False
+        num_kept = int(np.count_nonzero(keep))
+        for values in (self._positions, self._previous_positions,
+                self._velocities, self._radii, self._colours):
+            values[:num_kept] = values[:self.count][keep]
+        self.count = num_kept
+
+
+    def clear(self):
+        '''Remove all the rocks from the field.'''
+        self.count = 0
+
+
+    def copy(self):
+        '''Return a new RockField holding a copy of the rocks.'''
+        field = RockField(max(self.count, 1))
+        field.load(self.positions, self.previous_positions, self.velocities,
+            self.radii, self.colours)
+        return field
+
+
+    def load(self, positions, previous_positions, velocities, radii,
+            colours):
+        '''Replace all the rocks in the field with the given ones. Unlike
+        add, the previous positions of the rocks are given too.'''
+        num_rocks = len(radii)
+        self.count = 0
+        self._reserve(num_rocks)
+        self._positions[:num_rocks] = positions
+        self._previous_positions[:num_rocks] = previous_positions
+        self._velocities[:num_rocks] = velocities
+        self._radii[:num_rocks] = radii
+        self._colours[:num_rocks] = colours
+        self.count = num_rocks
+
+
+    def pack(self):
+        '''Return the state of the rocks as bytes: the positions,
+        previous positions and velocities as little endian doubles, the
+        radii as little endian 64 bit integers and the colours as bytes,
+        each array in turn.'''
+        return b''.join((self.positions.astype('<f8', copy=False).tobytes(),
+            self.previous_positions.astype('<f8', copy=False).tobytes(),
+            self.velocities.astype('<f8', copy=False).tobytes(),
+            self.radii.astype('<i8', copy=False).tobytes(),
+            self.colours.tobytes()))
+
+
+    def unpack(self, data, offset, num_rocks):
+        '''Replace the rocks with num_rocks rocks packed by pack, starting
+        at offset in data. Returns the offset of the end of the rocks.'''
+        arrays = []
+        for dtype, width in (('<f8', 2), ('<f8', 2), ('<f8', 2), ('<i8', 1),
+                ('u1', 3)):
+            array = np.frombuffer(data, dtype, num_rocks * width, offset)
+            offset += array.nbytes
+            arrays.append(array.reshape(num_rocks, width) if width > 1
+                else array)
+        self.load(*arrays)
+        return offset
+
+
+    def move(self):
+        '''Move every rock by its velocity. Rocks which cross the edge
+        of the screen move to the opposite side, following the same
+        rule as GameObject.move.'''
+        positions = self.positions
+        self.previous_positions[:] = positions
+        positions += self.velocities
+        wrap_positions(positions)
+
+
+    def contains(self, point, candidates=None):
+        '''Return a boolean array which is True for each rock whose
+        circle contains the point. If candidates (an array of rock
+        indices) is given then only those rocks are tested, and the
+        result has one entry per candidate.'''
+        positions = self.positions
+        radii = self.radii
+        if candidates is not None:
+            positions = positions[candidates]
+            radii = radii[candidates]
+        delta = positions - (point[0], point[1])
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        return distance <= radii
+
+
+    def contains_points(self, points, candidates=None):
+        '''Test many points at once. Returns a boolean array of shape
+        (p, c) for p points (an array of shape (p, 2)) and c rocks (or
+        candidates, if an array of rock indices is given), which is True
+        where the point is inside the rock, as for contains.'''
+        positions = self.positions
+        radii = self.radii
+        if candidates is not None:
+            positions = positions[candidates]
+            radii = radii[candidates]
+        delta = (positions[np.newaxis, :, :]
+            - np.asarray(points, dtype=float)[:, np.newaxis, :])
+        # This runs several times a time step, so the square root is
+        # taken in place rather than into another temporary array.
+        distance = np.einsum('pck,pck->pc', delta, delta)
+        np.sqrt(distance, out=distance)
+        return distance <= radii
+
+
+    def first_hit(self, point, candidates=None):
+        '''Return the index of the first rock whose circle contains
+        the point, or -1 if there is no such rock. If candidates (an
+        array of rock indices in increasing order) is given then only
+        those rocks are considered.'''
+        if self.count == 0:
+            return -1
+        hits = np.flatnonzero(self.contains(point, candidates))
+        if len(hits) == 0:
+            return -1
+        if candidates is not None:
+            return int(candidates[hits[0]])
+        return int(hits[0])
+
+
+    def any_hit(self, points, candidates=None):
+        '''Return True if any of the points is inside any of the rocks.
+        If candidates (an array of rock indices) is given then only
+        those rocks are considered.'''
+        if self.count == 0:
+            return False
+        return bool(self.contains_points(points, candidates).any())
+
+
+    def segment_hit_times(self, starts, ends, candidates=None):
+        '''Sweep points along line segments and find when each one first
+        touches each rock. The segments go from starts to ends (arrays
+        of shape (p, 2)). Returns an array of shape (p, c), where c is
+        the number of rocks (or of candidates, if an array of rock
+        indices is given), holding the fraction of the way along each
+        segment at which it enters each rock's circle. A segment which
+        starts inside a circle enters it at 0, and one which never
+        touches a circle has the value infinity.'''
+        positions = self.positions
+        radii = self.radii
+        if candidates is not None:
+            positions = positions[candidates]
+            radii = radii[candidates]
+        starts = np.asarray(starts, dtype=float)[:, np.newaxis, :]
+        direction = np.asarray(ends, dtype=float)[:, np.newaxis, :] - starts
+        # Solve |start + t * direction - centre|^2 = radius^2 for t.
+        offset = starts - positions[np.newaxis, :, :]
+        a = np.einsum('pck,pck->pc', direction, direction)
+        b = 2.0 * np.einsum('pck,pck->pc', offset, direction)
+        c = np.einsum('pck,pck->pc', offset, offset) - radii ** 2
+        discriminant = b * b - 4.0 * a * c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entry = (-b - np.sqrt(discriminant)) / (2.0 * a)
+        times = np.full(c.shape, np.inf)
+        crossing = (discriminant >= 0) & (a > 0) & (entry >= 0) & (entry <= 1)
+        times[crossing] = entry[crossing]
+        # Segments that start inside a circle hit it straight away.
+        times[c <= 0] = 0.0
+        return times
+
+
+    def collision_pairs(self):
+        '''Find the pairs of rocks which overlap. Returns a pair of
+        arrays (first, second) of rock indices, with first < second.
+
+        The rocks are found with sort and sweep along the X axis: every
+        rock covers the interval from x - radius to x + radius, and after
+        sorting the intervals by their left ends, each rock only needs to
+        be compared with the following rocks whose intervals start before
+        its own interval ends. Rocks near the left edge of the screen are
+        also swept as copies one screen width to the right, so that rocks
+        touching across the edge are found. Distances between rocks are
+        measured the short way around the screen in both directions.
+
+        With fewer than SWEEP_MIN_ROCKS rocks every pair is tested.'''
+        count = self.count
+        positions = self.positions
+        radii = self.radii
+        if count < SWEEP_MIN_ROCKS:
+            x = positions[:, 0]
+            y = positions[:, 1]
+            dx = np.abs(x[:, np.newaxis] - x)
+            dy = np.abs(y[:, np.newaxis] - y)
+            # The short way around the screen.
+            dx = np.minimum(dx, MAX_X - dx)
+            dy = np.minimum(dy, MAX_Y - dy)
+            reach = radii[:, np.newaxis] + radii
+            first, second = np.nonzero(dx * dx + dy * dy < reach * reach)
+            upper = first < second
+            return first[upper], second[upper]
+        x = positions[:, 0]
+        # A rock can touch a rock across the left edge only if it is
+        # within its own radius plus the largest radius of the edge.
+        copies = np.flatnonzero(x < radii + radii.max())
+        ids = np.concatenate((np.arange(count), copies))
+        is_copy = np.concatenate((np.zeros(count, dtype=bool),
+            np.ones(len(copies), dtype=bool)))
+        centres = np.concatenate((x, x[copies] + MAX_X))
+        reaches = radii[ids]
+        lefts = centres - reaches
+        rights = centres + reaches
+        order = np.argsort(lefts, kind='stable')
+        lefts = lefts[order]
+        rights = rights[order]
+        # Sweep: the intervals which overlap interval i in sorted order
+        # are the ones from i + 1 up to (but not including) ends[i].
+        ends = np.searchsorted(lefts, rights, side='right')
+        counts = ends - np.arange(len(order)) - 1
+        first = np.repeat(np.arange(len(order)), counts)
+        second = (first + 1 + np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts))
+        first = order[first]
+        second = order[second]
+        # Test whether the circles overlap. The copies make the X offset
+        # the short way around already; the Y offset is wrapped here.
+        dx = centres[second] - centres[first]
+        dy = positions[ids[second], 1] - positions[ids[first], 1]
+        dy[dy > MAX_Y / 2] -= MAX_Y
+        dy[dy < -MAX_Y / 2] += MAX_Y
+        reach = reaches[first] + reaches[second]
+        # Two copies overlap only if their original rocks also do.
+        touching = ((dx * dx + dy * dy < reach * reach)
+            & ~(is_copy[first] & is_copy[second]))
+        first = ids[first[touching]]
+        second = ids[second[touching]]
+        return np.minimum(first, second), np.maximum(first, second)
+
+
+    def wrapped_delta(self, first, second):
+        '''Return the offsets from the rocks with indices first to the
+        rocks with indices second, the short way around the screen.'''
+        delta = self.positions[second] - self.positions[first]
+        for axis, size in enumerate((MAX_X, MAX_Y)):
+            offset = delta[:, axis]
+            offset[offset > size / 2] -= size
+            offset[offset < -size / 2] += size
+        return delta
+
+
+    def collide(self):
+        '''Make rocks which overlap and are moving towards each other
+        bounce apart in elastic collisions. The mass of a rock is given
+        by rock_mass. Returns the number of collisions.
+
+        Each collision pushes its two rocks apart with equal and opposite
+        impulses, so momentum is always conserved. A pair of rocks which
+        touch nothing else bounce exactly as elastic discs do, conserving
+        kinetic energy. When a rock is in several collisions at once,
+        adding up the full impulses of all of them could create energy,
+        so every collision's impulse is divided by the largest number of
+        collisions that either of its rocks is in. Rocks in a dense crowd
+        therefore lose some energy rather than gaining it.'''
+        first, second = self.collision_pairs()
+        if len(first) == 0:
+            return 0
+        velocities = self.velocities
+        delta = self.wrapped_delta(first, second)
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        # Rocks at exactly the same place have no line between their
+        # centres to bounce along, and are left alone.
+        apart = distance > 0
+        first = first[apart]
+        second = second[apart]
+        normal = delta[apart] / distance[apart, np.newaxis]
+        # The speed at which the first rock approaches the second, along
+        # the line between their centres. Rocks moving apart are left
+        # alone, so that overlapping rocks do not stick together.
+        approach = np.einsum('ij,ij->i',
+            velocities[first] - velocities[second], normal)
+        colliding = approach > 0
+        first = first[colliding]
+        second = second[colliding]
+        normal = normal[colliding]
+        approach = approach[colliding]
+        if len(first) == 0:
+            return 0
+        num_collisions = np.bincount(np.concatenate((first, second)),
+            minlength=self.count)
+        share = 1.0 / np.maximum(num_collisions[first],
+            num_collisions[second])
+        first_mass = rock_mass(self.radii[first]).astype(float)
+        second_mass = rock_mass(self.radii[second]).astype(float)
+        # The impulse of an elastic collision between two discs.
+        impulse = (2.0 * first_mass * second_mass / (first_mass + second_mass)
+            * approach * share)[:, np.newaxis] * normal
+        np.subtract.at(velocities, first, impulse / first_mass[:, np.newaxis])
+        np.add.at(velocities, second, impulse / second_mass[:, np.newaxis])
+        return len(first)
+
+
+class UniformGrid(object):
+    '''A uniform grid over the screen, used as a broadphase for collision
+    tests against rocks.
+
+    The screen is divided into columns and rows of equal sized cells.
+    Each rock is recorded in every cell that its bounding box overlaps.
+    A query returns the indices of the rocks recorded in the cells that
+    the query shape overlaps. These are the only rocks which could touch
+    the shape, so the exact (narrowphase) test need only be applied to
+    them.
+
+    The grid wraps around at the edges of the screen in the same way
+    that GameObject.move does: cell coordinates are taken modulo the
+    number of columns and rows. A rock which straddles an edge of the
+    screen, or which is just outside it, is therefore recorded in the
+    cells on both sides, and a query near one edge also finds rocks
+    near the opposite edge. Queries may return rocks which do not
+    touch the shape, but never miss one which does.
+
+    The grid is rebuilt from the rock arrays with build, which costs
+    O(n log n) for n rocks using vectorized operations.
+    '''
+    def __init__(self, cell_size=MAX_ROCK_RADIUS):
+        # Choose cell sizes that divide the screen exactly, so that
+        # the cell coordinates wrap around consistently.
+        self.num_cols = max(1, int(MAX_X // cell_size))
+        self.num_rows = max(1, int(MAX_Y // cell_size))
+        self.cell_width = MAX_X / float(self.num_cols)
+        self.cell_height = MAX_Y / float(self.num_rows)
+        num_cells = self.num_cols * self.num_rows
+        # The rocks in cell c are cell_items[cell_start[c]:cell_start[c+1]],
+        # in increasing order of rock index.
+        self.cell_start = np.zeros(num_cells + 1, dtype=np.int64)
+        self.cell_items = np.zeros(0, dtype=np.int64)
+
+
+    def _col_range(self, low, high):
+        '''Unwrapped column numbers of the cells spanning [low, high].'''
+        first = np.floor(np.asarray(low) / self.cell_width).astype(np.int64)
+        last = np.floor(np.asarray(high) / self.cell_width).astype(np.int64)
+        return first, np.minimum(last - first + 1, self.num_cols)
+
+
+    def _row_range(self, low, high):
+        '''Unwrapped row numbers of the cells spanning [low, high].'''
+        first = np.floor(np.asarray(low) / self.cell_height).astype(np.int64)
+        last = np.floor(np.asarray(high) / self.cell_height).astype(np.int64)
+        return first, np.minimum(last - first + 1, self.num_rows)
+
+
+    def build(self, positions, radii):
+        '''Rebuild the grid for rocks with the given centre positions
+        (an array of shape (n, 2)) and radii (an array of shape (n,)).'''
+        num_rocks = len(radii)
+        num_cells = self.num_cols * self.num_rows
+        if num_rocks == 0:
+            self.cell_start = np.zeros(num_cells + 1, dtype=np.int64)
+            self.cell_items = np.zeros(0, dtype=np.int64)
+            return
+        x = positions[:, 0]
+        y = positions[:, 1]
+        first_col, num_cols = self._col_range(x - radii, x + radii)
+        first_row, num_rows = self._row_range(y - radii, y + radii)
+        # Each rock covers a small rectangle of cells. Generate one
+        # (rock, cell) pair for every cell of every rectangle.
+        counts = num_cols * num_rows
+        rock_index = np.repeat(np.arange(num_rocks), counts)
+        offsets = np.arange(len(rock_index)) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        width = num_cols[rock_index]
+        col = (first_col[rock_index] + offsets % width) % self.num_cols
+        row = (first_row[rock_index] + offsets // width) % self.num_rows
+        cell = row * self.num_cols + col
+        # Group the pairs by cell. The sort is stable, so the rocks in
+        # each cell stay in increasing order of index.
+        order = np.argsort(cell, kind='stable')
+        self.cell_items = rock_index[order]
+        self.cell_start[0] = 0
+        np.cumsum(np.bincount(cell, minlength=num_cells),
+            out=self.cell_start[1:])
+
+
+    def query_point(self, point):
+        '''Return the indices (in increasing order) of the rocks which
+        could contain the point.'''
+        col = int(point[0] // self.cell_width) % self.num_cols
+        row = int(point[1] // self.cell_height) % self.num_rows
+        cell = row * self.num_cols + col
+        return self.cell_items[self.cell_start[cell]:self.cell_start[cell + 1]]
+
+
+    def query_box(self, min_x, min_y, max_x, max_y):
+        '''Return the indices (in increasing order, without repeats) of
+        the rocks which could touch the axis aligned box.'''
+        first_col, num_cols = self._col_range(min_x, max_x)
+        first_row, num_rows = self._row_range(min_y, max_y)
+        slices = []
+        for row_offset in range(int(num_rows)):
+            row = (int(first_row) + row_offset) % self.num_rows
+            for col_offset in range(int(num_cols)):
+                col = (int(first_col) + col_offset) % self.num_cols
+                cell = row * self.num_cols + col
+                slices.append(self.cell_items[
+                    self.cell_start[cell]:self.cell_start[cell + 1]])
+        if len(slices) == 1:
+            return slices[0]
+        return np.unique(np.concatenate(slices))
+
+
+    def query_segment(self, start, end):
+        '''Return the indices of the rocks which could touch the line
+        segment from start to end.'''
+        return self.query_box(min(start[0], end[0]), min(start[1], end[1]),
+            max(start[0], end[0]), max(start[1], end[1]))
+
+
+    def query_triangle(self, points):
+        '''Return the indices of the rocks which could touch the triangle
+        with the given three corner points.'''
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        return self.query_box(min(xs), min(ys), max(xs), max(ys))
 
 
 class Bullet(GameObject):
@@ -190,7 +980,12 @@ class Bullet(GameObject):
 
     Bullets keep moving with the same velocity (direction and
     speed) while they are alive.
+
+    A bullet which has died can be fired again with reset, which
+    reuses its vectors instead of allocating new ones (see World).
     '''
+    __slots__ = ('direction', 'age')
+
     def __init__(self, position, direction):
         norm_direction = direction.normalize()
         velocity = norm_direction * BULLET_SPEED
@@ -199,17 +994,66 @@ class Bullet(GameObject):
         self.age = 0
 
 
-    def draw(self, windowSurface):
-        '''Draw a bullet at its current position on the supplied
-        windowSurface. Bullets are drawn as line segments.
-        The start of the line is the current position of the bullet.
+    def copy(self):
+        '''Return a copy of the bullet which shares no vectors with it.'''
+        bullet = Bullet(self.position, self.direction)
+        bullet.load(self.position, self.previous_position, self.direction,
+            self.velocity, self.age)
+        return bullet
+
+
+    def load(self, position, previous_position, direction, velocity, age):
+        '''Set the whole state of the bullet exactly, reusing its
+        vectors. Each vector argument may be a Vector2 or an (x, y)
+        pair.'''
+        self.position.update(position)
+        self.previous_position.update(previous_position)
+        self.direction.update(direction)
+        self.velocity.update(velocity)
+        self.age = age
+
+
+    def reset(self, position, direction):
+        '''Make this bullet a newly fired bullet at the given position
+        travelling in the given direction, as if it had just been
+        constructed.'''
+        self.position.update(position)
+        self.previous_position.update(position)
+        self.direction.update(direction)
+        self.direction.normalize_ip()
+        self.velocity.update(self.direction)
+        self.velocity *= BULLET_SPEED
+        self.age = 0
+
+
+    def front(self):
+        '''Return the (x, y) coordinates of the front of the bullet,
+        which is BULLET_LENGTH units from its position in the direction
+        that it is travelling.'''
+        position = self.position
+        direction = self.direction
+        return (position.x + direction.x * BULLET_LENGTH,
+            position.y + direction.y * BULLET_LENGTH)
+
+
+    def draw(self, windowSurface, position=None):
+        '''Draw a bullet at its current position (or the given position
+        if there is one) on the supplied windowSurface. Bullets are
+        drawn as line segments.
+        The start of the line is the position of the bullet.
         The end of the line is BULLET_LENGTH units away in the
         the direction that the bullet is travelling.
+        Returns the rectangle of the surface that was drawn on.
         '''
-        start_pos = (self.position.x, self.position.y)
-        end_pos_vec = self.position + self.direction * BULLET_LENGTH
-        end_pos = (end_pos_vec.x, end_pos_vec.y) 
-        pygame.draw.line(windowSurface, RED, start_pos, end_pos, BULLET_WIDTH)
+        if position is None:
+            start_pos = (self.position.x, self.position.y)
+            end_pos = self.front()
+        else:
+            start_pos = (position.x, position.y)
+            end_pos_vec = position + self.direction * BULLET_LENGTH
+            end_pos = (end_pos_vec.x, end_pos_vec.y)
+        return pygame.draw.line(windowSurface, RED, start_pos, end_pos,
+            BULLET_WIDTH)
 
 
     def time_step(self):
@@ -253,21 +1097,43 @@ class SpaceShip(GameObject):
     Space ships can rotate on the spot. Their angle of rotation
     affects their velocity if they try to accelerate. Zero degrees is
     facing upwards.
+
+    The points of the triangle are computed at most once for each
+    position and rotation of the ship, and shared by collision tests
+    and drawing.
     '''
+    __slots__ = ('rotation', 'size_major', 'size_minor', '_points',
+        '_points_key')
+
     def __init__(self, position, rotation, speed, size_major, size_minor):
         velocity = Vector2(speed,0).rotate(rotation)
         super(SpaceShip, self).__init__(position, velocity)
         self.rotation = rotation # degrees
         self.size_major = size_major 
         self.size_minor = size_minor
-
-
-    def draw(self, windowSurface):
-        '''Draw a space ship at its current position on the supplied
-        windowSurface. Space ships are drawn as triangles.
+        # The most recently computed points of the triangle, and the
+        # (x, y, rotation) they were computed for.
+        self._points = None
+        self._points_key = None
+
+
+    def copy(self):
+        '''Return a copy of the ship which shares no vectors with it.'''
+        ship = SpaceShip(self.position, self.rotation, 0, self.size_major,
+            self.size_minor)
+        ship.previous_position.update(self.previous_position)
+        ship.velocity = Vector2(self.velocity)
+        return ship
+
+
+    def draw(self, windowSurface, position=None):
+        '''Draw a space ship at its current position (or the given
+        position if there is one) on the supplied windowSurface. Space
+        ships are drawn as triangles.
+        Returns the rectangle of the surface that was drawn on.
         '''
         # Draw the triangle on the display.
-        pygame.draw.polygon(windowSurface, BLUE, self.points())
+        return pygame.draw.polygon(windowSurface, BLUE, self.points(position))
 
 
     def turn_left(self, angle):
@@ -304,10 +1170,23 @@ class SpaceShip(GameObject):
         self.velocity = new_velocity
 
 
-    def points(self):
+    def points(self, position=None):
         '''Compute the coordinates of the three points on the triangle
-        which defines the sprite for the ship.'''
-        position = self.position
+        which defines the sprite for the ship. The triangle is centred
+        on the ship's position, or on the given position if there
+        is one.'''
+        if position is None:
+            position = self.position
+            key = (position.x, position.y, self.rotation)
+            if key != self._points_key:
+                self._points = self._compute_points(position)
+                self._points_key = key
+            return self._points
+        return self._compute_points(position)
+
+
+    def _compute_points(self, position):
+        '''Compute the points of the triangle centred on position.'''
         size_major = self.size_major
         size_minor = self.size_minor
         rotation = self.rotation
@@ -345,16 +1224,18 @@ def is_inside_circle(point, center, radius):
     return point.distance_to(center) <= radius
 
 
-def random_colour():
+def random_colour(rng=random):
     '''Generate a random RGB colour which is not too dark.
     The range of intensity values of each colour channel are fairly
     arbitrary. The colours are used for newly spawned rocks, so
     all we care about is whether they look reasonbly good.
+    The rng argument is the source of randomness, which defaults
+    to the global random module.
     '''
-    return (randint(100, 255), randint(50, 150), randint(50, 100))
+    return (rng.randint(100, 255), rng.randint(50, 150), rng.randint(50, 100))
 
 
-def spawn_rock(position, min_radius, max_radius):
+def spawn_rock(position, min_radius, max_radius, rng=random):
     '''Spawn a new rock at a specified position
     with a radius randomly chosen between min_radius
     and max_radius.
@@ -362,18 +1243,18 @@ def spawn_rock(position, min_radius, max_radius):
     random colour.
     '''
     # Choose the radius of the new rock.
-    radius = choice(range(min_radius, max_radius, ROCK_RADIUS_SIZE_STEP))
+    radius = rng.choice(range(min_radius, max_radius, ROCK_RADIUS_SIZE_STEP))
     # Compute a random velocity for the rock.
-    angle = randint(0, 359)
+    angle = rng.randint(0, 359)
     direction_vector = Vector2(1, 0).rotate(angle)
-    speed = randint(MIN_ROCK_SPEED, MAX_ROCK_SPEED)
+    speed = rng.randint(MIN_ROCK_SPEED, MAX_ROCK_SPEED)
     velocity = direction_vector * speed
     # Choose a random colour for the rock.
-    colour = random_colour() 
+    colour = random_colour(rng)
     return Rock(position, velocity, radius, colour)
 
 
-def spawn_offscreen_rocks(num_rocks):
+def spawn_offscreen_rocks(num_rocks, rng=random):
     '''Spawn rocks which start life outside the screen.
     Sometimes we want to spawn new rocks that will start outside the
     bounds of the screen, and eventually move into the bounds.
@@ -393,37 +1274,56 @@ def spawn_offscreen_rocks(num_rocks):
     x_pos = -MAX_ROCK_RADIUS / 2
     for _count in range(0, num_rocks // 2):
         # The Y position is randomly chosen from the screen Y coordinates.
-        y_pos = randint(0, MAX_Y - 1)
+        y_pos = rng.randint(0, MAX_Y - 1)
         position = Vector2(x_pos, y_pos)
-        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS)
+        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS, rng)
         rocks.append(new_rock)
 
     # initialise rocks off to the negative Y side of the window
     y_pos = -MAX_ROCK_RADIUS / 2
     for _count in range(num_rocks // 2, num_rocks):
         # The X position is randomly chosen from the screen X coordinates.
-        x_pos = randint(0, MAX_X - 1) 
+        x_pos = rng.randint(0, MAX_X - 1) 
         position = Vector2(x_pos, y_pos)
-        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS)
+        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS, rng)
         rocks.append(new_rock)
     return rocks
 
 
-def spawn_rocks_explosion(exploding_rock):
+def spawn_rocks_explosion(exploding_rock, rng=random):
     '''Spawn new rocks at the point where a rock explodes from being
     hit by a bullet. A small random number of new rocks are created
     which are no larger than the exploded rock.
+
+    The explosion conserves the momentum of the exploded rock. Each new
+    rock is given a random velocity, and then all of them are given the
+    same extra velocity so that their total momentum (with masses from
+    rock_mass) is the momentum of the exploded rock. If the new rocks
+    are lighter than the exploded rock, the rest of its mass is taken
+    to be dust which carries away its share of the momentum, so the
+    new rocks never move faster together than the exploded rock did.
     '''
     # Choose a small random number of new rocks to create.
-    num_new_rocks = randint(MIN_SPAWN_EXPLODE_ROCKS, MAX_SPAWN_EXPLODE_ROCKS)
+    num_new_rocks = rng.randint(MIN_SPAWN_EXPLODE_ROCKS,
+        MAX_SPAWN_EXPLODE_ROCKS)
     rocks = []
     # The spawned rocks are created in the same place where the exploded
     # rock was.
     position = exploding_rock.position
     max_radius = exploding_rock.radius
     for _count in range(num_new_rocks):
-        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, max_radius)
+        new_rock = spawn_rock(position, MIN_ROCK_RADIUS, max_radius, rng)
         rocks.append(new_rock)
+    # Share out the momentum which the random velocities do not account
+    # for.
+    exploding_mass = rock_mass(exploding_rock.radius)
+    total_mass = sum(rock_mass(rock.radius) for rock in rocks)
+    momentum = exploding_rock.velocity * min(exploding_mass, total_mass)
+    for rock in rocks:
+        momentum -= rock.velocity * rock_mass(rock.radius)
+    extra_velocity = momentum / total_mass
+    for rock in rocks:
+        rock.velocity += extra_velocity
     return rocks
 
 
@@ -432,31 +1332,255 @@ def press_return_or_escape():
     the game, or to press the escape key to quit. Also
     terminate the game if the QUIT event occurs.'''
     while True:
-        for event in pygame.event.get():
-            # QUIT event terminates the game.
-            # The QUIT event occurs if the player closes
-            # the game window.
-            if event.type == QUIT:
+        # Sleep until there is an event, rather than polling, so that
+        # resources can load in the background meanwhile.
+        event = pygame.event.wait()
+        # QUIT event terminates the game.
+        # The QUIT event occurs if the player closes
+        # the game window.
+        if event.type == QUIT:
+            terminate()
+        if event.type == KEYDOWN:
+            # Escape key quits the game.
+            if event.key == K_ESCAPE:
                 terminate()
-            if event.type == KEYDOWN:
-                # Escape key quits the game.
-                if event.key == K_ESCAPE:
-                    terminate()
-                # Return key allows game to start.
-                elif event.key == K_RETURN:
-                    return
+            # Return key allows game to start.
+            elif event.key == K_RETURN:
+                return
+
+
+def init_pygame():
+    '''Initialise the parts of pygame that the game uses: the display
+    (which includes the event queue) and fonts. This is quicker than
+    pygame.init, which also starts sound, joysticks and so on.'''
+    pygame.display.init()
+    pygame.font.init()
+
+
+class FontRegistry(object):
+    '''The fonts used by the game, keyed by size. Loading a font is
+    slow, so each font is loaded only once, normally at startup by
+    calling load.
+
+    The game uses pygame's default font. It is loaded directly, rather
+    than with pygame.font.SysFont, which would search all the fonts
+    installed on the system before falling back to the default.
+    Fonts may be loaded by a background thread (see BackgroundLoader)
+    while others are in use.'''
+    def __init__(self):
+        self.fonts = {}
+
+
+    def load(self, *sizes):
+        '''Load the default font at each of the given sizes.'''
+        for size in sizes:
+            self.get(size)
+
+
+    def get(self, size):
+        '''Return the default font at the given size, loading it if it
+        has not been loaded before.'''
+        font = self.fonts.get(size)
+        if font is None:
+            font = pygame.font.Font(None, size)
+            self.fonts[size] = font
+        return font
+
+
+class TextCache(object):
+    '''A cache of rendered text surfaces, keyed by (font, text, colour).
+    Rendering text is slow, so text that is drawn on every frame (such
+    as the score) is only rendered again when it changes. When the cache
+    holds more than max_size surfaces the least recently used one
+    is discarded.'''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+
+    def render(self, font, text, colour):
+        '''Return a surface with the text rendered in the font and
+        colour, reusing a cached surface if there is one.'''
+        key = (font, text, colour)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            # Mark this surface as the most recently used.
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = font.render(text, 1, colour)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            # Discard the least recently used surface.
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+class SpriteCache(object):
+    '''Pre-rendered sprites for the rocks and the space ship.
+
+    Drawing a circle or a polygon on every frame is slower than copying
+    (blitting) a surface that already holds the shape. Rock sprites are
+    rendered on demand for each (radius, colour) pair and kept in a
+    cache; when the cache holds more than max_rocks sprites the least
+    recently used one is discarded. Ship sprites are rendered for every
+    whole degree of rotation the first time a ship of a given size is
+    drawn (the ship rotation atlas).
+
+    Sprites use black as the transparent colour, so they can overlap
+    each other on the black background.
+    '''
+    def __init__(self, max_rocks=ROCK_SPRITE_CACHE_SIZE):
+        self.max_rocks = max_rocks
+        self.rocks = OrderedDict()
+        self.ship_atlases = {}
+
+
+    def rock_sprite(self, radius, colour):
+        '''Return the sprite for a rock with the given radius and
+        colour. The rock centre is at (radius + 1, radius + 1) in
+        the sprite.'''
+        key = (radius, colour)
+        sprite = self.rocks.get(key)
+        if sprite is not None:
+            # Mark this sprite as the most recently used.
+            self.rocks.move_to_end(key)
+            return sprite
+        size = 2 * radius + 2
+        sprite = pygame.Surface((size, size))
+        sprite.fill(BLACK)
+        pygame.draw.circle(sprite, colour, (radius + 1, radius + 1), radius)
+        sprite.set_colorkey(BLACK, pygame.RLEACCEL)
+        self.rocks[key] = sprite
+        if len(self.rocks) > self.max_rocks:
+            # Discard the least recently used sprite.
+            self.rocks.popitem(last=False)
+        return sprite
+
+
+    def draw_rock(self, window_surface, center, radius, colour):
+        '''Draw a rock with its centre at the given integer coordinates.
+        Returns the rectangle of the surface that was drawn on.'''
+        sprite = self.rock_sprite(radius, colour)
+        return window_surface.blit(sprite,
+            (center[0] - radius - 1, center[1] - radius - 1))
+
+
+    def ship_atlas(self, size_major, size_minor):
+        '''Return the list of 360 ship sprites, one per degree of
+        rotation, for a ship of the given size. The ship centre is in
+        the middle of each sprite.'''
+        key = (size_major, size_minor)
+        atlas = self.ship_atlases.get(key)
+        if atlas is None:
+            half = max(size_major, size_minor) + 1
+            atlas = []
+            for rotation in range(360):
+                sprite = pygame.Surface((2 * half, 2 * half))
+                sprite.fill(BLACK)
+                points = [(half + offset.x, half + offset.y) for offset in (
+                    Vector2(size_major, 0).rotate(rotation),
+                    Vector2(size_minor, 0).rotate(rotation + 120),
+                    Vector2(size_minor, 0).rotate(rotation + 240))]
+                pygame.draw.polygon(sprite, BLUE, points)
+                sprite.set_colorkey(BLACK, pygame.RLEACCEL)
+                atlas.append(sprite)
+            self.ship_atlases[key] = atlas
+        return atlas
+
+
+    def draw_ship(self, window_surface, ship, position=None):
+        '''Draw a space ship using the sprite for its nearest whole
+        degree of rotation, centred on the ship's position or on the
+        given position if there is one. Returns the rectangle of the
+        surface that was drawn on.'''
+        if position is None:
+            position = ship.position
+        atlas = self.ship_atlas(ship.size_major, ship.size_minor)
+        sprite = atlas[int(round(ship.rotation)) % 360]
+        half = sprite.get_width() // 2
+        return window_surface.blit(sprite,
+            (int(position.x) - half, int(position.y) - half))
+
+
+class BackgroundLoader(object):
+    '''Run functions which load resources in a background thread, so
+    that the game can show its first screen without waiting for them.
+    Call wait before using the resources.'''
+    def __init__(self, *tasks):
+        self.tasks = tasks
+        self.error = None
+        self.thread = threading.Thread(target=self._run,
+            name='resource loader', daemon=True)
+        self.thread.start()
+
+
+    def _run(self):
+        '''Run each task in turn, stopping at the first error.'''
+        try:
+            for task in self.tasks:
+                task()
+        except Exception as error:
+            self.error = error
+
+
+    def wait(self):
+        '''Wait for all the tasks to finish. Raises the error raised by
+        a task, if there was one.'''
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class StartupTimer(object):
+    '''Record the time at which each stage of starting the game
+    finishes, measured from START_TIME.'''
+    def __init__(self, start=START_TIME):
+        self.start = start
+        self.stages = []
+
+
+    def mark(self, stage):
+        '''Record that a stage has finished.'''
+        self.stages.append((stage, time.perf_counter()))
+
+
+    def report(self):
+        '''Return the time of each stage as lines of text.'''
+        lines = []
+        previous = self.start
+        for stage, when in self.stages:
+            lines.append('{:<12} {:8.1f} ms  (+{:.1f} ms)'.format(stage,
+                1000 * (when - self.start), 1000 * (when - previous)))
+            previous = when
+        return '\n'.join(lines)
+
+
+# The fonts and rendered text shared by all the screens of the game.
+fonts = FontRegistry()
+text_cache = TextCache(TEXT_CACHE_SIZE)
 
 
 def drawText(text, font, window_surface, x, y):
     '''Write some white text in a given font on the given
-    surface at X and Y coordinates.'''
-    textobj = font.render(text, 1, WHITE)
+    surface at X and Y coordinates. Returns the rectangle of the
+    surface that was drawn on.'''
+    textobj = text_cache.render(font, text, WHITE)
     textrect = textobj.get_rect()
     textrect.topleft = (x, y)
-    window_surface.blit(textobj, textrect)
+    return window_surface.blit(textobj, textrect)
 
 
 def info_screen(window_surface, message1, message2):
+    '''Display an information screen for the game (see
+    draw_info_screen), then wait for the player to press Return to
+    play the game or Escape to quit.
+    '''
+    draw_info_screen(window_surface, message1, message2)
+    # Wait for the player to press a key.
+    press_return_or_escape()
+
+
+def draw_info_screen(window_surface, message1, message2):
     '''Display an information screen for the game.
     Two message strings can be provided.
     The first message is displayed in a larger font size
@@ -464,33 +1588,29 @@ def info_screen(window_surface, message1, message2):
     in a smaller font size nearer the middle of the screen.
     The screen also displays text indicating how to quit
     the game just below the second message.
-    Once the messages have been displayed this function
-    will wait for the player to press Return to play
-    the game or Escape to quit.
     '''
     # Display the first message in large font near the
     # top of the screen.
-    font = pygame.font.SysFont(None, LARGE_FONT_SIZE)
+    font = fonts.get(LARGE_FONT_SIZE)
     window_surface.fill(BLACK)
     drawText(message1, font, window_surface, MAX_X / 4, MAX_Y / 3)
     # Display the second message in a smaller font near
     # the middle of the screen.
-    font = pygame.font.SysFont(None, SMALL_FONT_SIZE)
+    font = fonts.get(SMALL_FONT_SIZE)
     drawText(message2, font, window_surface, MAX_X / 4, MAX_Y / 3 + 100)
     # Display the how-to-quit message below the second message.
     drawText('press escape key to quit', font, window_surface,
         MAX_X / 4, MAX_Y / 3 + 130)
     pygame.display.update()
-    # Wait for the player to press a key.
-    press_return_or_escape()
 
 
 def show_score(window_surface, score, high_score):
     '''Show the game current score and high score
-    near the top left corner of the screen.'''
-    font = pygame.font.SysFont(None, SCORE_FONT)
-    drawText("HIGH:  " + str(high_score), font, window_surface, 10, 10)
-    drawText("SCORE: " + str(score), font, window_surface, 10, 40)
+    near the top left corner of the screen. Returns the list of
+    rectangles of the surface that were drawn on.'''
+    font = fonts.get(SCORE_FONT)
+    return [drawText("HIGH:  " + str(high_score), font, window_surface, 10, 10),
+        drawText("SCORE: " + str(score), font, window_surface, 10, 40)]
 
 
 def score_hit(radius):
@@ -499,71 +1619,610 @@ def score_hit(radius):
     return (MAX_ROCK_RADIUS * 2) - radius
 
 
-# XXX This should be decomposed into smaller functions.
-# XXX Might be good to package up game state into an object.
-def game_loop(window_surface, high_score):
-    '''Play the game until the player quits or they ship
-    crashes into a rock. This function loops over 
-    game events and updates the state of the game.'''
-    score = 0
-    # Start the game clock.
-    clock = pygame.time.Clock()
-    # Choose an initial rotation for the ship.
-    initial_rotation = randint(0, 359)
-    ship_position = Vector2(START_X, START_Y)
-    # Initialise the ship
-    ship = SpaceShip(ship_position, rotation=initial_rotation,
-        speed=1, size_major=20, size_minor=10) 
-    # Initialise the alive bullets.
-    bullets = []
-    # Initialise the alive rocks.
-    rocks = []
+class FrameProfiler(object):
+    '''Times each phase of every frame of the game.
 
-    # Loop indefinitely, handling game events.
-    while True:
+    The time spent in each of the PROFILE_PHASES is recorded, along with
+    the number of rocks and bullets, in a ring buffer which holds the
+    last num_frames frames. A frame overruns if the work done in it
+    (not counting the time spent waiting for the next frame) takes
+    longer than the frame budget of 1 / fps seconds. An fps of 0, for
+    frames drawn as fast as possible, uses the budget of one time step,
+    1 / FPS seconds.
 
-        # Draw the background of the screen as black.
-        window_surface.fill(BLACK)
+    The game calls start_frame at the start of each frame, mark at the
+    end of each phase, and end_frame once the frame has been displayed.
+    Each call to mark adds the time since the previous call to the
+    named phase. When no profiler is in use the game skips these calls,
+    so profiling costs nothing when it is disabled.
 
-        # Check if the player pressed a key.
-        key_pressed = pygame.key.get_pressed()
-        if key_pressed[K_LEFT]:
-            # Left arrow was pressed.
-            # Roate the ship left.
+    If show_overlay is True then draw_overlay shows the median (p50)
+    and 99th percentile (p99) time of each phase and the object counts
+    in the top right corner of the screen.
+    '''
+    def __init__(self, num_frames=PROFILE_FRAMES, fps=FPS):
+        self.num_frames = num_frames
+        self.phase_index = dict((phase, index)
+            for index, phase in enumerate(PROFILE_PHASES))
+        self.times = np.zeros((num_frames, len(PROFILE_PHASES)))
+        # The phase times of the frame in progress. They are copied into
+        # the ring buffer when the frame ends.
+        self.current = [0.0] * len(PROFILE_PHASES)
+        self.rocks = np.zeros(num_frames, dtype=np.int64)
+        self.bullets = np.zeros(num_frames, dtype=np.int64)
+        self.overruns = np.zeros(num_frames, dtype=bool)
+        # The total number of frames recorded so far.
+        self.frame = 0
+        self.budget = 1.0 / (fps if fps > 0 else FPS)
+        self.show_overlay = False
+        self.overlay_lines = []
+        self.last_time = time.perf_counter()
+
+
+    def start_frame(self):
+        '''Start timing a new frame.'''
+        self.current = [0.0] * len(PROFILE_PHASES)
+        self.last_time = time.perf_counter()
+
+
+    def mark(self, phase):
+        '''Add the time since the previous mark (or the start of the
+        frame) to the named phase.'''
+        now = time.perf_counter()
+        self.current[self.phase_index[phase]] += now - self.last_time
+        self.last_time = now
+
+
+    def end_frame(self, num_rocks, num_bullets):
+        '''Finish timing the current frame, recording the number of
+        rocks and bullets in it.'''
+        slot = self.frame % self.num_frames
+        self.times[slot] = self.current
+        self.rocks[slot] = num_rocks
+        self.bullets[slot] = num_bullets
+        self.overruns[slot] = self.times[slot].sum() > self.budget
+        self.frame += 1
+        if self.show_overlay and self.frame % PROFILE_OVERLAY_INTERVAL == 0:
+            self.overlay_lines = self.overlay_text()
+
+
+    def recorded(self):
+        '''Return the indices of the recorded frames in the ring buffer,
+        oldest first.'''
+        if self.frame <= self.num_frames:
+            return np.arange(self.frame)
+        start = self.frame % self.num_frames
+        return (np.arange(self.num_frames) + start) % self.num_frames
+
+
+    def stats(self):
+        '''Return a dictionary mapping each phase name (and 'total') to
+        a (p50, p99) pair of times in seconds over the recorded
+        frames.'''
+        times = self.times[self.recorded()]
+        result = {}
+        if len(times) == 0:
+            return result
+        for phase, index in self.phase_index.items():
+            result[phase] = tuple(np.percentile(times[:, index], (50, 99)))
+        result['total'] = tuple(np.percentile(times.sum(axis=1), (50, 99)))
+        return result
+
+
+    def overlay_text(self):
+        '''Return the lines of text shown in the overlay.'''
+        stats = self.stats()
+        if not stats:
+            return []
+        last = (self.frame - 1) % self.num_frames
+        frames = self.recorded()
+        lines = ['phase      p50 ms  p99 ms']
+        for phase in PROFILE_PHASES + ('total',):
+            p50, p99 = stats[phase]
+            lines.append('{:8s} {:7.2f} {:7.2f}'.format(phase, p50 * 1e3,
+                p99 * 1e3))
+        lines.append('rocks {}  bullets {}'.format(self.rocks[last],
+            self.bullets[last]))
+        lines.append('overruns {} / {}'.format(
+            int(self.overruns[frames].sum()), len(frames)))
+        return lines
+
+
+    def draw_overlay(self, window_surface):
+        '''Draw the overlay if it is shown. Returns the list of
+        rectangles of the surface that were drawn on.'''
+        if not self.show_overlay:
+            return []
+        if not self.overlay_lines:
+            self.overlay_lines = self.overlay_text()
+        font = fonts.get(PROFILE_FONT_SIZE)
+        rects = []
+        y = 10
+        for line in self.overlay_lines:
+            rects.append(drawText(line, font, window_surface, MAX_X - 220, y))
+            y += PROFILE_FONT_SIZE
+        return rects
+
+
+    def export(self, path):
+        '''Write the recorded frames to a file, oldest first. The file
+        is written as JSON if its name ends with .json, and as CSV
+        otherwise. Times are in seconds.'''
+        frames = self.recorded()
+        first = self.frame - len(frames)
+        rows = []
+        for number, slot in enumerate(frames):
+            row = dict(zip(PROFILE_PHASES, self.times[slot].tolist()))
+            row['frame'] = first + number
+            row['total'] = float(self.times[slot].sum())
+            row['num_rocks'] = int(self.rocks[slot])
+            row['num_bullets'] = int(self.bullets[slot])
+            row['overrun'] = bool(self.overruns[slot])
+            rows.append(row)
+        columns = (('frame',) + PROFILE_PHASES +
+            ('total', 'num_rocks', 'num_bullets', 'overrun'))
+        with open(path, 'w') as file:
+            if path.endswith('.json'):
+                json.dump({'budget': self.budget, 'phases': PROFILE_PHASES,
+                    'frames': rows}, file, indent=1)
+            else:
+                writer = csv.DictWriter(file, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+# The state of the game as seen from the outside after each time step.
+# Positions and velocities are (x, y) tuples, bullets are (x, y, age)
+# tuples and rocks are (x, y, radius) tuples.
+GameState = namedtuple('GameState', ['score', 'ship_position',
+    'ship_velocity', 'ship_rotation', 'bullets', 'rocks'])
+
+
+# Seeds of games are reduced modulo this, so that any integer can be
+# used as a seed and stored in the 64 bit fields of snapshots and
+# replays.
+SEED_MODULUS = 2 ** 64
+# The first bytes of a snapshot of a World (see World.snapshot).
+SNAPSHOT_MAGIC = b'ASTS'
+# Version of the World snapshot format. It changes whenever the state
+# of a World does.
+SNAPSHOT_VERSION = 1
+# The fixed size start of a snapshot: the magic bytes, the version, the
+# seed, score and time step, the done, swept bullets and rock collisions
+# flags, the numbers of bullets and rocks, the ship's position, previous
+# position, velocity, rotation and axis sizes, and the random number
+# generator's cached Gaussian value (with a flag saying if there is one).
+SNAPSHOT_HEADER = struct.Struct('<4sBQqI3BII6dq2iBd')
+# The state of one bullet in a snapshot: position, previous position,
+# direction and velocity, then age.
+SNAPSHOT_BULLET = struct.Struct('<8dq')
+# The number of bytes of each rock in a snapshot (see RockField.pack).
+SNAPSHOT_ROCK_SIZE = 6 * 8 + 8 + 3
+# The state of a random.Random in a snapshot: its 625 words as unsigned
+# 32 bit integers.
+SNAPSHOT_RNG = struct.Struct('<625I')
+
+
+class SnapshotError(Exception):
+    '''Data given to World.restore is not a snapshot that this version
+    of the game can restore.'''
+    pass
+
+
+class World(object):
+    '''The complete state of one game, and the rules for advancing it.
+
+    A World owns the score, the ship, the alive bullets and the alive
+    rocks. It does not use the pygame display, event queue or clock,
+    so it can be stepped as fast as the host machine allows. This is
+    useful for testing automated players and for tuning the game
+    constants.
+
+    All randomness comes from a random.Random object owned by the
+    world, so two worlds reset with the same seed and given the same
+    sequence of actions play exactly the same game.
+
+    Each call to step advances the game by one time step (one frame
+    of the interactive game). Actions are integers made by or-ing
+    together the ACTION_* bits.
+
+    If swept_bullets is True (by default it is SWEPT_BULLETS) then
+    bullets use swept collision tests: see sweep_bullets. If
+    rock_collisions is True (by default it is ROCK_COLLISIONS) then
+    rocks bounce off each other: see RockField.collide.
+
+    After each step, explosions lists the rocks destroyed in that step,
+    as (x, y, velocity x, velocity y, radius, red, green, blue) tuples,
+    for drawing explosion effects (see ParticleSystem). They are not
+    part of the state of the game.
+
+    The whole state of a world can be saved as bytes with snapshot and
+    put back with restore, or copied into a new world with fork, for
+    example to try several actions from the same point in a game.
+    '''
+    def __init__(self, seed=None, swept_bullets=None, rock_collisions=None):
+        if swept_bullets is None:
+            swept_bullets = SWEPT_BULLETS
+        if rock_collisions is None:
+            rock_collisions = ROCK_COLLISIONS
+        self.swept_bullets = swept_bullets
+        self.rock_collisions = rock_collisions
+        # An optional FrameProfiler which times the phases of step.
+        self.profiler = None
+        # Bullets which have died, kept to be fired again rather than
+        # allocating new ones.
+        self.bullet_pool = []
+        self.bullets = []
+        self.explosions = []
+        self.reset(seed)
+
+
+    def reset(self, seed=None):
+        '''Start a new game. If seed is None a random seed is chosen
+        by the operating system. The seed, reduced modulo SEED_MODULUS,
+        is kept in the seed attribute, so that the game can be replayed.
+        Returns the initial GameState.'''
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        seed %= SEED_MODULUS
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.score = 0
+        self.ticks = 0
+        self.done = False
+        self.explosions.clear()
+        # Choose an initial rotation for the ship.
+        initial_rotation = self.rng.randint(0, 359)
+        ship_position = Vector2(START_X, START_Y)
+        # Initialise the ship
+        self.ship = SpaceShip(ship_position, rotation=initial_rotation,
+            speed=1, size_major=SHIP_SIZE_MAJOR, size_minor=SHIP_SIZE_MINOR)
+        # Initialise the alive bullets, keeping any from the previous
+        # game for reuse.
+        self.bullet_pool.extend(self.bullets)
+        self.bullets = []
+        # Initialise the alive rocks.
+        self.rocks = RockField()
+        # The broadphase for collisions between rocks and other objects.
+        self.grid = UniformGrid()
+        return self.state()
+
+
+    def state(self):
+        '''Return a GameState describing the current state of the world.'''
+        ship = self.ship
+        return GameState(
+            score=self.score,
+            ship_position=(ship.position.x, ship.position.y),
+            ship_velocity=(ship.velocity.x, ship.velocity.y),
+            ship_rotation=ship.rotation,
+            bullets=tuple((bullet.position.x, bullet.position.y, bullet.age)
+                for bullet in self.bullets),
+            rocks=tuple(zip(self.rocks.positions[:, 0].tolist(),
+                self.rocks.positions[:, 1].tolist(),
+                self.rocks.radii.tolist())))
+
+
+    def checksum(self):
+        '''Return a 32 bit checksum of the state of the game, including
+        the ship, the score, the bullets and the rocks. Two worlds
+        with the same checksum are almost certainly in the same state.'''
+        ship = self.ship
+        crc = zlib.crc32(struct.pack('<5dq', ship.position.x,
+            ship.position.y, ship.velocity.x, ship.velocity.y,
+            ship.rotation, self.score))
+        for bullet in self.bullets:
+            crc = zlib.crc32(struct.pack('<2dq', bullet.position.x,
+                bullet.position.y, bullet.age), crc)
+        rocks = self.rocks
+        for values in (rocks.positions, rocks.velocities, rocks.radii,
+                rocks.colours):
+            crc = zlib.crc32(values.tobytes(), crc)
+        return crc
+
+
+    def snapshot(self):
+        '''Return the complete state of the game as bytes, which restore
+        can put back into this or any other world. Besides the score, the
+        ship, the bullets and the rocks, the state includes the random
+        number generator, so a restored world plays exactly the same game
+        from then on as this one does.
+
+        A snapshot is SNAPSHOT_HEADER, then SNAPSHOT_RNG, then
+        SNAPSHOT_BULLET for each bullet, then the rocks as packed
+        by RockField.pack. All values are little endian.'''
+        ship = self.ship
+        position = ship.position
+        previous = ship.previous_position
+        velocity = ship.velocity
+        _version, words, gauss = self.rng.getstate()
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+            self.seed, self.score, self.ticks, self.done,
+            self.swept_bullets, self.rock_collisions, len(self.bullets),
+            len(self.rocks), position.x, position.y, previous.x,
+            previous.y, velocity.x, velocity.y, ship.rotation,
+            ship.size_major, ship.size_minor, gauss is not None,
+            0.0 if gauss is None else gauss), SNAPSHOT_RNG.pack(*words)]
+        for bullet in self.bullets:
+            position = bullet.position
+            previous = bullet.previous_position
+            direction = bullet.direction
+            velocity = bullet.velocity
+            parts.append(SNAPSHOT_BULLET.pack(position.x, position.y,
+                previous.x, previous.y, direction.x, direction.y,
+                velocity.x, velocity.y, bullet.age))
+        parts.append(self.rocks.pack())
+        return b''.join(parts)
+
+
+    def restore(self, data):
+        '''Put the world into the state saved in a snapshot made by
+        snapshot. Raises SnapshotError, leaving the world unchanged, if
+        the data is not a complete snapshot of the current version.'''
+        try:
+            header = SNAPSHOT_HEADER.unpack_from(data)
+        except struct.error:
+            raise SnapshotError('truncated snapshot')
+        (magic, version, seed, score, ticks, done, swept_bullets,
+            rock_collisions, num_bullets, num_rocks, x, y, previous_x,
+            previous_y, velocity_x, velocity_y, rotation, size_major,
+            size_minor, has_gauss, gauss) = header
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError('not a snapshot')
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError('unsupported snapshot version {}'.format(
+                version))
+        offset = SNAPSHOT_HEADER.size
+        rocks_offset = (offset + SNAPSHOT_RNG.size +
+            SNAPSHOT_BULLET.size * num_bullets)
+        if len(data) != rocks_offset + SNAPSHOT_ROCK_SIZE * num_rocks:
+            raise SnapshotError('snapshot has the wrong size')
+        words = SNAPSHOT_RNG.unpack_from(data, offset)
+        offset += SNAPSHOT_RNG.size
+        self.rng.setstate((random.Random.VERSION, words,
+            gauss if has_gauss else None))
+        self.seed = seed
+        self.score = score
+        self.ticks = ticks
+        self.done = bool(done)
+        self.explosions.clear()
+        self.swept_bullets = bool(swept_bullets)
+        self.rock_collisions = bool(rock_collisions)
+        ship = self.ship
+        ship.position.update(x, y)
+        ship.previous_position.update(previous_x, previous_y)
+        ship.velocity = Vector2(velocity_x, velocity_y)
+        ship.rotation = rotation
+        ship.size_major = size_major
+        ship.size_minor = size_minor
+        # The cached points of the ship may be for its old sizes.
+        ship._points_key = None
+        # Reuse the bullets of the current game for those of the
+        # snapshot.
+        pool = self.bullet_pool
+        pool.extend(self.bullets)
+        self.bullets = []
+        for _count in range(num_bullets):
+            values = SNAPSHOT_BULLET.unpack_from(data, offset)
+            offset += SNAPSHOT_BULLET.size
+            if pool:
+                bullet = pool.pop()
+            else:
+                bullet = Bullet(Vector2(0, 0), Vector2(1, 0))
+            bullet.load(values[0:2], values[2:4], values[4:6], values[6:8],
+                values[8])
+            self.bullets.append(bullet)
+        self.rocks.unpack(data, offset, num_rocks)
+
+
+    def fork(self):
+        '''Return a new World in the same state as this one, which then
+        plays on independently of it. This is the same as restoring a
+        snapshot of this world into a new one, but quicker. The new world
+        has no profiler.'''
+        world = World.__new__(World)
+        world.swept_bullets = self.swept_bullets
+        world.rock_collisions = self.rock_collisions
+        world.profiler = None
+        world.bullet_pool = []
+        world.explosions = []
+        world.seed = self.seed
+        # The new generator is not seeded, since setstate replaces all
+        # of its state.
+        world.rng = random.Random.__new__(random.Random)
+        world.rng.setstate(self.rng.getstate())
+        world.score = self.score
+        world.ticks = self.ticks
+        world.done = self.done
+        world.ship = self.ship.copy()
+        world.bullets = [bullet.copy() for bullet in self.bullets]
+        world.rocks = self.rocks.copy()
+        world.grid = UniformGrid()
+        return world
+
+
+    def step(self, action):
+        '''Advance the game by one time step using the player's action.
+        Returns a tuple (state, reward, done) where reward is the
+        number of points scored in this time step and done is True if
+        the ship crashed into a rock. Stepping a finished game does
+        nothing; call reset to start a new one.'''
+        if self.done:
+            return self.state(), 0, True
+        profiler = self.profiler
+        old_score = self.score
+        self.ticks += 1
+        self.explosions.clear()
+        self.apply_action(action)
+        if profiler is not None:
+            profiler.mark('input')
+        self.spawn_rocks()
+        if profiler is not None:
+            profiler.mark('spawn')
+        self.update_bullets()
+        if profiler is not None:
+            profiler.mark('bullets')
+        self.done = self.update_rocks()
+        if not self.done:
+            # Move the ship to its new position.
+            self.ship.move()
+        if profiler is not None:
+            profiler.mark('rocks')
+        return self.state(), self.score - old_score, self.done
+
+
+    def apply_action(self, action):
+        '''Turn, accelerate and fire the ship according to the action.'''
+        ship = self.ship
+        if action & ACTION_LEFT:
+            # Rotate the ship left.
             ship.turn_left(ROTATE_ANGLE)
-        if key_pressed[K_RIGHT]:
-            # Right arrow was pressed.
+        if action & ACTION_RIGHT:
             # Rotate the ship right.
             ship.turn_right(ROTATE_ANGLE)
-        if key_pressed[K_UP]: 
-            # Up arrow was pressed.
+        if action & ACTION_UP:
             # Accelerate the ship by one unit.
             ship.accelerate(1)
-        if key_pressed[K_SPACE]:
-            # Space bar was pressed.
+        if action & ACTION_FIRE:
             # If there are fewer than MAX_BULLETS alive
             # then fire a bullet in the direction that
             # the ship is facing.
-            if len(bullets) < MAX_BULLETS:
+            if len(self.bullets) < MAX_BULLETS:
                 # Choose the bullet direction to be the same
                 # as the direction of the ship.
                 direction = Vector2(1, 0).rotate(ship.rotation)
-                bullets.append(Bullet(ship.position, direction))
-
-        # Check if the player wants to quit the game.
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                terminate()
-            if event.type == KEYDOWN:
-                if event.key == K_ESCAPE:
-                    terminate()
-
-        # Spawn new rocks off screen if the number of alive rocks
-        # is less than the minimum.
+                if self.bullet_pool:
+                    bullet = self.bullet_pool.pop()
+                    bullet.reset(ship.position, direction)
+                else:
+                    bullet = Bullet(ship.position, direction)
+                self.bullets.append(bullet)
+
+
+    def spawn_rocks(self):
+        '''Spawn new rocks off screen if the number of alive rocks
+        is less than the minimum.'''
+        rocks = self.rocks
         if len(rocks) < MIN_NUM_ROCKS:
-            new_rocks = spawn_offscreen_rocks(MIN_NUM_ROCKS - len(rocks)) 
+            new_rocks = spawn_offscreen_rocks(MIN_NUM_ROCKS - len(rocks),
+                self.rng)
             rocks.extend(new_rocks)
 
+
+    def broadphase(self):
+        '''Rebuild and return the broadphase grid for the current rock
+        positions, or return None if there are too few rocks for the grid
+        to be worthwhile.'''
+        rocks = self.rocks
+        if len(rocks) < BROADPHASE_MIN_ROCKS:
+            return None
+        self.grid.build(rocks.positions, rocks.radii)
+        return self.grid
+
+
+    def sweep_bullets(self, bullets, grid):
+        '''Find when the front of each bullet first touched each rock
+        during the bullet's most recent move. Returns a pair
+        (candidates, times) where candidates is an array of the indices
+        of the rocks which could have been touched, and times is an
+        array with one row per bullet and one column per candidate,
+        holding the fraction of the move completed when the bullet
+        entered the rock (or infinity if it did not).
+
+        A bullet which wrapped around the screen in its move is swept
+        along two segments: from where it was to where it would have
+        been without wrapping, and from where it would have come from
+        on the opposite side to where it is now. The first segment
+        covers the first half of the move and the second segment the
+        second half, so that hits before the wrap count as earlier.'''
+        starts = []
+        ends = []
+        owners = []
+        # Each segment covers the part of the move from time_offset to
+        # time_offset + time_scale.
+        time_offset = []
+        time_scale = []
+        for index, bullet in enumerate(bullets):
+            front = bullet.direction * BULLET_LENGTH
+            start = bullet.previous_position + front
+            end = bullet.position + front
+            delta = end - start
+            if abs(delta.x) > MAX_X / 2 or abs(delta.y) > MAX_Y / 2:
+                starts.extend((start, end - bullet.velocity))
+                ends.extend((start + bullet.velocity, end))
+                owners.extend((index, index))
+                time_offset.extend((0.0, 0.5))
+                time_scale.extend((0.5, 0.5))
+            else:
+                starts.append(start)
+                ends.append(end)
+                owners.append(index)
+                time_offset.append(0.0)
+                time_scale.append(1.0)
+        starts = np.array([(point.x, point.y) for point in starts])
+        ends = np.array([(point.x, point.y) for point in ends])
+        if grid is not None:
+            candidates = np.unique(np.concatenate([np.asarray(
+                grid.query_segment(start, end), dtype=np.int64)
+                for start, end in zip(starts, ends)]))
+        else:
+            candidates = np.arange(len(self.rocks))
+        segment_times = self.rocks.segment_hit_times(starts, ends, candidates)
+        # Map each segment's times onto its part of the bullet's move,
+        # and keep the earliest time for each bullet.
+        segment_times = (np.array(time_offset)[:, np.newaxis]
+            + segment_times * np.array(time_scale)[:, np.newaxis])
+        times = np.full((len(bullets), len(candidates)), np.inf)
+        np.minimum.at(times, np.array(owners), segment_times)
+        return candidates, times
+
+
+    def point_bullets(self, bullets, grid):
+        '''Find which rocks contain the front of each bullet, as in
+        bullet_hit_rock. Returns a pair (candidates, times) in the same
+        form as sweep_bullets, where the time is 0 for a rock which
+        contains the front of the bullet and infinity otherwise. Only
+        rocks which contain the front of some bullet are candidates.'''
+        rocks = self.rocks
+        fronts = np.array([bullet.front() for bullet in bullets])
+        if grid is not None:
+            # Test each bullet only against the rocks in its own cell.
+            cells = [grid.query_point(front) for front in fronts]
+            owners = np.repeat(np.arange(len(bullets)),
+                [len(cell) for cell in cells])
+            indices = np.concatenate(cells)
+            delta = rocks.positions[indices] - fronts[owners]
+            distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+            inside = distance <= rocks.radii[indices]
+            candidates, columns = np.unique(indices[inside],
+                return_inverse=True)
+            owners = owners[inside]
+        else:
+            inside = rocks.contains_points(fronts)
+            # Without a grid the columns of inside are already the rocks
+            # in order, so only those which some bullet is in are kept.
+            candidates = np.flatnonzero(inside.any(axis=0))
+            return candidates, np.where(inside[:, candidates], 0.0, np.inf)
+        times = np.full((len(bullets), len(candidates)), np.inf)
+        times[owners, columns] = 0.0
+        return candidates, times
+
+
+    def update_bullets(self):
+        '''Check if any bullet has hit a rock.
+        Also increment the age of each bullet, and forget
+        about any bullets which have exceeded their age limit.
+        If swept_bullets is set then each bullet hits the first rock it
+        passed through during its move (see sweep_bullets), otherwise it
+        hits a rock which contains its front after its move.
+        Bullets which die are returned to the bullet pool.'''
+        if not self.bullets:
+            return
+        rocks = self.rocks
+        bullet_pool = self.bullet_pool
+        # The rocks do not move while the bullets are checked, so
+        # the broadphase is built once for all the bullets.
+        grid = self.broadphase()
         # The list of bullets which have not hit any rocks
         # in the current time step.
         alive_bullets = []
@@ -571,99 +2230,1086 @@ def game_loop(window_surface, high_score):
         # the current time step.
         spawned_rocks = []
 
-        # Check if any bullet has hit a rock.
-        # Also increment the age of each bullet, and forget
-        # about any bullets which have exceeded their age limit.
-        for bullet in bullets:
+        # The list of bullets which are still alive after this
+        # time step, and which have moved.
+        moved_bullets = []
+        for bullet in self.bullets:
             # Increment the age of the bullet.
             bullet.time_step()
             # Check if the bullet's age is less than the maximum age.
             if bullet.alive():
                 # Move the bullet to its new position.
                 bullet.move()
-                # Keep track of rocks that are not hit by bullets.
-                alive_rocks = []
-                # This bullet has not hit anything yet.
-                hit = False
-                # Check if this bullet hits any of the rocks.
-                for rock in rocks:
-                    # If the bullet has not already hit a rock, check
-                    # if it hits this rock.
-                    if not hit and bullet_hit_rock(bullet, rock):
-                        # Update the score based on the size of the rock.
-                        score += score_hit(rock.radius)
-                        # This bullet has now hit a rock.
-                        hit = True
-                        # Possibly spawn new rocks.
-                        if rock.radius > MIN_ROCK_RADIUS:
-                            spawned_rocks.extend(spawn_rocks_explosion(rock))
-                    else:
-                        # This rock was not hit by this bullet.
-                        alive_rocks.append(rock)
-                # Check if this bullet did not hit any rocks at all.
-                if not hit:
-                    # Draw the bullet at its new position.
-                    bullet.draw(window_surface)
-                    # Keep this bullet alive for the future.
-                    alive_bullets.append(bullet)
-                # Reset rocks list to be all the alive rocks.
-                rocks = alive_rocks
-
-        # Add all newly spawned rocks to the list of alive rocks.
+                moved_bullets.append(bullet)
+            else:
+                bullet_pool.append(bullet)
+
+        # All the bullets are tested against all the candidate rocks at
+        # once. Then only the bullets which touched a rock need to be
+        # considered one at a time.
+        touched = [False] * len(moved_bullets)
+        hit_rocks = None
+        if moved_bullets and len(rocks):
+            if self.swept_bullets:
+                candidates, times = self.sweep_bullets(moved_bullets, grid)
+            else:
+                candidates, times = self.point_bullets(moved_bullets, grid)
+            if len(candidates):
+                touched = np.isfinite(times).any(axis=1).tolist()
+                # The rocks which have been hit by a bullet in the
+                # current time step. They are removed once all bullets
+                # are checked.
+                hit_rocks = np.zeros(len(rocks), dtype=bool)
+
+        for number, bullet in enumerate(moved_bullets):
+            # Check if this bullet hits any of the rocks which have
+            # not already been hit.
+            index = -1
+            if touched[number]:
+                # Choose the rock the bullet touched first; among rocks
+                # touched at the same time this is the one with the
+                # lowest index.
+                bullet_times = times[number].copy()
+                bullet_times[hit_rocks[candidates]] = np.inf
+                earliest = int(np.argmin(bullet_times))
+                if np.isfinite(bullet_times[earliest]):
+                    index = int(candidates[earliest])
+            if index >= 0:
+                rock = rocks[index]
+                # Update the score based on the size of the rock.
+                self.score += score_hit(rock.radius)
+                # Record the explosion, for drawing effects.
+                x, y = rocks.positions[index].tolist()
+                velocity_x, velocity_y = rocks.velocities[index].tolist()
+                self.explosions.append((x, y, velocity_x, velocity_y,
+                    rock.radius) + rock.colour)
+                # Possibly spawn new rocks.
+                if rock.radius > MIN_ROCK_RADIUS:
+                    spawned_rocks.extend(
+                        spawn_rocks_explosion(rock, self.rng))
+                # The rock that was hit is destroyed, and so is
+                # the bullet.
+                hit_rocks[index] = True
+                bullet_pool.append(bullet)
+            else:
+                # Keep this bullet alive for the future.
+                alive_bullets.append(bullet)
+
+        # Forget the rocks which were hit, and add all newly
+        # spawned rocks to the alive rocks.
+        if hit_rocks is not None and hit_rocks.any():
+            rocks.remove(hit_rocks)
         rocks.extend(spawned_rocks)
         # Reset bullets to the currently alive bullets.
-        bullets = alive_bullets
-
-        # Move all of the rocks and check whether any of them collide
-        # with the ship.
-        for rock in rocks:
-            # Move this rock to its new position.
-            rock.move()
-            # Check for a collision with the ship.
-            if ship_hit_rock(ship, rock):
-                return score
-            # Draw the rock on the screen at its new position.
-            rock.draw(window_surface)
-
-        # Move the ship to its new position.
-        ship.move()
-        # Draw the ship on the screen at its new position.
-        ship.draw(window_surface)
+        self.bullets = alive_bullets
+
+
+    def update_rocks(self):
+        '''Move all of the rocks, bounce them off each other if
+        rock_collisions is set, and check whether any of them collide
+        with the ship. Returns True if the ship crashed.'''
+        self.rocks.move()
+        if self.rock_collisions:
+            self.rocks.collide()
+        points = self.ship.points()
+        grid = self.broadphase()
+        candidates = None
+        if grid is not None:
+            candidates = grid.query_triangle(points)
+        return self.rocks.any_hit(points, candidates)
+
+
+    def draw(self, window_surface, sprites=None, alpha=1.0):
+        '''Draw the bullets, rocks and ship on the supplied surface.
+        If sprites (a SpriteCache) is given then the rocks and ship are
+        drawn from pre-rendered sprites, otherwise they are drawn as
+        geometric shapes. If alpha is less than 1 then every object is
+        drawn a fraction alpha of the way through its most recent move,
+        which gives smooth motion when frames are drawn between time
+        steps. Returns the list of rectangles of the surface that
+        were drawn on.'''
+        interpolate = alpha < 1.0
+        rects = []
+        for bullet in self.bullets:
+            position = None
+            if interpolate:
+                position = bullet.interpolated_position(alpha)
+            rects.append(bullet.draw(window_surface, position))
+
+        rocks = self.rocks
+        positions = rocks.positions
+        if interpolate:
+            positions = interpolate_positions(rocks.previous_positions,
+                positions, alpha)
+        for (x, y), radius, (red, green, blue) in zip(positions.tolist(),
+                rocks.radii.tolist(), rocks.colours.tolist()):
+            center = (int(x), int(y))
+            colour = (red, green, blue)
+            if sprites is None:
+                rects.append(pygame.draw.circle(window_surface, colour,
+                    center, radius))
+            else:
+                rects.append(sprites.draw_rock(window_surface, center,
+                    radius, colour))
+
+        ship = self.ship
+        position = None
+        if interpolate:
+            position = ship.interpolated_position(alpha)
+        if sprites is None:
+            rects.append(ship.draw(window_surface, position))
+        else:
+            rects.append(sprites.draw_ship(window_surface, ship, position))
+        return rects
+
+
+class ParticleSystem(object):
+    '''Debris thrown out by exploding rocks. Particles are only drawn:
+    they do not affect the game, and they use their own random number
+    generator, so the game plays the same with or without them.
+
+    The state of up to capacity particles is kept in NumPy arrays which
+    are allocated once:
+       - positions (float array of shape (capacity, 2))
+       - velocities (float array of shape (capacity, 2))
+       - ages and lifetimes in time steps (integer arrays of shape
+         (capacity,))
+       - colours (unsigned byte array of shape (capacity, 3))
+       - alive (boolean array of shape (capacity,))
+    The slots of dead particles are kept on a free list (a stack of slot
+    indices), so new particles reuse them without the arrays being
+    moved or compacted. When every slot is in use new particles are
+    dropped.
+
+    Every particle is moved and aged with a few vectorized operations
+    per time step, and all of them are drawn at once by writing their
+    pixels straight into the surface with pygame.surfarray, rather than
+    with a drawing call per particle. Particles fade out as they age.
+    '''
+    def __init__(self, capacity=MAX_PARTICLES, seed=None):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.positions = np.zeros((capacity, 2))
+        self.velocities = np.zeros((capacity, 2))
+        self.ages = np.zeros(capacity, dtype=np.int64)
+        self.lifetimes = np.ones(capacity, dtype=np.int64)
+        self.colours = np.zeros((capacity, 3), dtype=np.uint8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # The free slots are free[:num_free], and the last of them is
+        # the next to be used.
+        self.free = np.arange(capacity - 1, -1, -1)
+        self.num_free = capacity
+
+
+    def __len__(self):
+        return self.capacity - self.num_free
+
+
+    def clear(self):
+        '''Remove all the particles.'''
+        self.alive[:] = False
+        self.free[:] = np.arange(self.capacity - 1, -1, -1)
+        self.num_free = self.capacity
+
+
+    def explode(self, explosions):
+        '''Throw out particles from each of a list of exploding rocks,
+        given as in World.explosions. Each particle starts at a random
+        point in its rock, moving away from the centre of the rock as
+        well as with the rock.'''
+        if not explosions:
+            return
+        rocks = np.array(explosions, dtype=float)
+        radii = rocks[:, 4]
+        counts = np.maximum(1, (radii * PARTICLES_PER_RADIUS).astype(int))
+        total = min(int(counts.sum()), self.num_free)
+        if total == 0:
+            return
+        sources = np.repeat(np.arange(len(rocks)), counts)[:total]
+        slots = self.free[self.num_free - total:self.num_free]
+        self.num_free -= total
+        rng = self.rng
+        angles = rng.uniform(0, 2 * np.pi, total)
+        directions = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        # Taking the square root spreads the particles evenly over the
+        # area of the rock.
+        distances = radii[sources] * np.sqrt(rng.uniform(0, 1, total))
+        positions = rocks[sources, 0:2] + directions * distances[:, np.newaxis]
+        wrap_positions(positions)
+        speeds = rng.uniform(MIN_PARTICLE_SPEED, MAX_PARTICLE_SPEED, total)
+        self.positions[slots] = positions
+        self.velocities[slots] = (rocks[sources, 2:4] +
+            directions * speeds[:, np.newaxis])
+        self.ages[slots] = 0
+        self.lifetimes[slots] = rng.integers(MIN_PARTICLE_AGE,
+            MAX_PARTICLE_AGE + 1, total)
+        self.colours[slots] = rocks[sources, 5:8]
+        self.alive[slots] = True
+
+
+    def update(self):
+        '''Move and age every particle by one time step, and free the
+        slots of particles which have reached the end of their
+        lives.'''
+        if self.num_free == self.capacity:
+            return
+        # Updating every slot, including the dead ones, is quicker than
+        # picking out the live ones first.
+        self.positions += self.velocities
+        self.velocities *= PARTICLE_DRAG
+        wrap_positions(self.positions)
+        self.ages += 1
+        dead = np.flatnonzero(self.alive & (self.ages >= self.lifetimes))
+        if len(dead):
+            self.alive[dead] = False
+            self.free[self.num_free:self.num_free + len(dead)] = dead
+            self.num_free += len(dead)
+
+
+    def draw(self, window_surface, alpha=1.0):
+        '''Draw every particle on the supplied surface, which must have
+        2 or 4 bytes per pixel. If alpha is less than 1 the particles
+        are drawn a fraction alpha of the way through their most recent
+        move. Returns the list of rectangles of the surface that were
+        drawn on (one rectangle around all the particles).'''
+        if self.num_free == self.capacity:
+            return []
+        slots = np.flatnonzero(self.alive)
+        positions = self.positions[slots]
+        if alpha < 1.0:
+            positions -= self.velocities[slots] * ((1.0 - alpha) /
+                PARTICLE_DRAG)
+        width, height = window_surface.get_size()
+        xs = positions[:, 0].astype(np.int64) % width
+        ys = positions[:, 1].astype(np.int64) % height
+        # Fade each particle from its colour to black over its life, and
+        # convert the colours to the surface's pixel format.
+        fade = 1.0 - self.ages[slots] / self.lifetimes[slots]
+        colours = (self.colours[slots] * fade[:, np.newaxis]).astype(np.int64)
+        shifts = window_surface.get_shifts()
+        losses = window_surface.get_losses()
+        pixels = window_surface.get_masks()[3]
+        for channel in range(3):
+            pixels = pixels | ((colours[:, channel] >> losses[channel]) <<
+                shifts[channel])
+        surface_pixels = pygame.surfarray.pixels2d(window_surface)
+        try:
+            pixels = pixels.astype(surface_pixels.dtype)
+            # Particles at the edge of the screen are cut off, so that
+            # they stay inside the rectangle returned.
+            for dx in range(PARTICLE_SIZE):
+                for dy in range(PARTICLE_SIZE):
+                    surface_pixels[np.minimum(xs + dx, width - 1),
+                        np.minimum(ys + dy, height - 1)] = pixels
+        finally:
+            # The surface is locked until the pixel array is deleted.
+            del surface_pixels
+        left = int(xs.min())
+        top = int(ys.min())
+        rect = pygame.Rect(left, top, int(xs.max()) - left + PARTICLE_SIZE,
+            int(ys.max()) - top + PARTICLE_SIZE)
+        return [rect.clip(window_surface.get_rect())]
+
+
+def merge_rects(rects):
+    '''Merge a list of rectangles so that none of the resulting
+    rectangles overlap. Overlapping rectangles are replaced by their
+    union, and empty rectangles are dropped.'''
+    merged = []
+    for rect in rects:
+        if rect.width == 0 or rect.height == 0:
+            continue
+        rect = pygame.Rect(rect)
+        index = rect.collidelist(merged)
+        while index >= 0:
+            rect.union_ip(merged.pop(index))
+            index = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class FullScreenRenderer(object):
+    '''Draws each frame of the game by clearing the whole screen,
+    drawing every object and then updating the whole display.
+    Rocks and the ship are drawn from sprites if a SpriteCache
+    is given.'''
+    def __init__(self, sprites=None):
+        self.sprites = sprites
+        # An optional FrameProfiler which times the drawing phases.
+        self.profiler = None
+
+
+    def reset(self):
+        '''Forget any previous frames. There is nothing to forget.'''
+        pass
 
-        # Show the score and high score on the screen.
-        show_score(window_surface, score, high_score)
 
+    def render(self, window_surface, world, high_score, alpha=1.0,
+            particles=None, aliens=None):
+        '''Draw the world, the alien ships of an AlienFleet (see
+        aliens.py) and the particles of a ParticleSystem if they are
+        given, and the score, and update the display. The alpha argument
+        is passed on to the draw methods.'''
+        profiler = self.profiler
+        # Draw the background of the screen as black.
+        window_surface.fill(BLACK)
+        # Draw the bullets, rocks and ship at their new positions.
+        world.draw(window_surface, self.sprites, alpha)
+        if aliens is not None:
+            aliens.draw(window_surface, alpha)
+        if profiler is not None:
+            profiler.mark('draw')
+        if particles is not None:
+            particles.draw(window_surface, alpha)
+            if profiler is not None:
+                profiler.mark('particles')
+        # Show the score and high score on the screen.
+        show_score(window_surface, world.score, high_score)
+        if profiler is not None:
+            profiler.mark('score')
+            profiler.draw_overlay(window_surface)
+            profiler.mark('overlay')
         # Redraw the screen.
         pygame.display.update()
-        clock.tick(FPS)
+        if profiler is not None:
+            profiler.mark('display')
 
 
-def get_high_score():
-    '''Try to read the high score from file.
-    If the file does not exist or cannot be read
-    then set the high score to 0.'''
-    score = 0
-    try:
-        with open(HIGH_SCORE_FILE) as file:
-            score = int(next(file))
-    except:
-        # Something bad happened when we tried to read
-        # the high score file. We ignore it and
-        # return the default high score.
-        pass
-    finally:
-        return score
+class DirtyRectRenderer(object):
+    '''Draws each frame of the game by changing only the parts of the
+    screen where something moved.
+
+    The renderer remembers the rectangles that were drawn on in the
+    previous frame. To draw a new frame it clears those rectangles to
+    the background colour, draws every object (recording the
+    rectangles that are drawn on this time), and then updates only the
+    previous and current rectangles of the display.
 
+    An object which wraps around to the opposite side of the screen
+    is handled like any other movement: its old rectangle on one side
+    is cleared and its new rectangle on the other side is drawn. Objects
+    which are partly off screen have their rectangles clipped to the
+    screen by pygame.
 
-def save_high_score(score):
-    '''Try to save the high score to file.'''
+    Rocks and the ship are drawn from sprites if a SpriteCache
+    is given.
+    '''
+    def __init__(self, sprites=None):
+        self.sprites = sprites
+        self.previous_rects = None
+        # An optional FrameProfiler which times the drawing phases.
+        self.profiler = None
+
+
+    def reset(self):
+        '''Forget the previous frame, so the next frame redraws the
+        whole screen. Call this whenever something else has drawn on
+        the screen, such as an info screen.'''
+        self.previous_rects = None
+
+
+    def render(self, window_surface, world, high_score, alpha=1.0,
+            particles=None, aliens=None):
+        '''Draw the world, the alien ships of an AlienFleet (see
+        aliens.py) and the particles of a ParticleSystem if they are
+        given, and the score, and update the parts of the display that
+        changed. The alpha argument is passed on to the draw methods.'''
+        if self.previous_rects is None:
+            # There is no previous frame, so start from a blank screen.
+            window_surface.fill(BLACK)
+            dirty_rects = [window_surface.get_rect()]
+        else:
+            # Erase the objects drawn in the previous frame.
+            for rect in self.previous_rects:
+                window_surface.fill(BLACK, rect)
+            dirty_rects = list(self.previous_rects)
+        profiler = self.profiler
+        rects = world.draw(window_surface, self.sprites, alpha)
+        if aliens is not None:
+            rects.extend(aliens.draw(window_surface, alpha))
+        if profiler is not None:
+            profiler.mark('draw')
+        if particles is not None:
+            rects.extend(particles.draw(window_surface, alpha))
+            if profiler is not None:
+                profiler.mark('particles')
+        rects.extend(show_score(window_surface, world.score, high_score))
+        if profiler is not None:
+            profiler.mark('score')
+            rects.extend(profiler.draw_overlay(window_surface))
+            profiler.mark('overlay')
+        self.previous_rects = rects
+        pygame.display.update(merge_rects(dirty_rects + rects))
+        if profiler is not None:
+            profiler.mark('display')
+
+
+def read_action():
+    '''Convert the keys currently held down by the player into
+    an action for World.step.'''
+    key_pressed = pygame.key.get_pressed()
+    action = ACTION_NONE
+    if key_pressed[K_LEFT]:
+        # Left arrow was pressed.
+        action |= ACTION_LEFT
+    if key_pressed[K_RIGHT]:
+        # Right arrow was pressed.
+        action |= ACTION_RIGHT
+    if key_pressed[K_UP]:
+        # Up arrow was pressed.
+        action |= ACTION_UP
+    if key_pressed[K_SPACE]:
+        # Space bar was pressed.
+        action |= ACTION_FIRE
+    return action
+
+
+class InputQueue(object):
+    '''The player's key presses and releases, in the order they arrived,
+    with the time each one arrived.
+
+    Reading which keys are held down once per frame misses a key which
+    is pressed and released between two frames, and treats a key
+    pressed just after one time step as if it had been pressed at the
+    start of the frame. Instead the game queues the KEYDOWN and KEYUP
+    events of the keys in KEY_ACTIONS as they arrive. Between frames it
+    sleeps in wait, which wakes up for each event, so events are timed
+    to within a millisecond or so rather than to the nearest frame.
+    pygame does not say when an event arrived, so an event which arrives
+    while the game is busy, such as while drawing a frame, can only be
+    timed when the game next collects events (see collect). It is given
+    the earliest time at which it can have arrived, the time at which
+    events were last collected, so that its latency is never
+    understated. The game collects events before drawing each frame, so
+    such latencies are overstated by at most the time taken to draw.
+
+    Each time step takes the events that arrived before the real time
+    at which the step ends (see action). A key pressed during a time
+    step acts in that step even if it was released again before the
+    step ended.
+
+    The latency of an input is the time from the arrival of its event
+    to the end of the pygame.display.update which first shows a frame
+    simulated with it. The game calls displayed after each update, and
+    the latencies of the last num_samples inputs are kept in a ring
+    buffer for stats.
+    '''
+    def __init__(self, num_samples=INPUT_SAMPLES):
+        self.num_samples = num_samples
+        # Events which have arrived but not been used by a time step,
+        # as (time, action bit, pressed) tuples.
+        self.events = deque()
+        # Other events which have arrived, for the game to handle.
+        self.other_events = []
+        # The action bits of the keys held down after the events used
+        # so far.
+        self.held = ACTION_NONE
+        # The (time, action bit) of the events used by time steps
+        # since the display was last updated.
+        self.applied = []
+        self.latencies = np.zeros(num_samples)
+        self.bits = np.zeros(num_samples, dtype=np.int64)
+        # The total number of inputs recorded so far.
+        self.count = 0
+        # The time at which events were last collected from pygame.
+        self.collected = time.perf_counter()
+
+
+    def reset(self, held=ACTION_NONE):
+        '''Forget the events queued so far, for a new game in which the
+        keys with the given action bits are already held down.'''
+        self.events.clear()
+        self.applied = []
+        self.held = held
+        self.collected = time.perf_counter()
+
+
+    def handle(self, event, when):
+        '''Queue an event which arrived at the given time.'''
+        if event.type in (KEYDOWN, KEYUP) and event.key in KEY_ACTIONS:
+            self.events.append((when, KEY_ACTIONS[event.key],
+                event.type == KEYDOWN))
+        else:
+            self.other_events.append(event)
+
+
+    def collect(self):
+        '''Queue the events waiting in pygame's event queue. They arrived
+        at some time since events were last collected, and are given
+        that time.'''
+        now = time.perf_counter()
+        for event in pygame.event.get():
+            self.handle(event, self.collected)
+        self.collected = now
+
+
+    def poll(self):
+        '''Queue the events which have arrived since they were last
+        collected. Returns the list of events which are not for the
+        keys in KEY_ACTIONS, such as QUIT.'''
+        self.collect()
+        other_events = self.other_events
+        self.other_events = []
+        return other_events
+
+
+    def wait(self, until):
+        '''Sleep until the given time (from time.perf_counter), queueing
+        each event as soon as it arrives.'''
+        self.collect()
+        while True:
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                return
+            event = pygame.event.wait(max(1, int(remaining * 1000)))
+            now = time.perf_counter()
+            if event.type != NOEVENT:
+                self.handle(event, now)
+            self.collected = now
+
+
+    def action(self, until):
+        '''Return the action for a time step which ends at the given
+        time: the keys held down at that time, and any keys pressed
+        during the step. Uses up the events which arrived before
+        then.'''
+        events = self.events
+        held = self.held
+        pressed = ACTION_NONE
+        while events and events[0][0] < until:
+            when, bit, down = events.popleft()
+            if down:
+                held |= bit
+                pressed |= bit
+            else:
+                held &= ~bit
+            self.applied.append((when, bit))
+        self.held = held
+        return held | pressed
+
+
+    def displayed(self):
+        '''Record the latency of the inputs used since the last call,
+        whose effects the display has just shown.'''
+        now = time.perf_counter()
+        for when, bit in self.applied:
+            slot = self.count % self.num_samples
+            self.latencies[slot] = now - when
+            self.bits[slot] = bit
+            self.count += 1
+        self.applied = []
+
+
+    def stats(self, percentiles=(50, 90, 99)):
+        '''Return a dictionary mapping 'all', and the name of each
+        action with recorded inputs, to a tuple of the given percentiles
+        of input latency in seconds.'''
+        count = min(self.count, self.num_samples)
+        latencies = self.latencies[:count]
+        bits = self.bits[:count]
+        result = {}
+        if count == 0:
+            return result
+        result['all'] = tuple(np.percentile(latencies, percentiles))
+        for bit, name in ACTION_NAMES.items():
+            chosen = latencies[bits == bit]
+            if len(chosen):
+                result[name] = tuple(np.percentile(chosen, percentiles))
+        return result
+
+
+    def report(self):
+        '''Return the input latency statistics as lines of text.'''
+        stats = self.stats()
+        if not stats:
+            return 'no inputs recorded'
+        lines = ['input    p50 ms  p90 ms  p99 ms']
+        for name in ('all',) + tuple(ACTION_NAMES.values()):
+            if name in stats:
+                lines.append('{:6s} {:8.1f} {:7.1f} {:7.1f}'.format(name,
+                    *(1000 * value for value in stats[name])))
+        lines.append('{} inputs'.format(self.count))
+        return '\n'.join(lines)
+
+
+def game_loop(window_surface, high_score, renderer=None, recorder=None,
+        profiler=None, render_fps=FPS, particles=None, aliens=None,
+        world=None, inputs=None):
+    '''Play the game until the player quits or they ship
+    crashes into a rock. This function is the interactive front end
+    to a World: it reads the keyboard, steps the world and draws the
+    result with the renderer (by default a FullScreenRenderer).
+    If a ReplayRecorder is given then the game is recorded. If a
+    FrameProfiler is given then every frame is timed, and the F3 key
+    shows or hides the profiler overlay. If a ParticleSystem is given
+    then exploding rocks throw out particles. If an AlienFleet (see
+    aliens.py) is given then alien ships join the game; such games
+    cannot be recorded. If a world is given, such as a LargeWorld (see
+    large_world.py), the game is played in it after resetting it,
+    rather than in a new World. The player's keys are read through an
+    InputQueue, which records input latency; pass one in to keep its
+    statistics from game to game.
+
+    The world is stepped FPS times per second of real time, however
+    fast frames are drawn. Frames are drawn render_fps times per
+    second (or fewer if the machine cannot keep up), or as fast as
+    possible if render_fps is 0. Each frame runs as many time steps as
+    are due, up to MAX_CATCH_UP_STEPS, and then draws the objects part
+    of the way between their previous and current positions according
+    to how far real time has got towards the next time step. Each time
+    step uses the keys pressed and released up to the real time at
+    which it ends.'''
+    if renderer is None:
+        renderer = FullScreenRenderer()
+    # The screen may have been drawn on since the last game.
+    renderer.reset()
+    if inputs is None:
+        inputs = InputQueue()
+    # Keys held down as the game starts count as pressed.
+    inputs.reset(read_action())
+    if world is None:
+        world = World()
+    else:
+        world.reset()
+    if recorder is not None:
+        recorder.start_game(world.seed)
+    world.profiler = profiler
+    renderer.profiler = profiler
+    if particles is not None:
+        particles.clear()
+    if aliens is not None:
+        aliens.reset()
+    # The length of one time step in seconds.
+    step_time = 1.0 / FPS
+    # The time between frames in seconds, or 0 to draw frames as fast as
+    # possible.
+    frame_time = 1.0 / render_fps if render_fps > 0 else 0.0
+    # The amount of real time not yet simulated.
+    lag = 0.0
+    previous_time = time.perf_counter()
+
+    # Loop indefinitely, handling game events.
+    while True:
+
+        frame_start = time.perf_counter()
+        if profiler is not None:
+            profiler.start_frame()
+
+        # Queue the player's key presses, and check if the player wants
+        # to quit the game.
+        for event in inputs.poll():
+            if event.type == QUIT:
+                terminate()
+            if event.type == KEYDOWN:
+                if event.key == K_ESCAPE:
+                    terminate()
+                elif event.key == K_F3 and profiler is not None:
+                    profiler.show_overlay = not profiler.show_overlay
+
+        current_time = time.perf_counter()
+        lag += current_time - previous_time
+        previous_time = current_time
+
+        # Advance the game by as many time steps as are due.
+        steps = 0
+        while lag >= step_time:
+            if steps == MAX_CATCH_UP_STEPS:
+                # Too far behind: forget the rest rather than spending
+                # ever longer catching up.
+                lag = 0.0
+                break
+            # Use the keys pressed up to the time this step ends.
+            action = inputs.action(current_time - lag + step_time)
+            _state, _reward, done = world.step(action)
+            if aliens is not None and not done:
+                aliens.step(world)
+                done = world.done
+                if profiler is not None:
+                    profiler.mark('aliens')
+            if recorder is not None:
+                recorder.record(action, world)
+            if done:
+                if recorder is not None:
+                    recorder.end_game()
+                return world.score
+            if particles is not None:
+                particles.explode(world.explosions)
+                particles.update()
+                if profiler is not None:
+                    profiler.mark('particles')
+            lag -= step_time
+            steps += 1
+
+        # Draw the new state of the game on the screen. Events which
+        # arrive while drawing can only be timed from here.
+        inputs.collect()
+        renderer.render(window_surface, world, high_score, lag / step_time,
+            particles, aliens)
+        inputs.displayed()
+        if profiler is not None:
+            profiler.end_frame(len(world.rocks), len(world.bullets))
+        # Wait for the next frame, timing key presses as they arrive.
+        inputs.wait(frame_start + frame_time)
+
+
+def run_headless(num_ticks, seed=None, swept_bullets=None,
+        rock_collisions=None):
+    '''Run the game without a display for num_ticks time steps, with
+    a player that presses random keys. Finished games are restarted.
+    The swept_bullets and rock_collisions arguments are passed on to
+    World. Returns the number of time steps simulated per second.'''
+    world = World(seed, swept_bullets, rock_collisions)
+    # The random player has its own generator so that it does not
+    # disturb the world's sequence of random numbers.
+    player = random.Random(seed)
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    start = time.perf_counter()
+    for _count in range(num_ticks):
+        _state, _reward, done = world.step(player.randint(0, max_action))
+        if done:
+            world.reset(player.randint(0, sys.maxsize))
+    elapsed = time.perf_counter() - start
+    return num_ticks / elapsed
+
+
+# First bytes of a replay file.
+REPLAY_MAGIC = b'ASTR'
+# Version of the replay file format. Replays are checked by simulating
+# them again, so the version changes whenever the rules of the game do.
+REPLAY_VERSION = 2
+
+
+class ReplayError(Exception):
+    '''A replay file is malformed, or replaying it produced a different
+    game from the one that was recorded.'''
+    pass
+
+
+class ReplayRecorder(object):
+    '''Record the games played in a session to a binary replay file.
+
+    The file starts with the four bytes REPLAY_MAGIC and a version byte.
+    Then each game is written as:
+       - the seed of the game (unsigned 64 bit integer)
+       - the number of time steps n (unsigned 32 bit integer)
+       - n bytes, each holding the ACTION_* bits for one time step
+       - n checksums of the game state after each time step
+         (unsigned 32 bit integers)
+    All integers are little endian. A game is written when it ends.
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(REPLAY_MAGIC + struct.pack('<B', REPLAY_VERSION))
+        self.seed = None
+        self.actions = bytearray()
+        self.checksums = array('I')
+
+
+    def start_game(self, seed):
+        '''Start recording a new game with the given seed.'''
+        self.seed = seed
+        self.actions = bytearray()
+        self.checksums = array('I')
+
+
+    def record(self, action, world):
+        '''Record the action for one time step, and the checksum of
+        the world after the step.'''
+        self.actions.append(action)
+        self.checksums.append(world.checksum())
+
+
+    def end_game(self):
+        '''Write the current game to the file.'''
+        if self.seed is None:
+            return
+        checksums = self.checksums
+        if sys.byteorder != 'little':
+            checksums = array('I', checksums)
+            checksums.byteswap()
+        self.file.write(struct.pack('<QI', self.seed, len(self.actions)))
+        self.file.write(self.actions)
+        self.file.write(checksums.tobytes())
+        self.file.flush()
+        self.seed = None
+
+
+    def close(self):
+        '''Write any unfinished game and close the file.'''
+        self.end_game()
+        self.file.close()
+
+
+def read_replay(path):
+    '''Read a replay file. Returns a list of (seed, actions, checksums)
+    tuples, one for each recorded game.'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    header_size = len(REPLAY_MAGIC) + 1
+    if data[:len(REPLAY_MAGIC)] != REPLAY_MAGIC:
+        raise ReplayError('{} is not a replay file'.format(path))
+    version = data[len(REPLAY_MAGIC)]
+    if version != REPLAY_VERSION:
+        raise ReplayError('unsupported replay version {}'.format(version))
+    games = []
+    offset = header_size
+    while offset < len(data):
+        if offset + 12 > len(data):
+            raise ReplayError('truncated replay file')
+        seed, num_ticks = struct.unpack_from('<QI', data, offset)
+        offset += 12
+        end = offset + 5 * num_ticks
+        if end > len(data):
+            raise ReplayError('truncated replay file')
+        actions = data[offset:offset + num_ticks]
+        checksums = array('I', data[offset + num_ticks:end])
+        if sys.byteorder != 'little':
+            checksums.byteswap()
+        games.append((seed, actions, checksums))
+        offset = end
+    return games
+
+
+def play_replay(path):
+    '''Re-simulate every game in a replay file as fast as possible,
+    without a display, checking the state checksum after every time
+    step. Raises ReplayError at the first difference. Returns a tuple
+    (num_ticks, ticks_per_second).'''
+    games = read_replay(path)
+    world = World(0)
+    num_ticks = 0
+    start = time.perf_counter()
+    for game, (seed, actions, checksums) in enumerate(games):
+        world.reset(seed)
+        for tick, (action, checksum) in enumerate(zip(actions, checksums)):
+            world.step(action)
+            if world.checksum() != checksum:
+                raise ReplayError('game {} differs from the recording at '
+                    'time step {}'.format(game, tick))
+        num_ticks += len(actions)
+    elapsed = time.perf_counter() - start
+    return num_ticks, num_ticks / elapsed if elapsed > 0 else 0.0
+
+
+def read_legacy_score(path):
+    '''Return the (score, time) in the high score file of older versions
+    of the game, using the time the file was written, or None if there
+    is no such file or it does not hold a positive score.'''
     try:
-        with open(HIGH_SCORE_FILE, 'w') as file:
-            file.write(str(score) + '\n')
-    except:
-        # Something bad happened when we tried to save 
-        # the high score file. We ignore it. 
-        pass
+        with open(path) as file:
+            score = int(next(file))
+        when = os.path.getmtime(path)
+    except (IOError, OSError, ValueError, StopIteration):
+        return None
+    return (score, when) if score > 0 else None
+
+
+class ScoreStore(object):
+    '''The table of the best scores, kept in an SQLite database.
+
+    Reading and writing the database is done by a background thread, so
+    that the game never waits for the disk. The best scores are read
+    when the store is created; until then (and if the database cannot
+    be used) the table is empty. Scores added with add appear in the
+    table straight away and are written to the database by the thread,
+    several at a time if they arrive faster than they can be written.
+
+    Several copies of the game may share one database. The database is
+    used in write-ahead log mode so that reading does not wait for
+    writing, and each batch of scores is added, and the table cut back
+    to the best max_scores, in one transaction. After each write the
+    table is read again, so it includes scores from other copies.
+
+    If the database has not been set up yet, the score in the high score
+    file of older versions of the game (legacy_path) is copied into it.
+
+    Errors using the database are reported on standard error, and the
+    store carries on with the scores it has. Call close to write any
+    remaining scores and stop the thread.
+    '''
+    def __init__(self, path=SCORE_DATABASE, max_scores=MAX_SCORES,
+            legacy_path=HIGH_SCORE_FILE):
+        self.path = path
+        self.max_scores = max_scores
+        self.legacy_path = legacy_path
+        # The best scores as (score, time) pairs, best first. The thread
+        # replaces the list rather than changing it, so it can be read
+        # without the lock.
+        self.scores = []
+        self.lock = threading.Lock()
+        # Set once the scores have been read from the database.
+        self.loaded = threading.Event()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run,
+            name='score writer', daemon=True)
+        self.thread.start()
+
+
+    def best(self):
+        '''Return the best score, or 0 if there are no scores.'''
+        scores = self.scores
+        return scores[0][0] if scores else 0
+
+
+    def add(self, score, when=None):
+        '''Add a score, made at the given time (by default now), without
+        waiting for it to be written.'''
+        if when is None:
+            when = time.time()
+        with self.lock:
+            self.scores = self._best(self.scores + [(score, when)])
+        self.pending.put((score, when))
+
+
+    def close(self):
+        '''Write any scores which have not been written yet, and stop
+        the thread.'''
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+
+
+    def _best(self, scores):
+        '''Return the best max_scores of a list of (score, time) pairs,
+        best first. Of equal scores the earliest is better.'''
+        return sorted(scores, key=lambda entry: (-entry[0], entry[1])
+            )[:self.max_scores]
+
+
+    def _run(self):
+        '''The body of the thread: open the database and then write
+        each batch of scores as they arrive, until close is called.'''
+        connection = None
+        try:
+            connection = self._open()
+            self._load(connection)
+        except sqlite3.Error as error:
+            self._report(error)
+        self.loaded.set()
+        batch = []
+        finished = False
+        while not finished:
+            # Wait for a score, then take every other score waiting.
+            item = self.pending.get()
+            while item is not None:
+                batch.append(item)
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+            finished = item is None
+            if connection is None:
+                batch = []
+                continue
+            try:
+                self._write(connection, batch)
+                batch = []
+                self._load(connection)
+            except sqlite3.Error as error:
+                # Keep the batch to try again with the next one.
+                self._report(error)
+        if connection is not None:
+            connection.close()
+
+
+    def _open(self):
+        '''Open the database, creating the table of scores and copying
+        in the legacy high score if that has not been done.'''
+        # Transactions are started explicitly, rather than by the
+        # sqlite3 module.
+        connection = sqlite3.connect(self.path, timeout=SCORE_LOCK_TIMEOUT,
+            isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        # Take the write lock before looking at the schema version, so
+        # that only one copy of the game sets up the database.
+        with self._transaction(connection):
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCORE_SCHEMA_VERSION:
+                connection.execute('CREATE TABLE IF NOT EXISTS scores ('
+                    'id INTEGER PRIMARY KEY, score INTEGER NOT NULL, '
+                    'time REAL NOT NULL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS scores_order '
+                    'ON scores (score DESC, time)')
+                legacy = read_legacy_score(self.legacy_path)
+                if legacy is not None:
+                    connection.execute('INSERT INTO scores (score, time) '
+                        'VALUES (?, ?)', legacy)
+                connection.execute('PRAGMA user_version = {}'.format(
+                    SCORE_SCHEMA_VERSION))
+        return connection
+
+
+    @contextmanager
+    def _transaction(self, connection):
+        '''Run the body of a with statement in an immediate transaction,
+        which holds the write lock from the start. The transaction is
+        rolled back if the body raises an exception.'''
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+    def _write(self, connection, batch):
+        '''Add a batch of scores in one transaction, keeping only the
+        best max_scores.'''
+        with self._transaction(connection):
+            connection.executemany('INSERT INTO scores (score, time) '
+                'VALUES (?, ?)', batch)
+            connection.execute('DELETE FROM scores WHERE id NOT IN '
+                '(SELECT id FROM scores ORDER BY score DESC, time LIMIT ?)',
+                (self.max_scores,))
+
+
+    def _load(self, connection):
+        '''Read the best scores from the database, merged with any added
+        since the last write.'''
+        stored = connection.execute('SELECT score, time FROM scores ORDER '
+            'BY score DESC, time LIMIT ?', (self.max_scores,)).fetchall()
+        with self.lock:
+            self.scores = self._best(list(set(self.scores) |
+                set(tuple(row) for row in stored)))
+
+
+    def _report(self, error):
+        '''Report an error using the database.'''
+        sys.stderr.write('score database {}: {}\n'.format(self.path, error))
+
+
+def read_best_scores(path=SCORE_DATABASE, max_scores=MAX_SCORES,
+        legacy_path=HIGH_SCORE_FILE):
+    '''Return the best max_scores scores in the database as (score, time)
+    pairs, best first, without changing it. The database is opened read
+    only, so it is not created if it does not exist; then the score in
+    the legacy high score file, if there is one, is the only score.
+    Errors using the database are reported on standard error.'''
+    if not os.path.exists(path):
+        legacy = read_legacy_score(legacy_path)
+        return [] if legacy is None else [legacy]
+    uri = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+    try:
+        connection = sqlite3.connect(uri, uri=True,
+            timeout=SCORE_LOCK_TIMEOUT)
+        try:
+            rows = connection.execute('SELECT score, time FROM scores ORDER '
+                'BY score DESC, time LIMIT ?', (max_scores,)).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as error:
+        sys.stderr.write('score database {}: {}\n'.format(path, error))
+        return []
+    return [tuple(row) for row in rows]
+
+
+def show_best_scores():
+    '''Print the table of best scores.'''
+    for rank, (score, when) in enumerate(read_best_scores(), 1):
+        print('{:2d}. {:8d}  {}'.format(rank, score,
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(when))))
 
 
 def terminate():
@@ -672,33 +3318,211 @@ def terminate():
     sys.exit()
 
 
+def non_negative_int(text):
+    '''Convert a command line argument to an integer of 0 or more.'''
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: {!r}'.format(
+            text))
+    if value < 0:
+        raise argparse.ArgumentTypeError('must not be negative: {}'.format(
+            value))
+    return value
+
+
+def parse_args():
+    '''Parse the command line arguments of the game.'''
+    parser = argparse.ArgumentParser(description='Asteroids game.')
+    parser.add_argument('--headless', metavar='TICKS', type=int,
+        help='simulate TICKS time steps without a display and '
+             'report the number of time steps per second')
+    parser.add_argument('--dirty-rects', action='store_true',
+        help='redraw only the parts of the screen that change')
+    parser.add_argument('--sprites', action='store_true',
+        help='draw rocks and the ship from pre-rendered sprites')
+    parser.add_argument('--no-particles', dest='particles',
+        action='store_false',
+        help='do not draw the debris of exploding rocks')
+    parser.add_argument('--aliens', metavar='COUNT', type=int, default=0,
+        help='number of alien ships which hunt the player (games with '
+             'aliens cannot be recorded)')
+    parser.add_argument('--large-world', metavar='CHUNKS', type=int,
+        nargs='?', const=0, default=None,
+        help='play in a scrolling field of CHUNKS by CHUNKS chunks (by '
+             'default WORLD_CHUNKS in large_world.py), without particles')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed for the random number generator in headless mode')
+    parser.add_argument('--swept-bullets', action='store_true',
+        default=None, help='use swept collision tests for bullets in '
+                           'headless mode')
+    parser.add_argument('--no-rock-collisions', dest='rock_collisions',
+        action='store_false', default=None,
+        help='let rocks pass through each other in headless mode')
+    parser.add_argument('--render-fps', type=non_negative_int, default=FPS,
+        help='number of frames to draw per second, or 0 to draw them as '
+             'fast as possible; the game itself always runs at {} time '
+             'steps per second'.format(FPS))
+    parser.add_argument('--profile', metavar='FILE',
+        help='time each phase of every frame and write the last frames '
+             'to FILE (CSV, or JSON if FILE ends with .json) on exit; '
+             'press F3 during the game to show the timings')
+    parser.add_argument('--input-latency', action='store_true',
+        help='report the time from each key press or release to the '
+             'first frame showing its effect on exit')
+    parser.add_argument('--record', metavar='FILE',
+        help='record the games played to a replay file')
+    parser.add_argument('--replay', metavar='FILE',
+        help='re-simulate the games in a replay file without a display '
+             'and check that they match the recording')
+    parser.add_argument('--startup-time', action='store_true',
+        help='report how long the game takes to start up and show its '
+             'first screen, then exit')
+    parser.add_argument('--scores', action='store_true',
+        help='show the table of best scores and exit')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+        help='join a multiplayer arena server (see multiplayer.py)')
+    args = parser.parse_args()
+    if args.aliens and args.record is not None:
+        parser.error('games with aliens cannot be recorded')
+    if args.aliens:
+        # Imported here because aliens imports this module.
+        from aliens import MAX_ALIENS
+        if args.aliens > MAX_ALIENS:
+            parser.error('at most {} aliens are allowed'.format(MAX_ALIENS))
+    if args.large_world is not None:
+        if args.record is not None:
+            parser.error('games in a large world cannot be recorded')
+        if args.aliens:
+            parser.error('aliens cannot join games in a large world')
+    return args
+
+
 def main():
     '''The entry point for the entire game.'''
-    # Initialise the pygame system.
-    pygame.init()
+    args = parse_args()
+    if args.headless is not None:
+        # Run the simulation without a window and report its speed.
+        ticks_per_second = run_headless(args.headless, args.seed,
+            args.swept_bullets, args.rock_collisions)
+        print('{:.0f} ticks/sec'.format(ticks_per_second))
+        return
+    if args.replay is not None:
+        # Check a recorded session as fast as possible.
+        try:
+            num_ticks, ticks_per_second = play_replay(args.replay)
+        except (IOError, ReplayError) as error:
+            sys.exit('replay failed: {}'.format(error))
+        print('replay ok: {} ticks at {:.0f} ticks/sec'.format(num_ticks,
+            ticks_per_second))
+        return
+    if args.scores:
+        show_best_scores()
+        return
+    if args.connect is not None:
+        # Imported here because multiplayer imports this module.
+        import multiplayer
+        multiplayer.run_client(*multiplayer.parse_address(args.connect))
+        return
+
+    startup = StartupTimer()
+    startup.mark('imports')
+    # Initialise the parts of the pygame system that the game uses.
+    init_pygame()
     # Create a window surface to act as the screen for the game
     window_surface = pygame.display.set_mode((MAX_X, MAX_Y), 0, 32)
     pygame.display.set_caption('asteroids')
-
-    # Try to read the saved game high score from file.
-    high_score = get_high_score()
+    startup.mark('window')
+    # Load the fonts once, rather than every time text is drawn. Only
+    # the fonts of the start screen are needed straight away; the rest
+    # are loaded in the background while the start screen is shown,
+    # along with the ship sprites if they are used.
+    fonts.load(LARGE_FONT_SIZE, SMALL_FONT_SIZE)
+    sprites = SpriteCache() if args.sprites else None
+    tasks = [lambda: fonts.load(SCORE_FONT, PROFILE_FONT_SIZE)]
+    if sprites is not None:
+        tasks.append(lambda: sprites.ship_atlas(SHIP_SIZE_MAJOR,
+            SHIP_SIZE_MINOR))
+    loader = BackgroundLoader(*tasks)
+
+    # Read the best scores in the background.
+    score_store = ScoreStore()
 
     # Show the start game info screen.
-    # Wait for the player to press a key. 
-    info_screen(window_surface, 'ASTEROIDS', 'press return key to start')
+    draw_info_screen(window_surface, 'ASTEROIDS', 'press return key to start')
+    startup.mark('first frame')
+    if args.startup_time:
+        # Report how long it took to get here, and to finish loading,
+        # without waiting for the player.
+        loader.wait()
+        score_store.loaded.wait()
+        startup.mark('loaded')
+        score_store.close()
+        print(startup.report())
+        return
+    # Wait for the player to press a key.
+    press_return_or_escape()
+    loader.wait()
+
+    # Choose how to draw the game.
+    if args.dirty_rects:
+        renderer = DirtyRectRenderer(sprites)
+    else:
+        renderer = FullScreenRenderer(sprites)
+
+    # Draw the debris of exploding rocks, unless asked not to.
+    particles = ParticleSystem() if args.particles else None
+    # Possibly add alien ships to the game.
+    aliens = None
+    if args.aliens:
+        # Imported here because aliens imports this module.
+        from aliens import AlienFleet
+        aliens = AlienFleet(args.aliens)
+    # Possibly play in a large scrolling field, whose particles would
+    # not follow the camera.
+    world = None
+    if args.large_world is not None:
+        # Imported here because large_world imports this module.
+        from large_world import LargeWorld, WORLD_CHUNKS
+        world = LargeWorld(world_chunks=args.large_world or WORLD_CHUNKS)
+        particles = None
+    # Possibly record the games to a replay file.
+    recorder = None
+    if args.record is not None:
+        recorder = ReplayRecorder(args.record)
+    # Possibly time the phases of each frame.
+    profiler = None
+    if args.profile is not None:
+        profiler = FrameProfiler(fps=args.render_fps)
+    # Read the player's keys, keeping latency statistics for the whole
+    # session.
+    inputs = InputQueue()
 
     # Keep playing the game until the player quits.
-    while True:
-        # Run the game loop.
-        new_score = game_loop(window_surface, high_score)
-        # Possibly update save high score.
-        if new_score > high_score:
-            high_score = new_score
-            save_high_score(high_score)
-        # Show the resume game info screen.
-        # Wait for the player to press a key.
-        info_screen(window_surface, 'GAME OVER',
-            'press return key to continue')
+    try:
+        while True:
+            # Run the game loop.
+            new_score = game_loop(window_surface, score_store.best(),
+                renderer, recorder, profiler, args.render_fps, particles,
+                aliens, world, inputs)
+            # Add the score to the table of best scores, which is saved
+            # in the background.
+            if new_score > 0:
+                score_store.add(new_score)
+            # Show the resume game info screen.
+            # Wait for the player to press a key.
+            info_screen(window_surface, 'GAME OVER',
+                'press return key to continue')
+    finally:
+        # Finish saving the scores.
+        score_store.close()
+        # Save the game in progress when the player quits.
+        if recorder is not None:
+            recorder.close()
+        if profiler is not None:
+            profiler.export(args.profile)
+        if args.input_latency:
+            print(inputs.report())
 
 
 if __name__ == '__main__':
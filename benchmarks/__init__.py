@@ -0,0 +1,25 @@
+'''
+Benchmarks for the simulation and rendering hot paths of the asteroids game.
+
+The benchmarks run without a window: SDL is told to use its dummy video
+driver and everything is drawn onto an off-screen surface. Run them from
+the top directory of the repository like so:
+
+    python -m benchmarks
+
+Each scenario is stepped for a number of time steps, and the time taken by
+each phase of every step is recorded. The results can be saved as a
+baseline and later runs compared against it:
+
+    python -m benchmarks --save-baseline baseline.json
+    python -m benchmarks --baseline baseline.json --tolerance 0.2
+
+The comparison exits with a non-zero status if the median time per step of
+any scenario is slower than the baseline by more than the tolerance.
+'''
+
+import os
+
+# Use SDL's dummy video driver so that no window is needed. This must be
+# done before pygame is initialised.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
@@ -0,0 +1,156 @@
+'''
+Run the benchmarks and report, save or compare the results.
+'''
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import pygame
+
+from benchmarks.scenarios import all_scenarios
+
+# Number of time steps run before timing starts, to warm up caches.
+WARMUP_TICKS = 2
+
+
+def percentile(sorted_values, fraction):
+    '''Return the value at the given fraction (between 0 and 1) of a
+    sorted list, using the nearest rank.'''
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarise(times):
+    '''Return summary statistics (in seconds) for a list of times.'''
+    ordered = sorted(times)
+    return {
+        'mean': statistics.mean(ordered),
+        'median': statistics.median(ordered),
+        'stdev': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'min': ordered[0],
+        'p95': percentile(ordered, 0.95),
+        'samples': len(ordered),
+    }
+
+
+def run_scenario(scenario, seed, tick_scale):
+    '''Run one scenario and return its results: summaries of the time
+    of each phase and of the whole time step, and the number of time
+    steps per second.'''
+    scenario.setup(seed)
+    phases = scenario.phases()
+    num_ticks = max(1, int(scenario.num_ticks * tick_scale))
+    phase_times = dict((name, []) for name, _function in phases)
+    tick_times = []
+    clock = time.perf_counter
+    for tick in range(WARMUP_TICKS + num_ticks):
+        tick_start = clock()
+        for name, function in phases:
+            start = clock()
+            function()
+            phase_times[name].append(clock() - start)
+        tick_times.append(clock() - tick_start)
+    # Discard the warm up time steps.
+    tick_times = tick_times[WARMUP_TICKS:]
+    result = {
+        'phases': dict((name, summarise(times[WARMUP_TICKS:]))
+            for name, times in phase_times.items()),
+        'tick': summarise(tick_times),
+    }
+    result['ticks_per_second'] = 1.0 / result['tick']['mean']
+    return result
+
+
+def print_result(name, result):
+    '''Print the results of one scenario in milliseconds.'''
+    tick = result['tick']
+    print('{:24s} {:10.0f} ticks/sec  median {:9.3f} ms  p95 {:9.3f} ms  '
+        'stdev {:8.3f} ms'.format(name, result['ticks_per_second'],
+        tick['median'] * 1e3, tick['p95'] * 1e3, tick['stdev'] * 1e3))
+    if len(result['phases']) > 1:
+        for phase, summary in result['phases'].items():
+            print('    {:20s} median {:9.3f} ms  p95 {:9.3f} ms'.format(
+                phase, summary['median'] * 1e3, summary['p95'] * 1e3))
+
+
+def compare(results, baseline, tolerance):
+    '''Compare results against a baseline. Returns the list of names
+    of scenarios whose median time step is slower than the baseline by
+    more than the tolerance (a fraction).'''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['tick']['median']
+        new = result['tick']['median']
+        change = (new - old) / old if old > 0 else 0.0
+        status = 'ok'
+        if change > tolerance:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print('{:24s} {:9.3f} ms -> {:9.3f} ms  {:+7.1%}  {}'.format(name,
+            old * 1e3, new * 1e3, change, status))
+    return regressions
+
+
+def main():
+    '''Run the benchmarks.'''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Benchmark the asteroids game without a display.')
+    parser.add_argument('scenarios', nargs='*',
+        help='names of the scenarios to run (default: all)')
+    parser.add_argument('--list', action='store_true',
+        help='list the scenarios and exit')
+    parser.add_argument('--seed', type=int, default=1,
+        help='seed for the random number generators')
+    parser.add_argument('--tick-scale', type=float, default=1.0,
+        help='multiply the number of time steps of every scenario')
+    parser.add_argument('--output', metavar='FILE',
+        help='write the results as JSON')
+    parser.add_argument('--save-baseline', metavar='FILE',
+        help='write the results as a baseline JSON file')
+    parser.add_argument('--baseline', metavar='FILE',
+        help='compare the results against a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='allowed slowdown against the baseline, as a fraction')
+    args = parser.parse_args()
+
+    scenarios = all_scenarios()
+    if args.list:
+        for scenario in scenarios:
+            print(scenario.name)
+        return
+    if args.scenarios:
+        known = set(scenario.name for scenario in scenarios)
+        unknown = [name for name in args.scenarios if name not in known]
+        if unknown:
+            parser.error('unknown scenarios: {}'.format(', '.join(unknown)))
+        scenarios = [scenario for scenario in scenarios
+            if scenario.name in args.scenarios]
+
+    pygame.init()
+    results = {}
+    for scenario in scenarios:
+        result = run_scenario(scenario, args.seed, args.tick_scale)
+        results[scenario.name] = result
+        print_result(scenario.name, result)
+
+    for path in (args.output, args.save_baseline):
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print()
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit('slower than baseline: {}'.format(', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
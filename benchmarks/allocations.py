@@ -0,0 +1,161 @@
+'''
+Measure the memory held by each time step of the game.
+
+For each time step of a World played by a random player (and the drawing
+of its frame) this reports the net number of memory blocks the step left
+allocated, by sys.getallocatedblocks, and the peak number of bytes
+allocated during the step above what was allocated before it, as traced
+by tracemalloc. Neither counts the blocks which are allocated and freed
+again within a step, so they show how much memory steps hold on to and
+how high it rises, not how many allocations they make.
+
+The peak of a whole step is the peak of its most expensive phase, which
+hides changes to the others, so the peak of each phase of World.step
+(those named in PROFILE_PHASES, then building the returned state) and of
+drawing is reported as well. Every NumPy operation which broadcasts its
+arrays allocates about 1.5 KB of scratch memory for its iterator, so no
+phase which uses one peaks much lower than that.
+
+To find the lines of code which hold on to memory, the lines whose
+traced memory grew the most over the whole run can be listed as well;
+memory which CPython keeps in free lists for reuse, such as that of
+small tuples, shows up there too. Run it from the top directory of the
+repository like so:
+
+    python -m benchmarks.allocations --ticks 2000 --top 10
+'''
+
+import argparse
+import random
+import sys
+import tracemalloc
+
+import numpy as np
+import pygame
+
+from asteroids import (World, MAX_X, MAX_Y, BLACK, ACTION_LEFT,
+    ACTION_RIGHT, ACTION_UP, ACTION_FIRE)
+
+# The phases whose peaks are measured: those of World.step which it
+# marks, then the rest of the step and drawing the frame.
+PHASES = ('input', 'spawn', 'bullets', 'rocks', 'state', 'draw')
+
+
+class PhasePeaks(object):
+    '''Stands in for the FrameProfiler of a World, recording the peak
+    bytes traced by tracemalloc in each phase of each time step, above
+    what was allocated when the phase began, and the peak of the whole
+    step above what was allocated when it began.'''
+    def __init__(self, num_ticks):
+        self.peaks = np.zeros((num_ticks, len(PHASES)), dtype=np.int64)
+        self.phase_index = {phase: index for index, phase in
+            enumerate(PHASES)}
+        self.tick = 0
+        self.before = 0
+        self.step_before = 0
+        self.step_peak = 0
+
+
+    def start(self, tick):
+        '''Start measuring the phases of the given time step.'''
+        self.tick = tick
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.get_traced_memory()[0]
+        self.step_before = self.before
+        self.step_peak = 0
+
+
+    def mark(self, phase):
+        '''Record the peak of the phase which has just finished.'''
+        current, peak = tracemalloc.get_traced_memory()
+        self.peaks[self.tick, self.phase_index[phase]] = peak - self.before
+        self.step_peak = max(self.step_peak, peak - self.step_before)
+        tracemalloc.reset_peak()
+        self.before = current
+
+
+def measure(num_ticks, seed, draw=True):
+    '''Step a World for num_ticks time steps with a random player.
+    Returns an array with the net number of memory blocks allocated by
+    each time step (by sys.getallocatedblocks, so blocks allocated and
+    freed within the step are not counted), an array with the peak bytes
+    allocated during each step as traced by tracemalloc, an array of
+    shape (num_ticks, len(PHASES)) with the peak bytes of each phase of
+    each step, and a list of tracemalloc.StatisticDiff objects for the
+    lines of the game whose traced memory grew the most between the end
+    of the first step and the end of the last, largest first.'''
+    world = World(seed)
+    player = random.Random(seed)
+    surface = pygame.Surface((MAX_X, MAX_Y))
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    # The results are stored in arrays allocated up front, so that
+    # recording them allocates nothing during the run.
+    blocks = np.zeros(num_ticks, dtype=np.int64)
+    peaks = np.zeros(num_ticks, dtype=np.int64)
+    phases = PhasePeaks(num_ticks)
+    world.profiler = phases
+    first = None
+    tracemalloc.start()
+    for count in range(num_ticks):
+        action = player.randint(0, max_action)
+        before_blocks = sys.getallocatedblocks()
+        phases.start(count)
+        _state, _reward, done = world.step(action)
+        phases.mark('state')
+        if draw:
+            surface.fill(BLACK)
+            world.draw(surface)
+            phases.mark('draw')
+        blocks[count] = sys.getallocatedblocks() - before_blocks
+        peaks[count] = phases.step_peak
+        if done:
+            world.reset(player.getrandbits(64))
+        if first is None:
+            # Leave out the memory allocated once, by the first step.
+            first = tracemalloc.take_snapshot()
+    last = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    if first is None:
+        return blocks, peaks, phases.peaks, []
+    # Leave out the memory of the measurement itself.
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)]
+    growth = last.filter_traces(filters).compare_to(
+        first.filter_traces(filters), 'lineno')
+    return blocks, peaks, phases.peaks, growth
+
+
+def main():
+    '''Report allocations per time step.'''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.allocations',
+        description='Measure memory allocated per asteroids time step.')
+    parser.add_argument('--ticks', type=int, default=2000,
+        help='number of time steps to measure')
+    parser.add_argument('--seed', type=int, default=1,
+        help='seed for the game and the random player')
+    parser.add_argument('--no-draw', action='store_true',
+        help='only step the world, without drawing it')
+    parser.add_argument('--top', type=int, default=0, metavar='LINES',
+        help='also list the LINES lines of code whose traced memory grew '
+             'the most over the run')
+    args = parser.parse_args()
+    blocks, peaks, phase_peaks, growth = measure(args.ticks, args.seed,
+        not args.no_draw)
+    print('blocks retained per step: mean {:.2f}'.format(np.mean(blocks)))
+    print('peak bytes per step:      mean {:.0f}  median {:.0f}  '
+        'max {}'.format(np.mean(peaks), np.median(peaks), np.max(peaks)))
+    print('peak bytes per phase:')
+    for index, phase in enumerate(PHASES):
+        if phase == 'draw' and args.no_draw:
+            continue
+        values = phase_peaks[:, index]
+        print('    {:<8} mean {:6.0f}  median {:6.0f}  max {:6d}'.format(
+            phase, np.mean(values), np.median(values), np.max(values)))
+    if args.top > 0:
+        print('largest growth over the run:')
+        for difference in growth[:args.top]:
+            print('    {}'.format(difference))
+
+
+if __name__ == '__main__':
+    main()
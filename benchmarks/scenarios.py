@@ -0,0 +1,278 @@
+'''
+Benchmark scenarios.
+
+A scenario sets up some game state and then runs a list of phases once
+per time step. Each phase is a (name, function) pair; the runner times
+every call of every phase separately.
+'''
+
+import random
+
+import pygame
+from pygame.math import Vector2
+
+from asteroids import (World, GameObject, Rock, Bullet, SpaceShip, MAX_X,
+    MAX_Y, MAX_ROCK_RADIUS, MIN_ROCK_RADIUS, bullet_hit_rock, ship_hit_rock,
+    spawn_offscreen_rocks, spawn_rocks_explosion, spawn_rock, show_score,
+    fonts, SCORE_FONT, BLACK, ParticleSystem)
+from aliens import AlienFleet
+
+
+def random_rocks(num_rocks, rng, radius=None):
+    '''Return num_rocks new Rock objects at random positions on the
+    screen. If radius is given then every rock has that radius.'''
+    rocks = []
+    for _count in range(num_rocks):
+        position = Vector2(rng.uniform(0, MAX_X), rng.uniform(0, MAX_Y))
+        if radius is None:
+            rock = spawn_rock(position, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS, rng)
+        else:
+            rock = spawn_rock(position, radius, radius + 1, rng)
+        rocks.append(rock)
+    return rocks
+
+
+class WorldScenario(object):
+    '''Step a World containing many rocks and bullets, timing each
+    phase of World.step and the drawing of the frame.
+
+    The ship is not allowed to end the game, so the scenario keeps the
+    same number of objects for its whole length. Each step the rocks are
+    topped up to num_rocks and the bullets to num_bullets. If aimed is
+    True each new bullet is placed just in front of a rock, so that
+    nearly every bullet hits something (an explosion storm). The
+    rock_collisions argument is passed on to World. If particles is True
+    the exploding rocks throw out particles, which are updated and drawn
+    as in the game. If num_aliens is more than 0 an AlienFleet of that
+    many aliens hunts the ship.
+    '''
+    def __init__(self, name, num_rocks, num_ticks, num_bullets=0,
+            rock_radius=None, aimed=False, rock_collisions=None,
+            particles=False, num_aliens=0):
+        self.name = name
+        self.num_rocks = num_rocks
+        self.num_ticks = num_ticks
+        self.num_bullets = num_bullets
+        self.rock_radius = rock_radius
+        self.aimed = aimed
+        self.rock_collisions = rock_collisions
+        self.particles = particles
+        self.num_aliens = num_aliens
+
+
+    def setup(self, seed):
+        '''Create the world and the off-screen surface.'''
+        self.rng = random.Random(seed)
+        self.world = World(seed, rock_collisions=self.rock_collisions)
+        self.world.rocks.extend(random_rocks(self.num_rocks, self.rng,
+            self.rock_radius))
+        self.surface = pygame.Surface((MAX_X, MAX_Y))
+        self.particle_system = ParticleSystem(seed=seed)
+        self.fleet = AlienFleet(self.num_aliens, seed=seed)
+        fonts.load(SCORE_FONT)
+
+
+    def refill(self):
+        '''Top up the rocks and bullets.'''
+        world = self.world
+        rng = self.rng
+        missing = self.num_rocks - len(world.rocks)
+        if missing > 0:
+            world.rocks.extend(random_rocks(missing, rng, self.rock_radius))
+        rocks = world.rocks
+        while len(world.bullets) < self.num_bullets:
+            direction = Vector2(1, 0).rotate(rng.uniform(0, 360))
+            if self.aimed and len(rocks):
+                # Put the bullet where its front will be at the centre
+                # of a rock once it has moved.
+                x, y = rocks.positions[rng.randrange(len(rocks))]
+                target = Vector2(float(x), float(y))
+                position = target - direction * 25
+            else:
+                position = Vector2(rng.uniform(0, MAX_X),
+                    rng.uniform(0, MAX_Y))
+            world.bullets.append(Bullet(position, direction))
+
+
+    def update_particles(self):
+        '''Throw out particles from the rocks which exploded in this step,
+        and move all the particles.'''
+        # World.step clears the explosions, but the scenario calls the
+        # phases of step directly.
+        world = self.world
+        self.particle_system.explode(world.explosions)
+        world.explosions.clear()
+        self.particle_system.update()
+
+
+    def phases(self):
+        '''Return the list of (name, function) phases of one step.'''
+        world = self.world
+        surface = self.surface
+        phases = [
+            ('refill', self.refill),
+            ('spawn', world.spawn_rocks),
+            ('bullets', world.update_bullets),
+            ('rocks', world.update_rocks),
+            ('ship', world.ship.move),
+            ('clear', lambda: surface.fill(BLACK)),
+            ('draw', lambda: world.draw(surface)),
+            ('score', lambda: show_score(surface, world.score, 0)),
+        ]
+        if self.particles:
+            particles = self.particle_system
+            phases[5:5] = [('particles', self.update_particles)]
+            phases.append(('draw_particles', lambda: particles.draw(surface)))
+        if self.num_aliens:
+            fleet = self.fleet
+            phases[5:5] = [('aliens', lambda: fleet.step(world))]
+            phases.append(('draw_aliens', lambda: fleet.draw(surface)))
+        return phases
+
+
+class CallScenario(object):
+    '''Time a single function of the game, calling it num_calls times
+    per step. The setup function takes a random.Random and returns the
+    arguments to call the function with.'''
+    def __init__(self, name, function, setup_args, num_calls, num_ticks):
+        self.name = name
+        self.function = function
+        self.setup_args = setup_args
+        self.num_calls = num_calls
+        self.num_ticks = num_ticks
+
+
+    def setup(self, seed):
+        '''Create the arguments for the function.'''
+        self.args = self.setup_args(random.Random(seed))
+
+
+    def phases(self):
+        '''Return the single phase, which calls the function
+        num_calls times.'''
+        function = self.function
+        args = self.args
+        calls = range(self.num_calls)
+        def call():
+            for _count in calls:
+                function(*args)
+        return [(self.function.__name__, call)]
+
+
+def one_rock(rng):
+    '''Return the arguments for GameObject.move: a random rock.'''
+    return random_rocks(1, rng)
+
+
+def bullet_and_rock(rng):
+    '''Return the arguments for bullet_hit_rock: a random bullet and a
+    random rock.'''
+    bullet = Bullet(Vector2(rng.uniform(0, MAX_X), rng.uniform(0, MAX_Y)),
+        Vector2(1, 0).rotate(rng.uniform(0, 360)))
+    return (bullet, random_rocks(1, rng)[0])
+
+
+def ship_and_rock(rng):
+    '''Return the arguments for ship_hit_rock: the ship of a new World
+    and a random rock.'''
+    world = World(rng.getrandbits(32))
+    return (world.ship, random_rocks(1, rng)[0])
+
+
+def surface_and_rock(rng):
+    '''Return the arguments for Rock.draw: a random rock and an
+    off-screen surface.'''
+    return (random_rocks(1, rng)[0], pygame.Surface((MAX_X, MAX_Y)))
+
+
+def surface_and_bullet(rng):
+    '''Return the arguments for Bullet.draw: a random bullet and an
+    off-screen surface.'''
+    bullet = Bullet(Vector2(rng.uniform(0, MAX_X), rng.uniform(0, MAX_Y)),
+        Vector2(1, 0).rotate(rng.uniform(0, 360)))
+    return (bullet, pygame.Surface((MAX_X, MAX_Y)))
+
+
+def surface_and_ship(rng):
+    '''Return the arguments for SpaceShip.draw: the ship of a new World
+    and an off-screen surface.'''
+    world = World(rng.getrandbits(32))
+    return (world.ship, pygame.Surface((MAX_X, MAX_Y)))
+
+
+def spawn_args(rng):
+    '''Return the arguments for spawn_offscreen_rocks: ten rocks.'''
+    return (10, rng)
+
+
+def explosion_args(rng):
+    '''Return the arguments for spawn_rocks_explosion: a large rock.'''
+    return (random_rocks(1, rng, MAX_ROCK_RADIUS - 10)[0], rng)
+
+
+def played_world(rng):
+    '''Return a World part way through a game of a player pressing
+    random keys, with 50 rocks added to make a busy scene.'''
+    world = World(rng.getrandbits(32))
+    for _count in range(100):
+        world.step(rng.randint(0, 15))
+        if world.done:
+            world.reset(rng.getrandbits(32))
+    world.rocks.extend(random_rocks(50, rng))
+    return world
+
+
+def world_args(rng):
+    '''Return the arguments for World.snapshot and World.fork: a World
+    part way through a game.'''
+    return (played_world(rng),)
+
+
+def restore_args(rng):
+    '''Return the arguments for World.restore: a new World and the
+    snapshot of a World part way through a game.'''
+    world = played_world(rng)
+    return (World(0), world.snapshot())
+
+
+def all_scenarios():
+    '''Return the list of all benchmark scenarios.'''
+    return [
+        WorldScenario('rocks_10', 10, num_ticks=2000),
+        WorldScenario('rocks_300', 300, num_ticks=500),
+        WorldScenario('rocks_1k', 1000, num_ticks=200),
+        # With this many rocks on the screen every rock overlaps
+        # thousands of others, so rocks do not collide with each other.
+        WorldScenario('rocks_10k', 10000, num_ticks=20,
+            rock_collisions=False),
+        WorldScenario('rocks_100k', 100000, num_ticks=5,
+            rock_collisions=False),
+        # These scenarios time the bullets, so rock collisions are left
+        # out of them.
+        WorldScenario('many_bullets', 1000, num_ticks=100, num_bullets=500,
+            rock_collisions=False),
+        WorldScenario('explosion_storm', 500, num_ticks=100, num_bullets=200,
+            rock_radius=MAX_ROCK_RADIUS - 10, aimed=True,
+            rock_collisions=False),
+        WorldScenario('particle_storm', 500, num_ticks=100, num_bullets=200,
+            rock_radius=MAX_ROCK_RADIUS - 10, aimed=True,
+            rock_collisions=False, particles=True),
+        WorldScenario('aliens_100', 50, num_ticks=200, num_aliens=100),
+        CallScenario('move', GameObject.move, one_rock, 1000, 100),
+        CallScenario('bullet_hit_rock', bullet_hit_rock, bullet_and_rock,
+            1000, 100),
+        CallScenario('ship_hit_rock', ship_hit_rock, ship_and_rock,
+            1000, 100),
+        CallScenario('spawn_offscreen_rocks', spawn_offscreen_rocks,
+            spawn_args, 100, 100),
+        CallScenario('spawn_rocks_explosion', spawn_rocks_explosion,
+            explosion_args, 100, 100),
+        CallScenario('world_snapshot', World.snapshot, world_args, 100, 100),
+        CallScenario('world_restore', World.restore, restore_args, 100, 100),
+        CallScenario('world_fork', World.fork, world_args, 100, 100),
+        CallScenario('rock_draw', Rock.draw, surface_and_rock, 1000, 100),
+        CallScenario('bullet_draw', Bullet.draw, surface_and_bullet,
+            1000, 100),
+        CallScenario('ship_draw', SpaceShip.draw, surface_and_ship,
+            1000, 100),
+    ]
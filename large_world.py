@@ -0,0 +1,454 @@
+'''
+A game of asteroids in a field many screens in size.
+
+A LargeWorld plays by the rules of asteroids.World, but its asteroid
+field is a square of world_chunks by world_chunks chunks, each
+CHUNK_SIZE units square, which wraps around at its edges. The screen
+is a camera which follows the ship, so the ship stays in the middle of
+the screen while the field scrolls past.
+
+Only the chunks near the ship are simulated every time step. They form
+the active window: a square of 2 * ACTIVE_RADIUS + 1 chunks on a side,
+centred on the chunk holding the ship, which extends well beyond the
+edges of the screen. Every other chunk is asleep:
+
+    - A chunk which has never been near the ship holds nothing at all.
+      When it first wakes, the state of its rocks at the start of the
+      game is generated from the seed of the world and the coordinates
+      of the chunk, and they are moved on from there like the rocks of
+      any other sleeping chunk.
+    - A chunk which has been near the ship is stored as the state of
+      its rocks (relative to the corner of the chunk) and the time step
+      at which it fell asleep.
+
+Rocks move in straight lines, so when a chunk wakes the positions of
+its rocks are computed directly from the time that has passed. While a
+chunk sleeps its rocks wrap around inside it, as rocks on the screen do
+in asteroids.World, so a sleeping chunk neither gains nor loses rocks.
+Likewise rocks which leave the active window wrap around to its
+opposite side; the edges of the window are never on the screen. When
+the ship moves into another chunk the window moves with it: the chunks
+it leaves fall asleep with the rocks that are in them, and the chunks
+it reaches wake up.
+
+So each time step costs time in proportion to the number of rocks in
+the active window, and the memory used grows with the area the ship has
+visited, however large the field is.
+
+The active window has its own coordinates, whose origin is the corner
+of its first chunk. The ship, bullets and rocks of a LargeWorld are
+kept in these coordinates, which change whenever the window moves;
+world_position converts them to coordinates in the whole field.
+
+Rocks in a LargeWorld pass through each other. Games in a large world
+cannot be recorded. To measure the speed of time steps as the field
+grows:
+
+    python large_world.py --chunks 16 256 4096 --ticks 2000
+'''
+
+import argparse
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+import pygame
+from pygame.math import Vector2
+
+from asteroids import (SpaceShip, Bullet, RockField, GameState, MAX_X, MAX_Y,
+    MAX_BULLETS, ROTATE_ANGLE, MIN_ROCK_RADIUS, MAX_ROCK_RADIUS,
+    SHIP_SIZE_MAJOR, SHIP_SIZE_MINOR, ACTION_LEFT, ACTION_RIGHT, ACTION_UP,
+    ACTION_FIRE, score_hit, spawn_rock, spawn_rocks_explosion)
+
+# Width and height of a chunk of the field.
+CHUNK_SIZE = 400
+# Number of chunks on each side of the chunk holding the ship which are
+# simulated every time step. The active window must reach well beyond
+# the edges of the screen.
+ACTIVE_RADIUS = 2
+# Default number of chunks along each side of the field.
+WORLD_CHUNKS = 256
+# Range of the number of rocks in a newly generated chunk.
+MIN_CHUNK_ROCKS = 1
+MAX_CHUNK_ROCKS = 3
+# Rocks are not generated within this distance of the ship when a game
+# starts.
+START_CLEARANCE = 3 * MAX_ROCK_RADIUS
+
+# A sleeping chunk: the time step at which it fell asleep and the state
+# of its rocks at that time. Offsets are the positions of the rocks
+# relative to the top left corner of the chunk.
+SleepingChunk = namedtuple('SleepingChunk', ['tick', 'offsets', 'velocities',
+    'radii', 'colours'])
+
+
+class LargeWorld(object):
+    '''The state of one game in a large field of rocks, and the rules
+    for advancing it. It has the same interface as asteroids.World for
+    playing a game: reset, step (with the ACTION_* bits), state and
+    draw, and the score, ship, bullets, rocks, done and profiler
+    attributes.
+
+    The rocks of the active window are kept in a RockField. The
+    sleeping chunks which have been active are kept in the chunks
+    dictionary, keyed by (column, row) in the field.
+    '''
+    def __init__(self, seed=None, world_chunks=WORLD_CHUNKS):
+        if world_chunks < 2 * ACTIVE_RADIUS + 1:
+            raise ValueError('a large world needs at least {} chunks on a '
+                'side'.format(2 * ACTIVE_RADIUS + 1))
+        self.world_chunks = world_chunks
+        self.window_chunks = 2 * ACTIVE_RADIUS + 1
+        self.window_size = self.window_chunks * CHUNK_SIZE
+        # An optional FrameProfiler which times the phases of step.
+        self.profiler = None
+        self.reset(seed)
+
+
+    def reset(self, seed=None):
+        '''Start a new game with the ship in the middle of the field.
+        If seed is None a random seed is chosen by the operating system.
+        Returns the initial GameState.'''
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.score = 0
+        self.ticks = 0
+        self.done = False
+        self.chunks = {}
+        # The field coordinates of the first chunk of the active window.
+        centre = self.world_chunks // 2
+        self.origin = (centre - ACTIVE_RADIUS, centre - ACTIVE_RADIUS)
+        middle = ACTIVE_RADIUS * CHUNK_SIZE + CHUNK_SIZE / 2
+        self.ship = SpaceShip(Vector2(middle, middle),
+            rotation=self.rng.randint(0, 359), speed=1,
+            size_major=SHIP_SIZE_MAJOR, size_minor=SHIP_SIZE_MINOR)
+        self.bullets = []
+        self.rocks = RockField()
+        for column in range(self.window_chunks):
+            for row in range(self.window_chunks):
+                self.wake(column, row)
+        # Clear a space around the ship to start in.
+        delta = self.rocks.positions - (middle, middle)
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        self.rocks.remove(distance < START_CLEARANCE + self.rocks.radii)
+        return self.state()
+
+
+    def chunk_key(self, column, row):
+        '''Return the field coordinates of the chunk at (column, row)
+        in the active window.'''
+        return ((self.origin[0] + column) % self.world_chunks,
+            (self.origin[1] + row) % self.world_chunks)
+
+
+    def world_position(self, position):
+        '''Convert a position in the active window to a position in the
+        whole field.'''
+        size = self.world_chunks * CHUNK_SIZE
+        return ((self.origin[0] * CHUNK_SIZE + position[0]) % size,
+            (self.origin[1] * CHUNK_SIZE + position[1]) % size)
+
+
+    def generate(self, key):
+        '''Return the rocks of the chunk with the given field
+        coordinates at the start of the game, as a SleepingChunk. They
+        depend only on the seed of the world and the key.'''
+        rng = random.Random('{}:{}:{}'.format(self.seed, key[0], key[1]))
+        rocks = [spawn_rock(Vector2(rng.uniform(0, CHUNK_SIZE),
+            rng.uniform(0, CHUNK_SIZE)), MIN_ROCK_RADIUS, MAX_ROCK_RADIUS, rng)
+            for _count in range(rng.randint(MIN_CHUNK_ROCKS, MAX_CHUNK_ROCKS))]
+        return SleepingChunk(0,
+            np.array([(rock.position.x, rock.position.y) for rock in rocks]),
+            np.array([(rock.velocity.x, rock.velocity.y) for rock in rocks]),
+            np.array([rock.radius for rock in rocks], dtype=np.int64),
+            np.array([rock.colour for rock in rocks], dtype=np.uint8))
+
+
+    def wake(self, column, row):
+        '''Add the rocks of the chunk at (column, row) in the active
+        window to the rocks being simulated, at the positions they have
+        reached by now.'''
+        key = self.chunk_key(column, row)
+        chunk = self.chunks.pop(key, None)
+        if chunk is None:
+            chunk = self.generate(key)
+        if len(chunk.radii) == 0:
+            return
+        offsets = np.mod(chunk.offsets + chunk.velocities *
+            (self.ticks - chunk.tick), CHUNK_SIZE)
+        self.rocks.add(offsets + (column * CHUNK_SIZE, row * CHUNK_SIZE),
+            chunk.velocities, chunk.radii, chunk.colours)
+
+
+    def sleep(self, asleep):
+        '''Put the chunks of the active window for which the boolean
+        array asleep (indexed by column and row) is True to sleep, and
+        remove their rocks from the rocks being simulated. Each rock
+        sleeps in the chunk it is in now.'''
+        rocks = self.rocks
+        cells = np.clip(np.floor(rocks.positions / CHUNK_SIZE).astype(np.int64),
+            0, self.window_chunks - 1)
+        for column, row in zip(*np.nonzero(asleep)):
+            inside = (cells[:, 0] == column) & (cells[:, 1] == row)
+            corner = (column * CHUNK_SIZE, row * CHUNK_SIZE)
+            self.chunks[self.chunk_key(column, row)] = SleepingChunk(
+                self.ticks, rocks.positions[inside] - corner,
+                rocks.velocities[inside].copy(), rocks.radii[inside].copy(),
+                rocks.colours[inside].copy())
+        leaving = asleep[cells[:, 0], cells[:, 1]]
+        if leaving.any():
+            rocks.remove(leaving)
+
+
+    def follow_ship(self):
+        '''Move the active window if the ship has left its middle chunk:
+        put the chunks that are left behind to sleep, shift everything
+        into the coordinates of the new window, and wake the chunks that
+        the window now reaches.'''
+        ship = self.ship
+        shift_x = int(ship.position.x // CHUNK_SIZE) - ACTIVE_RADIUS
+        shift_y = int(ship.position.y // CHUNK_SIZE) - ACTIVE_RADIUS
+        if shift_x == 0 and shift_y == 0:
+            return
+        last = self.window_chunks - 1
+        # A chunk stays in the window if its column and row are both
+        # still in range once the window has moved.
+        index = np.arange(self.window_chunks)
+        columns = (index - shift_x >= 0) & (index - shift_x <= last)
+        rows = (index - shift_y >= 0) & (index - shift_y <= last)
+        self.sleep(~(columns[:, np.newaxis] & rows[np.newaxis, :]))
+        offset = Vector2(shift_x * CHUNK_SIZE, shift_y * CHUNK_SIZE)
+        self.rocks.positions[:] -= (offset.x, offset.y)
+        self.rocks.previous_positions[:] -= (offset.x, offset.y)
+        for item in [ship] + self.bullets:
+            item.position -= offset
+            item.previous_position -= offset
+        # The cached points of the ship are for its old position.
+        ship._points_key = None
+        self.origin = ((self.origin[0] + shift_x) % self.world_chunks,
+            (self.origin[1] + shift_y) % self.world_chunks)
+        for column in range(self.window_chunks):
+            for row in range(self.window_chunks):
+                # Skip the chunks that were in the window before it
+                # moved.
+                if (0 <= column + shift_x <= last
+                        and 0 <= row + shift_y <= last):
+                    continue
+                self.wake(column, row)
+
+
+    def state(self):
+        '''Return a GameState describing the current state of the world,
+        with positions in the coordinates of the whole field. Only the
+        rocks of the active window are included.'''
+        ship = self.ship
+        rock_positions = [self.world_position(position)
+            for position in self.rocks.positions.tolist()]
+        return GameState(
+            score=self.score,
+            ship_position=self.world_position(ship.position),
+            ship_velocity=(ship.velocity.x, ship.velocity.y),
+            ship_rotation=ship.rotation,
+            bullets=tuple(self.world_position(bullet.position) + (bullet.age,)
+                for bullet in self.bullets),
+            rocks=tuple((x, y, radius) for (x, y), radius in
+                zip(rock_positions, self.rocks.radii.tolist())))
+
+
+    def step(self, action):
+        '''Advance the game by one time step using the player's action.
+        Returns a tuple (state, reward, done), as World.step does.'''
+        if self.done:
+            return self.state(), 0, True
+        profiler = self.profiler
+        old_score = self.score
+        self.ticks += 1
+        self.apply_action(action)
+        if profiler is not None:
+            profiler.mark('input')
+        self.follow_ship()
+        if profiler is not None:
+            profiler.mark('spawn')
+        self.update_bullets()
+        if profiler is not None:
+            profiler.mark('bullets')
+        self.done = self.update_rocks()
+        if not self.done:
+            self.move(self.ship)
+        if profiler is not None:
+            profiler.mark('rocks')
+        return self.state(), self.score - old_score, self.done
+
+
+    def apply_action(self, action):
+        '''Turn, accelerate and fire the ship according to the action,
+        as World.apply_action does.'''
+        ship = self.ship
+        if action & ACTION_LEFT:
+            ship.turn_left(ROTATE_ANGLE)
+        if action & ACTION_RIGHT:
+            ship.turn_right(ROTATE_ANGLE)
+        if action & ACTION_UP:
+            ship.accelerate(1)
+        if action & ACTION_FIRE and len(self.bullets) < MAX_BULLETS:
+            self.bullets.append(Bullet(ship.position,
+                Vector2(1, 0).rotate(ship.rotation)))
+
+
+    def move(self, item):
+        '''Move the ship or a bullet by its velocity. Unlike
+        GameObject.move this does not wrap: the ship is always in the
+        middle chunk of the active window, and bullets die long before
+        they could reach its edge.'''
+        item.previous_position.update(item.position)
+        item.position += item.velocity
+
+
+    def update_bullets(self):
+        '''Age and move the bullets, and destroy the rocks which contain
+        the front of a bullet, as World.update_bullets does.'''
+        rocks = self.rocks
+        moved_bullets = []
+        for bullet in self.bullets:
+            bullet.time_step()
+            if bullet.alive():
+                self.move(bullet)
+                moved_bullets.append(bullet)
+        self.bullets = []
+        if not moved_bullets or len(rocks) == 0:
+            self.bullets = moved_bullets
+            return
+        inside = rocks.contains_points([bullet.front()
+            for bullet in moved_bullets])
+        hit_rocks = np.zeros(len(rocks), dtype=bool)
+        spawned_rocks = []
+        for bullet, touched in zip(moved_bullets, inside):
+            hits = np.flatnonzero(touched & ~hit_rocks)
+            if len(hits) == 0:
+                self.bullets.append(bullet)
+                continue
+            index = int(hits[0])
+            rock = rocks[index]
+            self.score += score_hit(rock.radius)
+            if rock.radius > MIN_ROCK_RADIUS:
+                spawned_rocks.extend(spawn_rocks_explosion(rock, self.rng))
+            hit_rocks[index] = True
+        if hit_rocks.any():
+            rocks.remove(hit_rocks)
+        rocks.extend(spawned_rocks)
+
+
+    def update_rocks(self):
+        '''Move all the rocks of the active window, wrapping around at
+        its edges, and check whether any of them collide with the ship.
+        Returns True if the ship crashed.'''
+        rocks = self.rocks
+        positions = rocks.positions
+        rocks.previous_positions[:] = positions
+        positions += rocks.velocities
+        np.mod(positions, self.window_size, out=positions)
+        return rocks.any_hit(self.ship.points())
+
+
+    def draw(self, window_surface, sprites=None, alpha=1.0):
+        '''Draw the part of the field around the ship on the supplied
+        surface, with the ship in the middle, as World.draw does. Only
+        the rocks which overlap the screen are drawn. Returns the list
+        of rectangles of the surface that were drawn on.'''
+        ship = self.ship
+        interpolate = alpha < 1.0
+        if interpolate:
+            centre = ship.previous_position + (ship.position -
+                ship.previous_position) * alpha
+        else:
+            centre = ship.position
+        camera = Vector2(centre.x - MAX_X / 2, centre.y - MAX_Y / 2)
+        rects = []
+        for bullet in self.bullets:
+            position = bullet.position
+            if interpolate:
+                position = bullet.previous_position + (position -
+                    bullet.previous_position) * alpha
+            rects.append(bullet.draw(window_surface, position - camera))
+
+        rocks = self.rocks
+        positions = rocks.positions
+        if interpolate:
+            positions = rocks.previous_positions + (positions -
+                rocks.previous_positions) * alpha
+            # Rocks which wrapped around the active window are far from
+            # the screen, so they need no special care.
+        positions = positions - (camera.x, camera.y)
+        radii = rocks.radii
+        visible = np.flatnonzero((positions[:, 0] > -radii)
+            & (positions[:, 0] < MAX_X + radii) & (positions[:, 1] > -radii)
+            & (positions[:, 1] < MAX_Y + radii))
+        for (x, y), radius, (red, green, blue) in zip(
+                positions[visible].tolist(), radii[visible].tolist(),
+                rocks.colours[visible].tolist()):
+            center = (int(x), int(y))
+            colour = (red, green, blue)
+            if sprites is None:
+                rects.append(pygame.draw.circle(window_surface, colour,
+                    center, radius))
+            else:
+                rects.append(sprites.draw_rock(window_surface, center,
+                    radius, colour))
+
+        position = Vector2(MAX_X / 2, MAX_Y / 2)
+        if sprites is None:
+            rects.append(ship.draw(window_surface, position))
+        else:
+            rects.append(sprites.draw_ship(window_surface, ship, position))
+        return rects
+
+
+def run_large_headless(world_chunks, num_ticks, seed=None):
+    '''Fly a ship through a large world of world_chunks by
+    world_chunks chunks for num_ticks time steps, with a player that
+    keeps accelerating and presses random keys. The ship cannot crash,
+    so it keeps crossing into new chunks. Returns a tuple
+    (ticks_per_second, active_rocks, sleeping_chunks, sleeping_rocks)
+    at the end of the run.'''
+    world = LargeWorld(seed, world_chunks)
+    player = random.Random(seed)
+    start = time.perf_counter()
+    for _count in range(num_ticks):
+        world.step(ACTION_UP | player.choice((0, ACTION_LEFT, ACTION_RIGHT,
+            ACTION_FIRE)))
+        world.done = False
+    elapsed = time.perf_counter() - start
+    sleeping_rocks = sum(len(chunk.radii) for chunk in world.chunks.values())
+    return (num_ticks / elapsed, len(world.rocks), len(world.chunks),
+        sleeping_rocks)
+
+
+def main():
+    '''Report the speed of time steps in large worlds of several
+    sizes.'''
+    parser = argparse.ArgumentParser(
+        description='Measure the speed of large worlds.')
+    parser.add_argument('--chunks', type=int, nargs='+',
+        default=[16, 256, 4096],
+        help='numbers of chunks along each side of the field')
+    parser.add_argument('--ticks', type=int, default=2000,
+        help='number of time steps to simulate')
+    parser.add_argument('--seed', type=int, default=1,
+        help='seed for the world and the player')
+    args = parser.parse_args()
+    print('   chunks      screens  ticks/sec  active rocks  sleeping chunks '
+        ' sleeping rocks')
+    for world_chunks in args.chunks:
+        ticks_per_second, active, sleeping, sleeping_rocks = (
+            run_large_headless(world_chunks, args.ticks, args.seed))
+        screens = (world_chunks * CHUNK_SIZE) ** 2 / float(MAX_X * MAX_Y)
+        print('{:9d} {:12.0f} {:10.0f} {:13d} {:16d} {:15d}'.format(
+            world_chunks, screens, ticks_per_second, active, sleeping,
+            sleeping_rocks))
+
+
+if __name__ == '__main__':
+    main()
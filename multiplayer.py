@@ -0,0 +1,913 @@
+'''
+Play asteroids with several players in one arena over the network.
+
+An arena server runs the authoritative simulation of one shared field of
+rocks with a ship for every player. Players steer, accelerate and fire
+as in the single player game, shooting rocks scores points for the
+player who fired (via score_hit), and a ship which crashes into a rock
+starts again in the middle of the screen with a score of zero. Ships and
+bullets pass through each other.
+
+Clients and the server talk over UDP using asyncio. Every time step a
+client sends the keys its player is holding down, together with the
+number of the last snapshot it received. Every time step the server
+sends each client a snapshot of the arena, delta encoded against the
+last snapshot that client acknowledged: only the objects which appeared,
+disappeared or changed since then are sent, and for changed objects only
+the fields which changed, as 8 bit differences when they are small.
+Positions are sent in quarter pixels and angles in 1/65536 of a turn.
+Clients which acknowledged the same snapshot get the same encoding, so
+the server encodes each snapshot only a few times however many players
+there are.
+
+To run a server, and join it from the game (on the same or another
+machine):
+
+    python multiplayer.py server --port 9999
+    python asteroids.py --connect localhost:9999
+
+To add some players which press random keys:
+
+    python multiplayer.py bots --connect localhost:9999 --count 4
+
+To measure the server's time step and the bandwidth per client as the
+number of players grows, with the server and bot clients talking over
+the loopback interface:
+
+    python multiplayer.py bench --players 1 4 16 64 --ticks 400
+'''
+
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pygame
+from pygame.locals import QUIT, KEYDOWN, K_ESCAPE
+
+from asteroids import (MAX_X, MAX_Y, START_X, START_Y, FPS, BLACK, RED,
+    GREEN, BLUE, BULLET_LENGTH, BULLET_WIDTH, MIN_ROCK_RADIUS,
+    MIN_NUM_ROCKS, MAX_BULLETS, ROTATE_ANGLE, SCORE_FONT, ACTION_NONE,
+    ACTION_LEFT, ACTION_RIGHT, ACTION_UP, ACTION_FIRE, ROCK_COLLISIONS,
+    SHIP_SIZE_MAJOR, SHIP_SIZE_MINOR, Bullet, SpaceShip, RockField, Vector2,
+    fonts, init_pygame, read_action, score_hit, show_score,
+    spawn_offscreen_rocks, spawn_rocks_explosion)
+
+# Default UDP port of the arena server.
+DEFAULT_PORT = 9999
+# Maximum number of players in one arena.
+MAX_PLAYERS = 64
+# Number of recent snapshots kept for each client, which the server can
+# delta encode against and the client can decode against.
+SNAPSHOT_HISTORY = 64
+# Seconds without hearing from a client after which it is dropped.
+CLIENT_TIMEOUT = 5.0
+# Seconds between server statistics reports.
+REPORT_INTERVAL = 5.0
+# Positions are sent in units of 1/POSITION_SCALE pixels.
+POSITION_SCALE = 4
+# Angles are sent in units of 1/ANGLE_UNITS of a turn.
+ANGLE_UNITS = 65536
+# Baseline tick of a snapshot which is not delta encoded.
+NO_BASELINE = 0xFFFFFFFF
+
+# The first byte of each message says what kind of message it is.
+# Client to server: join the arena.
+JOIN = b'J'
+# Client to server: leave the arena.
+LEAVE = b'L'
+# Client to server: the player's action, and the last snapshot received.
+INPUT = b'I'
+# Server to client: the player number of the client.
+WELCOME = b'W'
+# Server to client: a snapshot of the arena.
+SNAPSHOT = b'S'
+
+# The kinds of object in a snapshot, in the order they are sent, and
+# the name and wire type (a NumPy dtype) of each of their fields.
+SNAPSHOT_FIELDS = OrderedDict([
+    ('ships', (('x', '<i2'), ('y', '<i2'), ('rotation', '<u2'),
+        ('score', '<u4'))),
+    ('bullets', (('x', '<i2'), ('y', '<i2'), ('rotation', '<u2'))),
+    ('rocks', (('x', '<i2'), ('y', '<i2'), ('radius', 'u1'),
+        ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'))),
+])
+
+# The objects of one kind in a snapshot: ids is an array of object
+# numbers in increasing order, and values is an integer array with one
+# row per object and one column per field.
+EntityTable = namedtuple('EntityTable', ['ids', 'values'])
+
+# The state of an arena at one time step. Entities maps each kind in
+# SNAPSHOT_FIELDS to an EntityTable.
+Snapshot = namedtuple('Snapshot', ['tick', 'entities'])
+
+
+class ProtocolError(Exception):
+    '''A message could not be decoded.'''
+
+
+def empty_table(kind):
+    '''Return an EntityTable with no objects of the given kind.'''
+    return EntityTable(np.zeros(0, dtype=np.int64),
+        np.zeros((0, len(SNAPSHOT_FIELDS[kind])), dtype=np.int64))
+
+
+def quantize_angle(degrees):
+    '''Convert angles in degrees (a number or an array) to the units
+    in which they are sent.'''
+    return np.round(np.mod(degrees, 360) * (ANGLE_UNITS / 360.0)).astype(
+        np.int64) % ANGLE_UNITS
+
+
+def encode_table(table, base, fields):
+    '''Encode the objects of one kind, relative to the objects of the
+    same kind in a baseline snapshot (which the receiver already has).
+    Returns a list of byte strings.
+
+    The encoding is column oriented, and in order holds:
+       - a bitmap with a bit set for each baseline object which is gone
+       - the number of new objects, their ids, and then for each field
+         the values of the new objects
+       - a bitmap with a bit set for each remaining baseline object
+         which changed, and one byte for each changed object with a bit
+         set for each field that changed
+       - for each field which changed in any object, a byte which is 1
+         if the new values are sent as 8 bit differences from the
+         baseline values (when they all fit) or 0 if they are sent
+         whole, followed by the values of the objects which have that
+         field's bit set.'''
+    ids, values = table
+    bits = 1 << np.arange(len(fields))
+    in_table = np.isin(base.ids, ids, assume_unique=True)
+    is_new = ~np.isin(ids, base.ids, assume_unique=True)
+    # The objects in both are in the same order in both tables.
+    base_values = base.values[in_table]
+    kept_values = values[~is_new]
+    masks = ((kept_values != base_values) * bits).sum(axis=1)
+    updated = masks != 0
+    new_values = values[is_new]
+    parts = [np.packbits(~in_table).tobytes(),
+        struct.pack('<H', int(is_new.sum())),
+        ids[is_new].astype('<u4').tobytes()]
+    for column, (_name, dtype) in enumerate(fields):
+        parts.append(new_values[:, column].astype(dtype).tobytes())
+    masks = masks[updated]
+    parts.append(np.packbits(updated).tobytes())
+    parts.append(masks.astype('u1').tobytes())
+    kept_values = kept_values[updated]
+    base_values = base_values[updated]
+    for column, (_name, dtype) in enumerate(fields):
+        has_field = (masks & bits[column]) != 0
+        if not has_field.any():
+            continue
+        column_values = kept_values[has_field, column]
+        difference = column_values - base_values[has_field, column]
+        if difference.min() >= -128 and difference.max() <= 127:
+            parts.append(b'\x01')
+            parts.append(difference.astype('i1').tobytes())
+        else:
+            parts.append(b'\x00')
+            parts.append(column_values.astype(dtype).tobytes())
+    return parts
+
+
+def decode_table(data, offset, base, fields):
+    '''Decode the objects of one kind encoded by encode_table, starting
+    at offset in data. Returns the EntityTable and the offset of the
+    end of the encoding.'''
+    def read(dtype, count):
+        # Read count values of the given type, moving the offset on.
+        nonlocal offset
+        array = np.frombuffer(data, dtype, count, offset)
+        offset += count * array.itemsize
+        return array
+
+    num_base = len(base.ids)
+    gone = np.unpackbits(read('u1', (num_base + 7) // 8),
+        count=num_base).astype(bool)
+    kept_ids = base.ids[~gone]
+    kept_values = base.values[~gone].copy()
+    num_new = struct.unpack_from('<H', data, offset)[0]
+    offset += 2
+    new_ids = read('<u4', num_new).astype(np.int64)
+    new_values = np.zeros((num_new, len(fields)), dtype=np.int64)
+    for column, (_name, dtype) in enumerate(fields):
+        new_values[:, column] = read(dtype, num_new)
+    updated = np.unpackbits(read('u1', (len(kept_ids) + 7) // 8),
+        count=len(kept_ids)).astype(bool)
+    rows = np.flatnonzero(updated)
+    masks = read('u1', len(rows))
+    for column, (_name, dtype) in enumerate(fields):
+        has_field = (masks & (1 << column)) != 0
+        count = int(has_field.sum())
+        if count == 0:
+            continue
+        if data[offset] > 1:
+            raise ValueError('bad field encoding {}'.format(data[offset]))
+        offset += 1
+        if data[offset - 1] == 1:
+            kept_values[rows[has_field], column] += read('i1', count)
+        else:
+            kept_values[rows[has_field], column] = read(dtype, count)
+    all_ids = np.concatenate((kept_ids, new_ids))
+    order = np.argsort(all_ids, kind='stable')
+    return (EntityTable(all_ids[order],
+        np.concatenate((kept_values, new_values))[order]), offset)
+
+
+def encode_entities(snapshot, baseline=None):
+    '''Encode the objects of a snapshot, as a delta against the
+    baseline snapshot if there is one. The result is the same for every
+    client with the same baseline.'''
+    parts = []
+    for kind, fields in SNAPSHOT_FIELDS.items():
+        if baseline is None:
+            base = empty_table(kind)
+        else:
+            base = baseline.entities[kind]
+        parts.extend(encode_table(snapshot.entities[kind], base, fields))
+    return b''.join(parts)
+
+
+def encode_snapshot(snapshot, player_id, baseline=None, entities=None):
+    '''Encode a snapshot message for the player with the given number,
+    as a delta against the baseline snapshot if there is one. If the
+    encoded objects (from encode_entities with the same baseline) are
+    given they are used rather than encoded again. Returns the message
+    as bytes.'''
+    if entities is None:
+        entities = encode_entities(snapshot, baseline)
+    baseline_tick = NO_BASELINE if baseline is None else baseline.tick
+    return (SNAPSHOT + struct.pack('<IIH', snapshot.tick, baseline_tick,
+        player_id) + entities)
+
+
+def decode_snapshot(data, baselines):
+    '''Decode a snapshot message. Baselines maps ticks to the snapshots
+    previously received, one of which the message may be encoded
+    against. Returns a pair (player_id, snapshot). Raises ProtocolError
+    if the message is malformed or its baseline is not known.'''
+    try:
+        tick, baseline_tick, player_id = struct.unpack_from('<IIH', data, 1)
+        if baseline_tick == NO_BASELINE:
+            baseline = None
+        elif baseline_tick in baselines:
+            baseline = baselines[baseline_tick]
+        else:
+            raise ProtocolError('unknown baseline {}'.format(baseline_tick))
+        offset = 11
+        entities = {}
+        for kind, fields in SNAPSHOT_FIELDS.items():
+            if baseline is None:
+                base = empty_table(kind)
+            else:
+                base = baseline.entities[kind]
+            entities[kind], offset = decode_table(data, offset, base, fields)
+    except (struct.error, ValueError, IndexError) as error:
+        raise ProtocolError('malformed snapshot: {}'.format(error))
+    if offset != len(data):
+        raise ProtocolError('malformed snapshot: {} extra bytes'.format(
+            len(data) - offset))
+    return player_id, Snapshot(tick, entities)
+
+
+class ArenaBullet(Bullet):
+    '''A bullet which knows its number in the arena, so that clients
+    can match it up between snapshots.'''
+    __slots__ = ('bullet_id',)
+
+    def __init__(self, position, direction, bullet_id):
+        super(ArenaBullet, self).__init__(position, direction)
+        self.bullet_id = bullet_id
+
+
+class Player(object):
+    '''A player in an arena: their ship, their alive bullets, their
+    score and the action they are currently taking.'''
+    def __init__(self, player_id, ship):
+        self.player_id = player_id
+        self.ship = ship
+        self.bullets = []
+        self.score = 0
+        self.action = ACTION_NONE
+
+
+class Arena(object):
+    '''The authoritative state of a multiplayer game, and the rules for
+    advancing it. The rules are those of asteroids.World, applied to
+    every player's ship and bullets, with one shared field of rocks.
+    The field has at least MIN_NUM_ROCKS rocks for each player.
+
+    Rocks are given increasing numbers as they are created, which are
+    kept in the rock_ids array in the same order as the rocks.
+    '''
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.tick = 0
+        self.players = OrderedDict()
+        self.rocks = RockField()
+        self.rock_ids = np.zeros(0, dtype=np.int64)
+        self.next_rock_id = 0
+        self.next_bullet_id = 0
+
+
+    def new_ship(self):
+        '''Return a ship in the middle of the screen with a random
+        rotation, as at the start of a game.'''
+        return SpaceShip(Vector2(START_X, START_Y),
+            rotation=self.rng.randint(0, 359), speed=1,
+            size_major=SHIP_SIZE_MAJOR, size_minor=SHIP_SIZE_MINOR)
+
+
+    def add_player(self):
+        '''Add a new player to the arena. Returns their player number,
+        or None if the arena is full.'''
+        for player_id in range(MAX_PLAYERS):
+            if player_id not in self.players:
+                self.players[player_id] = Player(player_id, self.new_ship())
+                # Keep the players in order of their numbers, so that
+                # they are always updated in the same order.
+                self.players = OrderedDict(sorted(self.players.items()))
+                return player_id
+        return None
+
+
+    def remove_player(self, player_id):
+        '''Remove a player and their bullets from the arena.'''
+        self.players.pop(player_id, None)
+
+
+    def set_action(self, player_id, action):
+        '''Set the action the player takes in each time step until it
+        is changed.'''
+        player = self.players.get(player_id)
+        if player is not None:
+            player.action = action
+
+
+    def add_rocks(self, rocks):
+        '''Add Rock objects to the field, numbering them.'''
+        self.rocks.extend(rocks)
+        new_ids = np.arange(self.next_rock_id, self.next_rock_id + len(rocks))
+        self.rock_ids = np.concatenate((self.rock_ids, new_ids))
+        self.next_rock_id += len(rocks)
+
+
+    def step(self):
+        '''Advance the arena by one time step, using each player's
+        current action.'''
+        self.tick += 1
+        for player in self.players.values():
+            self.apply_action(player)
+        self.spawn_rocks()
+        self.update_bullets()
+        self.update_rocks()
+
+
+    def apply_action(self, player):
+        '''Turn, accelerate and fire the player's ship according to their
+        action, as World.apply_action does.'''
+        ship = player.ship
+        action = player.action
+        if action & ACTION_LEFT:
+            ship.turn_left(ROTATE_ANGLE)
+        if action & ACTION_RIGHT:
+            ship.turn_right(ROTATE_ANGLE)
+        if action & ACTION_UP:
+            ship.accelerate(1)
+        if action & ACTION_FIRE and len(player.bullets) < MAX_BULLETS:
+            direction = Vector2(1, 0).rotate(ship.rotation)
+            player.bullets.append(ArenaBullet(ship.position, direction,
+                self.next_bullet_id))
+            self.next_bullet_id += 1
+
+
+    def spawn_rocks(self):
+        '''Spawn new rocks off screen if there are fewer than
+        MIN_NUM_ROCKS for each player.'''
+        wanted = MIN_NUM_ROCKS * max(1, len(self.players))
+        if len(self.rocks) < wanted:
+            self.add_rocks(spawn_offscreen_rocks(wanted - len(self.rocks),
+                self.rng))
+
+
+    def update_bullets(self):
+        '''Age and move every player's bullets, and check if any bullet
+        has hit a rock. Bullets are checked in order of their players,
+        and a rock can only be hit by one bullet, as in World.'''
+        moved = []
+        for player in self.players.values():
+            alive = []
+            for bullet in player.bullets:
+                bullet.time_step()
+                if bullet.alive():
+                    bullet.move()
+                    alive.append(bullet)
+                    moved.append((player, bullet))
+            player.bullets = alive
+        rocks = self.rocks
+        if not moved or not len(rocks):
+            return
+        fronts = np.array([bullet.front() for _player, bullet in moved])
+        inside = rocks.contains_points(fronts)
+        touched = inside.any(axis=1).tolist()
+        hit_rocks = np.zeros(len(rocks), dtype=bool)
+        spawned_rocks = []
+        for number, (player, bullet) in enumerate(moved):
+            if not touched[number]:
+                continue
+            # The bullet hits the first rock it is inside which has not
+            # already been hit.
+            targets = np.flatnonzero(inside[number] & ~hit_rocks)
+            if len(targets) == 0:
+                continue
+            index = int(targets[0])
+            rock = rocks[index]
+            player.score += score_hit(rock.radius)
+            if rock.radius > MIN_ROCK_RADIUS:
+                spawned_rocks.extend(spawn_rocks_explosion(rock, self.rng))
+            hit_rocks[index] = True
+            player.bullets.remove(bullet)
+        if hit_rocks.any():
+            rocks.remove(hit_rocks)
+            self.rock_ids = self.rock_ids[~hit_rocks]
+        self.add_rocks(spawned_rocks)
+
+
+    def update_rocks(self):
+        '''Move the rocks, bounce them off each other, and move the
+        ships. A ship which hits a rock is replaced by a new ship in the
+        middle of the screen, and its player's score starts again.'''
+        self.rocks.move()
+        if ROCK_COLLISIONS:
+            self.rocks.collide()
+        for player in self.players.values():
+            if self.rocks.any_hit(player.ship.points()):
+                player.ship = self.new_ship()
+                player.bullets = []
+                player.score = 0
+            else:
+                player.ship.move()
+
+
+    def snapshot(self):
+        '''Return a Snapshot of the arena, with positions and angles in
+        the units in which they are sent.'''
+        players = list(self.players.values())
+        ships = EntityTable(
+            np.array([player.player_id for player in players],
+                dtype=np.int64),
+            np.array([(round(player.ship.position.x * POSITION_SCALE),
+                round(player.ship.position.y * POSITION_SCALE),
+                quantize_angle(player.ship.rotation), player.score)
+                for player in players], dtype=np.int64).reshape(-1, 4))
+        bullets = sorted((bullet.bullet_id, bullet)
+            for player in players for bullet in player.bullets)
+        bullets = EntityTable(
+            np.array([bullet_id for bullet_id, _bullet in bullets],
+                dtype=np.int64),
+            np.array([(round(bullet.position.x * POSITION_SCALE),
+                round(bullet.position.y * POSITION_SCALE),
+                quantize_angle(math.degrees(math.atan2(bullet.direction.y,
+                    bullet.direction.x))))
+                for _bullet_id, bullet in bullets],
+                dtype=np.int64).reshape(-1, 3))
+        rocks = self.rocks
+        rocks = EntityTable(self.rock_ids, np.column_stack((
+            np.round(rocks.positions * POSITION_SCALE).astype(np.int64),
+            rocks.radii, rocks.colours)))
+        return Snapshot(self.tick, {'ships': ships, 'bullets': bullets,
+            'rocks': rocks})
+
+
+class ClientState(object):
+    '''What the server knows about one client: its player number, the
+    last snapshot it acknowledged, the snapshots recently sent to it,
+    when it was last heard from and how many bytes it has been sent.'''
+    def __init__(self, player_id, now):
+        self.player_id = player_id
+        self.ack = None
+        self.history = OrderedDict()
+        self.last_heard = now
+        self.bytes_sent = 0
+        self.snapshots_sent = 0
+
+
+class ArenaServer(asyncio.DatagramProtocol):
+    '''An asyncio datagram protocol which runs an Arena and serves it
+    to clients over UDP. Call run to step the arena tick_rate times per
+    second.
+
+    Each client is known by its address. The server records how long
+    each time step takes (stepping the arena and encoding and sending
+    every snapshot) in tick_times, and the bytes sent to each client.
+    '''
+    def __init__(self, arena, tick_rate=FPS):
+        self.arena = arena
+        self.tick_rate = tick_rate
+        self.transport = None
+        self.clients = OrderedDict()
+        self.tick_times = []
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+    def datagram_received(self, data, address):
+        kind = data[:1]
+        client = self.clients.get(address)
+        now = time.monotonic()
+        if kind == JOIN:
+            if client is None:
+                player_id = self.arena.add_player()
+                if player_id is None:
+                    # The arena is full.
+                    return
+                client = ClientState(player_id, now)
+                self.clients[address] = client
+            # Joins are repeated until they are welcomed, so a lost
+            # welcome is sent again.
+            self.transport.sendto(WELCOME + struct.pack('<H',
+                client.player_id), address)
+        elif client is None:
+            return
+        elif kind == INPUT and len(data) == 10:
+            _sequence, ack, action = struct.unpack_from('<IIB', data, 1)
+            self.arena.set_action(client.player_id, action)
+            # Datagrams may arrive out of order, so only a newer
+            # acknowledgement of a snapshot the server still has counts.
+            if (ack in client.history
+                    and (client.ack is None or ack > client.ack)):
+                client.ack = ack
+        elif kind == LEAVE:
+            self.drop_client(address)
+            return
+        client.last_heard = now
+
+
+    def drop_client(self, address):
+        '''Forget a client and remove its player from the arena.'''
+        client = self.clients.pop(address, None)
+        if client is not None:
+            self.arena.remove_player(client.player_id)
+
+
+    def tick(self):
+        '''Step the arena and send every client its snapshot.'''
+        start = time.perf_counter()
+        now = time.monotonic()
+        for address, client in list(self.clients.items()):
+            if now - client.last_heard > CLIENT_TIMEOUT:
+                self.drop_client(address)
+        arena = self.arena
+        arena.step()
+        snapshot = arena.snapshot()
+        # Most clients acknowledge the same recent snapshot, so the
+        # objects are encoded once for each different baseline.
+        encoded = {}
+        for address, client in self.clients.items():
+            baseline = client.history.get(client.ack)
+            if client.ack not in encoded:
+                encoded[client.ack] = encode_entities(snapshot, baseline)
+            message = encode_snapshot(snapshot, client.player_id, baseline,
+                encoded[client.ack])
+            self.transport.sendto(message, address)
+            client.bytes_sent += len(message)
+            client.snapshots_sent += 1
+            client.history[snapshot.tick] = snapshot
+            if len(client.history) > SNAPSHOT_HISTORY:
+                client.history.popitem(last=False)
+        self.tick_times.append(time.perf_counter() - start)
+
+
+    async def run(self, num_ticks=None):
+        '''Step the arena tick_rate times per second, for num_ticks
+        time steps or forever. If the server falls behind it does not
+        try to catch up.'''
+        loop = asyncio.get_running_loop()
+        step_time = 1.0 / self.tick_rate
+        next_time = loop.time()
+        count = 0
+        while num_ticks is None or count < num_ticks:
+            self.tick()
+            count += 1
+            next_time += step_time
+            delay = next_time - loop.time()
+            if delay < 0:
+                next_time = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+
+class ArenaClient(asyncio.DatagramProtocol):
+    '''An asyncio datagram protocol which joins an arena server and
+    decodes the snapshots it sends. The most recent snapshot is in
+    latest, and the client's player number in player_id (None until the
+    server has welcomed the client).'''
+    def __init__(self):
+        self.transport = None
+        self.player_id = None
+        self.snapshots = OrderedDict()
+        self.latest = None
+        self.sequence = 0
+        self.bytes_received = 0
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.sendto(JOIN)
+
+
+    def datagram_received(self, data, address):
+        self.bytes_received += len(data)
+        kind = data[:1]
+        if kind == WELCOME and len(data) == 3:
+            self.player_id = struct.unpack_from('<H', data, 1)[0]
+        elif kind == SNAPSHOT:
+            try:
+                _player_id, snapshot = decode_snapshot(data, self.snapshots)
+            except ProtocolError:
+                return
+            # Ignore snapshots which arrive out of order.
+            if self.latest is not None and snapshot.tick <= self.latest.tick:
+                return
+            self.snapshots[snapshot.tick] = snapshot
+            if len(self.snapshots) > SNAPSHOT_HISTORY:
+                self.snapshots.popitem(last=False)
+            self.latest = snapshot
+
+
+    def send_input(self, action):
+        '''Send the player's action to the server, acknowledging the
+        latest snapshot. Until the server has welcomed the client this
+        asks to join instead.'''
+        if self.player_id is None:
+            self.transport.sendto(JOIN)
+            return
+        self.sequence += 1
+        ack = NO_BASELINE if self.latest is None else self.latest.tick
+        self.transport.sendto(INPUT + struct.pack('<IIB', self.sequence,
+            ack, action))
+
+
+    def leave(self):
+        '''Tell the server that the player has left.'''
+        self.transport.sendto(LEAVE)
+
+
+def draw_snapshot(window_surface, snapshot, player_id):
+    '''Draw the rocks, bullets and ships of a snapshot. The ship of the
+    given player is drawn in blue and the others in green. Returns the
+    score of the given player and the best score in the arena.'''
+    entities = snapshot.entities
+    for (x, y, radius, red, green, blue) in entities['rocks'].values.tolist():
+        center = (x // POSITION_SCALE, y // POSITION_SCALE)
+        pygame.draw.circle(window_surface, (red, green, blue), center, radius)
+    for (x, y, rotation) in entities['bullets'].values.tolist():
+        start_pos = Vector2(x, y) / POSITION_SCALE
+        end_pos = start_pos + Vector2(BULLET_LENGTH, 0).rotate(
+            rotation * 360.0 / ANGLE_UNITS)
+        pygame.draw.line(window_surface, RED, start_pos, end_pos,
+            BULLET_WIDTH)
+    score = 0
+    best_score = 0
+    ships = entities['ships']
+    for ship_id, (x, y, rotation, ship_score) in zip(ships.ids.tolist(),
+            ships.values.tolist()):
+        ship = SpaceShip(Vector2(x, y) / POSITION_SCALE,
+            rotation * 360.0 / ANGLE_UNITS, 0, SHIP_SIZE_MAJOR,
+            SHIP_SIZE_MINOR)
+        colour = GREEN
+        if ship_id == player_id:
+            colour = BLUE
+            score = ship_score
+        best_score = max(best_score, ship_score)
+        pygame.draw.polygon(window_surface, colour, ship.points())
+    return score, best_score
+
+
+async def client_loop(window_surface, host, port):
+    '''Play in the arena served at host and port until the player
+    quits: send the keys held down every frame and draw the latest
+    snapshot.'''
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(ArenaClient,
+        remote_addr=(host, port))
+    try:
+        while True:
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    return
+                if event.type == KEYDOWN and event.key == K_ESCAPE:
+                    return
+            client.send_input(read_action())
+            window_surface.fill(BLACK)
+            if client.latest is not None:
+                score, best_score = draw_snapshot(window_surface,
+                    client.latest, client.player_id)
+                show_score(window_surface, score, best_score)
+            pygame.display.update()
+            await asyncio.sleep(1.0 / FPS)
+    finally:
+        client.leave()
+        transport.close()
+
+
+def run_client(host, port):
+    '''Open the game window and play in the arena served at host and
+    port. This is the multiplayer mode of asteroids.py.'''
+    init_pygame()
+    window_surface = pygame.display.set_mode((MAX_X, MAX_Y), 0, 32)
+    pygame.display.set_caption('asteroids arena')
+    fonts.load(SCORE_FONT)
+    try:
+        asyncio.run(client_loop(window_surface, host, port))
+    finally:
+        pygame.quit()
+
+
+async def connect_clients(host, port, count):
+    '''Open count client endpoints to the arena served at host and
+    port. Returns a list of (transport, ArenaClient) pairs.'''
+    loop = asyncio.get_running_loop()
+    return [await loop.create_datagram_endpoint(ArenaClient,
+        remote_addr=(host, port)) for _count in range(count)]
+
+
+async def press_random_keys(clients, num_ticks=None, seed=None):
+    '''Send a random action from each client every time step, for
+    num_ticks time steps or forever.'''
+    player = random.Random(seed)
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    count = 0
+    while num_ticks is None or count < num_ticks:
+        for client in clients:
+            client.send_input(player.randint(0, max_action))
+        count += 1
+        await asyncio.sleep(1.0 / FPS)
+
+
+def disconnect_clients(endpoints):
+    '''Leave the arena and close the endpoints of connect_clients.'''
+    for transport, client in endpoints:
+        client.leave()
+        transport.close()
+
+
+async def run_bots(host, port, count, seed=None):
+    '''Join the arena served at host and port with count players who
+    press random keys, until cancelled.'''
+    endpoints = await connect_clients(host, port, count)
+    try:
+        await press_random_keys([client for _transport, client in endpoints],
+            seed=seed)
+    finally:
+        disconnect_clients(endpoints)
+
+
+async def serve(port, seed=None):
+    '''Run an arena server on the given UDP port forever, printing
+    statistics every REPORT_INTERVAL seconds.'''
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: ArenaServer(Arena(seed)), local_addr=('0.0.0.0', port))
+    print('arena server listening on port {}'.format(port))
+    task = asyncio.ensure_future(server.run())
+    try:
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            times = server.tick_times
+            server.tick_times = []
+            clients = list(server.clients.values())
+            sent = sum(client.bytes_sent for client in clients)
+            for client in clients:
+                client.bytes_sent = 0
+            if times and clients:
+                print('{} players: tick p50 {:.3f} ms p99 {:.3f} ms, '
+                    '{:.0f} bytes/sec per client'.format(len(clients),
+                    1000 * np.percentile(times, 50),
+                    1000 * np.percentile(times, 99),
+                    sent / float(len(clients)) / REPORT_INTERVAL))
+    finally:
+        task.cancel()
+        transport.close()
+
+
+def in_sync(client, server_client):
+    '''Return True if the latest snapshot decoded by a client is the
+    same as the snapshot the server sent it for that time step.'''
+    if client.latest is None:
+        return False
+    sent = server_client.history.get(client.latest.tick)
+    if sent is None:
+        return False
+    return all(np.array_equal(sent.entities[kind].ids,
+            client.latest.entities[kind].ids)
+        and np.array_equal(sent.entities[kind].values,
+            client.latest.entities[kind].values)
+        for kind in SNAPSHOT_FIELDS)
+
+
+async def measure(num_players, num_ticks, seed=None):
+    '''Run a server and num_players clients pressing random keys over
+    the loopback interface for num_ticks time steps. Returns a tuple of
+    the median and 99th percentile server time step in seconds, the
+    mean bytes sent per client per second, and whether every client's
+    latest snapshot matches the one the server sent it.'''
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(
+        lambda: ArenaServer(Arena(seed), FPS), local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+    endpoints = await connect_clients('127.0.0.1', port, num_players)
+    clients = [client for _transport, client in endpoints]
+    keys = asyncio.ensure_future(press_random_keys(clients, seed=seed))
+    try:
+        # Let every client join before the measurement starts.
+        while any(client.player_id is None for client in clients):
+            await asyncio.sleep(0.01)
+        server.tick_times = []
+        for server_client in server.clients.values():
+            server_client.bytes_sent = 0
+        await server.run(num_ticks)
+        # Give the last snapshots time to arrive.
+        await asyncio.sleep(0.1)
+        by_player = dict((server_client.player_id, server_client)
+            for server_client in server.clients.values())
+        synced = all(in_sync(client, by_player[client.player_id])
+            for client in clients)
+        sent = sum(server_client.bytes_sent
+            for server_client in server.clients.values())
+    finally:
+        keys.cancel()
+        disconnect_clients(endpoints)
+        transport.close()
+    seconds = num_ticks / float(FPS)
+    return (np.percentile(server.tick_times, 50),
+        np.percentile(server.tick_times, 99),
+        sent / float(num_players) / seconds, synced)
+
+
+def parse_address(address):
+    '''Split a HOST:PORT string. The host defaults to localhost.'''
+    host, _colon, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def main():
+    '''Run an arena server, some bot players, or the benchmark.'''
+    parser = argparse.ArgumentParser(
+        description='Multiplayer asteroids arena.')
+    commands = parser.add_subparsers(dest='command')
+    server_parser = commands.add_parser('server', help='run an arena server')
+    server_parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help='UDP port to listen on')
+    server_parser.add_argument('--seed', type=int, default=None,
+        help='seed for the arena')
+    bots_parser = commands.add_parser('bots',
+        help='join a server with players who press random keys')
+    bots_parser.add_argument('--connect', metavar='HOST:PORT',
+        default='localhost:{}'.format(DEFAULT_PORT), help='server address')
+    bots_parser.add_argument('--count', type=int, default=4,
+        help='number of players')
+    bots_parser.add_argument('--seed', type=int, default=None,
+        help='seed for the random keys')
+    bench_parser = commands.add_parser('bench',
+        help='measure server time step and bandwidth over loopback')
+    bench_parser.add_argument('--players', type=int, nargs='+',
+        default=[1, 4, 16, 64], help='numbers of players to try')
+    bench_parser.add_argument('--ticks', type=int, default=400,
+        help='number of time steps to measure')
+    bench_parser.add_argument('--seed', type=int, default=1,
+        help='seed for the arena and the random keys')
+    args = parser.parse_args()
+    try:
+        if args.command == 'server':
+            asyncio.run(serve(args.port, args.seed))
+        elif args.command == 'bots':
+            host, port = parse_address(args.connect)
+            asyncio.run(run_bots(host, port, args.count, args.seed))
+        elif args.command == 'bench':
+            for num_players in args.players:
+                tick_p50, tick_p99, bandwidth, synced = asyncio.run(
+                    measure(num_players, args.ticks, args.seed))
+                print('{:3d} players: tick p50 {:6.3f} ms p99 {:6.3f} ms, '
+                    '{:7.0f} bytes/sec per client, clients {}'.format(
+                    num_players, 1000 * tick_p50, 1000 * tick_p99,
+                    bandwidth, 'in sync' if synced else 'NOT in sync'))
+        else:
+            parser.print_help()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+'''
+Off-screen frames of many asteroids games at once.
+
+Recording games, and automated players which learn from pixels, need
+the picture of every game at every time step, often at a low
+resolution such as 84 by 84 pixels. Drawing each game with pygame
+means one drawing call per rock, bullet and ship, on a full size
+surface which must then be scaled down. A BatchRasterizer instead
+draws a whole batch of games straight into one NumPy array of shape
+(games, height, width) of grey levels, or (games, height, width, 3)
+of RGB colours, with a few vectorized operations per kind of shape:
+
+    - Rocks are circles. Every rock of every game of the same radius
+      is drawn at once, by testing the pixels of a small square around
+      each rock's centre against its circle.
+    - Bullets are line segments BULLET_LENGTH long, drawn by setting
+      the pixels under evenly spaced points along each segment.
+    - Ships are triangles, drawn by testing the pixels of a square
+      around each ship against the three edges of its triangle.
+
+A pixel is covered by a shape if the centre of the pixel is inside the
+shape, with the screen of MAX_X by MAX_Y units scaled to fit the
+frame, as if the screen of the game had been drawn and then resized.
+As in the game, shapes are drawn in the order bullets, rocks, ship,
+each on top of the ones before, and shapes crossing the edge of the
+screen are cut off rather than wrapped around. Grey levels are the
+luminance of the colours used by the game.
+
+Nothing here needs a display. Frames can be taken from a list of
+asteroids.World objects or straight from the arrays of a
+vector_world.VectorWorld. To compare the time per game with drawing
+each game with pygame and scaling it down:
+
+    python rasterizer.py --games 1 16 256 --size 84 84
+'''
+
+import argparse
+import random
+import time
+
+import numpy as np
+import pygame
+
+from asteroids import (World, MAX_X, MAX_Y, BLACK, RED, BLUE, BULLET_LENGTH,
+    BULLET_WIDTH, SHIP_SIZE_MAJOR, SHIP_SIZE_MINOR, ACTION_LEFT,
+    ACTION_RIGHT, ACTION_UP, ACTION_FIRE)
+from vector_world import VectorWorld
+
+# Default width and height of the frames, in pixels.
+FRAME_WIDTH = 84
+FRAME_HEIGHT = 84
+# Weights of the red, green and blue channels in the grey level of a
+# colour (ITU-R BT.601 luminance).
+GREY_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+class BatchRasterizer(object):
+    '''Draws batches of games into NumPy arrays of frames of the given
+    width and height. If colour is True frames are RGB, with shape
+    (games, height, width, 3), otherwise they are grey levels, with shape
+    (games, height, width). Both are unsigned bytes.
+
+    The array of frames is kept from one call to the next, so the
+    frames returned are overwritten by the next call. Copy them to keep
+    them.
+    '''
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, colour=False):
+        self.width = width
+        self.height = height
+        self.colour = colour
+        # Pixels per unit of the game along each axis.
+        self.scale_x = width / float(MAX_X)
+        self.scale_y = height / float(MAX_Y)
+        self.frames = None
+        self.bullet_value = self.shade(np.array([RED]))[0]
+        self.ship_value = self.shade(np.array([BLUE]))[0]
+        self.background = self.shade(np.array([BLACK]))[0]
+
+
+    def shade(self, colours):
+        '''Return the pixel values of an array of RGB colours with shape
+        (n, 3): the colours themselves, or their grey levels.'''
+        colours = np.asarray(colours)
+        if self.colour:
+            return colours.astype(np.uint8)
+        return np.rint(colours @ GREY_WEIGHTS).astype(np.uint8)
+
+
+    def blank_frames(self, num_games):
+        '''Return the array of frames for num_games games, cleared to the
+        background colour.'''
+        shape = (num_games, self.height, self.width)
+        if self.colour:
+            shape += (3,)
+        if self.frames is None or self.frames.shape != shape:
+            self.frames = np.zeros(shape, dtype=np.uint8)
+        self.frames[...] = self.background
+        return self.frames
+
+
+    def plot(self, frames, games, xs, ys, values):
+        '''Set the pixels at columns xs and rows ys of the frames of the
+        given games (arrays of the same shape) to the given values,
+        leaving out pixels outside the frames.'''
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        frames[games[inside], ys[inside], xs[inside]] = values[inside]
+
+
+    def draw_circles(self, frames, games, centres, radii, values):
+        '''Draw filled circles with the given centres (shape (k, 2)) and
+        radii (shape (k,)), in game units, in the frames of the given
+        games with the given pixel values. The circles of each radius
+        are drawn together.'''
+        scale_x = self.scale_x
+        scale_y = self.scale_y
+        for radius in np.unique(radii):
+            chosen = np.flatnonzero(radii == radius)
+            # A square of pixels, centred on the pixel holding the centre
+            # of the circle, large enough to hold the circle.
+            half_x = int(np.ceil(radius * scale_x)) + 1
+            half_y = int(np.ceil(radius * scale_y)) + 1
+            offset_y, offset_x = np.mgrid[-half_y:half_y + 1,
+                -half_x:half_x + 1]
+            centre_x = centres[chosen, 0, np.newaxis]
+            centre_y = centres[chosen, 1, np.newaxis]
+            xs = np.floor(centre_x * scale_x).astype(np.int64) + offset_x.ravel()
+            ys = np.floor(centre_y * scale_y).astype(np.int64) + offset_y.ravel()
+            # The offsets of the pixel centres from the circle centres,
+            # in game units.
+            dx = (xs + 0.5) / scale_x - centre_x
+            dy = (ys + 0.5) / scale_y - centre_y
+            covered = dx * dx + dy * dy <= float(radius) * radius
+            rows, columns = np.nonzero(covered)
+            self.plot(frames, games[chosen][rows], xs[rows, columns],
+                ys[rows, columns], values[chosen][rows])
+
+
+    def draw_segments(self, frames, games, starts, ends, value):
+        '''Draw line segments from starts to ends (shape (k, 2)), in game
+        units, BULLET_WIDTH units wide (but at least one pixel), in the
+        frames of the given games with the given pixel value.'''
+        lengths = np.sqrt(np.einsum('ij,ij->i', ends - starts, ends - starts))
+        scale = max(self.scale_x, self.scale_y)
+        # Enough points that consecutive points are less than a pixel
+        # apart.
+        num_points = int(np.ceil(lengths.max(initial=0.0) * scale)) + 1
+        fractions = np.linspace(0.0, 1.0, num_points)[np.newaxis, :, np.newaxis]
+        points = starts[:, np.newaxis, :] + (ends - starts)[:, np.newaxis,
+            :] * fractions
+        thickness = max(1, int(round(BULLET_WIDTH * scale)))
+        xs = np.floor(points[:, :, 0] * self.scale_x).astype(np.int64)
+        ys = np.floor(points[:, :, 1] * self.scale_y).astype(np.int64)
+        owners = np.repeat(games, num_points).reshape(xs.shape)
+        for offset_x in range(thickness):
+            for offset_y in range(thickness):
+                self.plot(frames, owners, xs + offset_x, ys + offset_y,
+                    np.full(xs.shape + np.shape(value), value, dtype=np.uint8))
+
+
+    def draw_triangles(self, frames, corners, value):
+        '''Draw one filled triangle in each frame, with the given corners
+        (shape (games, 3, 2)) in game units, with the given pixel
+        value.'''
+        num_games = len(corners)
+        # Work in pixels; scaling the axes does not change which points
+        # are inside a triangle.
+        corners = corners * (self.scale_x, self.scale_y)
+        centres = corners.mean(axis=1)
+        half = int(np.ceil(np.abs(corners - centres[:, np.newaxis, :]).max(
+            initial=0.0))) + 1
+        offset_y, offset_x = np.mgrid[-half:half + 1, -half:half + 1]
+        xs = np.floor(centres[:, 0, np.newaxis]).astype(np.int64) + offset_x.ravel()
+        ys = np.floor(centres[:, 1, np.newaxis]).astype(np.int64) + offset_y.ravel()
+        pixel_x = xs + 0.5
+        pixel_y = ys + 0.5
+        positive = np.ones(xs.shape, dtype=bool)
+        negative = np.ones(xs.shape, dtype=bool)
+        for corner in range(3):
+            ax, ay = corners[:, corner, 0:1], corners[:, corner, 1:2]
+            bx, by = (corners[:, (corner + 1) % 3, 0:1],
+                corners[:, (corner + 1) % 3, 1:2])
+            # Which side of the edge from a to b each pixel centre is on.
+            side = (bx - ax) * (pixel_y - ay) - (by - ay) * (pixel_x - ax)
+            positive &= side >= 0
+            negative &= side <= 0
+        rows, columns = np.nonzero(positive | negative)
+        values = np.full((len(rows),) + np.shape(value), value, dtype=np.uint8)
+        self.plot(frames, np.arange(num_games)[rows], xs[rows, columns],
+            ys[rows, columns], values)
+
+
+    def render_arrays(self, ship_position, ship_rotation, rock_position,
+            rock_radius, rock_colour, rock_alive, bullet_position,
+            bullet_direction, bullet_alive):
+        '''Draw a batch of games given as arrays whose first axis is the
+        game, in the layout of vector_world.VectorWorld: ship positions
+        (shape (n, 2)) and rotations in degrees (shape (n,)), rocks with
+        shape (n, r, ...) and bullets with shape (n, b, ...), where the
+        rock_alive and bullet_alive masks mark the slots in use. Returns
+        the frames.'''
+        num_games = len(ship_position)
+        frames = self.blank_frames(num_games)
+
+        games, slots = np.nonzero(bullet_alive)
+        if len(games):
+            starts = bullet_position[games, slots]
+            ends = starts + bullet_direction[games, slots] * BULLET_LENGTH
+            self.draw_segments(frames, games, starts, ends, self.bullet_value)
+
+        games, slots = np.nonzero(rock_alive)
+        if len(games):
+            self.draw_circles(frames, games, rock_position[games, slots],
+                rock_radius[games, slots],
+                self.shade(rock_colour[games, slots]))
+
+        if num_games:
+            # The corners of each ship, as in SpaceShip.points.
+            angles = np.radians(np.asarray(ship_rotation, dtype=float)[:,
+                np.newaxis] + (0.0, 120.0, 240.0))
+            sizes = np.array([SHIP_SIZE_MAJOR, SHIP_SIZE_MINOR,
+                SHIP_SIZE_MINOR], dtype=float)
+            corners = (ship_position[:, np.newaxis, :] + sizes[:, np.newaxis]
+                * np.stack((np.cos(angles), np.sin(angles)), axis=-1))
+            self.draw_triangles(frames, corners, self.ship_value)
+        return frames
+
+
+    def render_vector(self, vector_world):
+        '''Draw every game of a VectorWorld. Returns the frames.'''
+        return self.render_arrays(vector_world.ship_position,
+            vector_world.ship_rotation, vector_world.rock_position,
+            vector_world.rock_radius, vector_world.rock_colour,
+            vector_world.rock_alive, vector_world.bullet_position,
+            vector_world.bullet_direction, vector_world.bullet_alive)
+
+
+    def render_worlds(self, worlds):
+        '''Draw each of a list of World objects. Returns the frames, in
+        the same order as the worlds.'''
+        num_games = len(worlds)
+        num_rocks = max([len(world.rocks) for world in worlds] + [0])
+        num_bullets = max([len(world.bullets) for world in worlds] + [0])
+        rock_position = np.zeros((num_games, num_rocks, 2))
+        rock_radius = np.zeros((num_games, num_rocks), dtype=np.int64)
+        rock_colour = np.zeros((num_games, num_rocks, 3), dtype=np.uint8)
+        rock_alive = np.zeros((num_games, num_rocks), dtype=bool)
+        bullet_position = np.zeros((num_games, num_bullets, 2))
+        bullet_direction = np.zeros((num_games, num_bullets, 2))
+        bullet_alive = np.zeros((num_games, num_bullets), dtype=bool)
+        ship_position = np.zeros((num_games, 2))
+        ship_rotation = np.zeros(num_games)
+        for game, world in enumerate(worlds):
+            rocks = world.rocks
+            count = len(rocks)
+            rock_position[game, :count] = rocks.positions
+            rock_radius[game, :count] = rocks.radii
+            rock_colour[game, :count] = rocks.colours
+            rock_alive[game, :count] = True
+            for slot, bullet in enumerate(world.bullets):
+                bullet_position[game, slot] = bullet.position
+                bullet_direction[game, slot] = bullet.direction
+                bullet_alive[game, slot] = True
+            ship = world.ship
+            ship_position[game] = ship.position
+            ship_rotation[game] = ship.rotation
+        return self.render_arrays(ship_position, ship_rotation,
+            rock_position, rock_radius, rock_colour, rock_alive,
+            bullet_position, bullet_direction, bullet_alive)
+
+
+def pygame_frames(worlds, width, height, colour):
+    '''Draw each world with pygame at the size of the screen, scale it
+    down to width by height pixels and copy out its pixels: the way to
+    get frames without a BatchRasterizer. Returns the frames.'''
+    surface = pygame.Surface((MAX_X, MAX_Y))
+    small = pygame.Surface((width, height))
+    frames = []
+    for world in worlds:
+        surface.fill(BLACK)
+        world.draw(surface)
+        pygame.transform.scale(surface, (width, height), small)
+        # surfarray arrays are indexed (x, y).
+        pixels = pygame.surfarray.array3d(small).swapaxes(0, 1)
+        if not colour:
+            pixels = np.rint(pixels @ GREY_WEIGHTS).astype(np.uint8)
+        frames.append(pixels)
+    return np.stack(frames)
+
+
+def played_worlds(num_games, num_ticks, seed):
+    '''Return num_games worlds part way through games of a player
+    pressing random keys.'''
+    player = random.Random(seed)
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    worlds = []
+    for _game in range(num_games):
+        world = World(player.getrandbits(32))
+        for _count in range(num_ticks):
+            world.step(player.randint(0, max_action))
+            if world.done:
+                world.reset(player.getrandbits(32))
+        worlds.append(world)
+    return worlds
+
+
+def main():
+    '''Report the time taken to draw batches of games with a
+    BatchRasterizer and with pygame.'''
+    parser = argparse.ArgumentParser(
+        description='Measure the speed of batched off-screen frames.')
+    parser.add_argument('--games', type=int, nargs='+', default=[1, 16, 256],
+        help='numbers of games to draw at once')
+    parser.add_argument('--size', type=int, nargs=2, default=[FRAME_WIDTH,
+        FRAME_HEIGHT], metavar=('WIDTH', 'HEIGHT'),
+        help='width and height of the frames in pixels')
+    parser.add_argument('--colour', action='store_true',
+        help='draw RGB frames rather than grey levels')
+    parser.add_argument('--repeats', type=int, default=20,
+        help='number of times to draw each batch')
+    parser.add_argument('--seed', type=int, default=1,
+        help='seed for the games')
+    args = parser.parse_args()
+    width, height = args.size
+    rasterizer = BatchRasterizer(width, height, args.colour)
+    print(' games   worlds us/game   vector us/game   pygame us/game')
+    for num_games in args.games:
+        worlds = played_worlds(num_games, 200, args.seed)
+        vector_world = VectorWorld(num_games, args.seed)
+        actions = np.random.default_rng(args.seed)
+        for _count in range(200):
+            vector_world.step(actions.integers(0, 16, size=num_games))
+        results = []
+        for draw in (lambda: rasterizer.render_worlds(worlds),
+                lambda: rasterizer.render_vector(vector_world),
+                lambda: pygame_frames(worlds, width, height, args.colour)):
+            draw()
+            start = time.perf_counter()
+            for _count in range(args.repeats):
+                draw()
+            results.append((time.perf_counter() - start) / args.repeats
+                / num_games)
+        print('{:6d} {:16.1f} {:16.1f} {:16.1f}'.format(num_games,
+            *(1e6 * result for result in results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+'''
+Run many games of asteroids in parallel worker processes.
+
+A RolloutRunner divides a number of games between a pool of worker
+processes. Each worker plays its games with asteroids.World, using a
+player which presses random keys, and writes the state and score of
+every game at every time step into arrays in shared memory
+(multiprocessing.shared_memory). The parent process reads the results
+straight from those arrays, so nothing but a few small arguments is
+pickled between processes.
+
+Each game has its own seed, derived from the runner's seed and the
+index of the game. A worker is given the seeds of the games it plays,
+so the results are the same whatever the number of workers. A game
+which ends (the ship crashes) is restarted with a new seed drawn from
+the same sequence, so every game slot records exactly num_ticks time
+steps.
+
+To measure throughput and scaling efficiency for several worker counts:
+
+    python rollout.py --games 64 --ticks 2000 --workers 1 2 4 8
+
+Scaling efficiency is the throughput divided by the number of workers,
+relative to the throughput per worker of the first worker count (so it
+is 1 for the first line). It stays close to 1 until the number of
+workers reaches the number of physical cores.
+'''
+
+import argparse
+import random
+import time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from asteroids import (World, ACTION_LEFT, ACTION_RIGHT, ACTION_UP,
+    ACTION_FIRE)
+
+# The names of the per-tick state values recorded for each game.
+STATE_FIELDS = ('ship_x', 'ship_y', 'ship_velocity_x', 'ship_velocity_y',
+    'ship_rotation', 'num_rocks', 'num_bullets')
+
+
+class RolloutBuffers(object):
+    '''Arrays in shared memory holding the results of a rollout of
+    num_games games for num_ticks time steps each:
+       - states (float array of shape (num_games, num_ticks, len(STATE_FIELDS)))
+       - scores (integer array of shape (num_games, num_ticks))
+       - dones (boolean array of shape (num_games, num_ticks))
+
+    The process which creates the buffers (with names=None) owns them
+    and must call unlink when it has finished with them. Worker
+    processes attach to existing buffers by passing their names.
+    '''
+    def __init__(self, num_games, num_ticks, names=None):
+        self.shapes = {
+            'states': ((num_games, num_ticks, len(STATE_FIELDS)), np.float64),
+            'scores': ((num_games, num_ticks), np.int64),
+            'dones': ((num_games, num_ticks), np.bool_),
+        }
+        self.owner = names is None
+        self.memory = {}
+        for key, (shape, dtype) in self.shapes.items():
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if self.owner:
+                memory = SharedMemory(create=True, size=max(size, 1))
+            else:
+                memory = SharedMemory(name=names[key])
+            self.memory[key] = memory
+            setattr(self, key, np.ndarray(shape, dtype=dtype,
+                buffer=memory.buf))
+
+
+    def names(self):
+        '''Return the names which other processes use to attach
+        to these buffers.'''
+        return dict((key, memory.name) for key, memory in self.memory.items())
+
+
+    def close(self):
+        '''Detach from the shared memory. The arrays must not be used
+        after this.'''
+        for key in self.shapes:
+            setattr(self, key, None)
+        for memory in self.memory.values():
+            memory.close()
+
+
+    def unlink(self):
+        '''Free the shared memory. Only the owner should do this.'''
+        self.close()
+        for memory in self.memory.values():
+            memory.unlink()
+
+
+def play_games(names, num_games, num_ticks, first_game, game_seeds):
+    '''Worker entry point. Play the games numbered from first_game, one
+    per seed in game_seeds, writing their results into the shared
+    buffers with the given names. Returns the time in seconds that the
+    worker spent simulating.'''
+    buffers = RolloutBuffers(num_games, num_ticks, names)
+    max_action = ACTION_LEFT | ACTION_RIGHT | ACTION_UP | ACTION_FIRE
+    start = time.perf_counter()
+    try:
+        for offset, seed in enumerate(game_seeds):
+            game = first_game + offset
+            states = buffers.states[game]
+            scores = buffers.scores[game]
+            dones = buffers.dones[game]
+            # The random player and the restarts of this game are
+            # driven by the game's own seed.
+            player = random.Random(seed)
+            world = World(player.getrandbits(64))
+            for tick in range(num_ticks):
+                _state, _reward, done = world.step(player.randint(0,
+                    max_action))
+                ship = world.ship
+                states[tick] = (ship.position.x, ship.position.y,
+                    ship.velocity.x, ship.velocity.y, ship.rotation,
+                    len(world.rocks), len(world.bullets))
+                scores[tick] = world.score
+                dones[tick] = done
+                if done:
+                    world.reset(player.getrandbits(64))
+    finally:
+        buffers.close()
+    return time.perf_counter() - start
+
+
+class RolloutRunner(object):
+    '''Play num_games games of num_ticks time steps each, divided
+    between num_workers worker processes.
+
+    After run returns, the results are available in the states, scores
+    and dones arrays of the runner's buffers. They remain valid until
+    close is called; a RolloutRunner can be used as a context manager to
+    do this automatically.
+    '''
+    def __init__(self, num_games, num_ticks, num_workers):
+        self.num_games = num_games
+        self.num_ticks = num_ticks
+        self.num_workers = max(1, min(num_workers, num_games))
+        self.buffers = RolloutBuffers(num_games, num_ticks)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Free the shared memory holding the results.'''
+        if self.buffers is not None:
+            self.buffers.unlink()
+            self.buffers = None
+
+
+    def game_seeds(self, seed):
+        '''Return one seed for each game, derived from the runner seed.'''
+        sequence = np.random.SeedSequence(seed)
+        return [int(value) for value in
+            sequence.generate_state(self.num_games, dtype=np.uint64)]
+
+
+    def shards(self):
+        '''Divide the games into one contiguous range per worker. Returns
+        a list of (first_game, end_game) pairs.'''
+        bounds = np.linspace(0, self.num_games, self.num_workers + 1)
+        bounds = bounds.astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+    def run(self, seed=None):
+        '''Play all the games. Returns the total number of game time
+        steps simulated per second of wall clock time.'''
+        seeds = self.game_seeds(seed)
+        names = self.buffers.names()
+        tasks = [(names, self.num_games, self.num_ticks, int(first),
+            seeds[first:end]) for first, end in self.shards()]
+        with Pool(self.num_workers) as pool:
+            start = time.perf_counter()
+            pool.starmap(play_games, tasks)
+            elapsed = time.perf_counter() - start
+        return self.num_games * self.num_ticks / elapsed
+
+
+def main():
+    '''Report rollout throughput and scaling efficiency for several
+    numbers of worker processes.'''
+    parser = argparse.ArgumentParser(
+        description='Measure the speed of parallel asteroids rollouts.')
+    parser.add_argument('--games', type=int, default=64,
+        help='number of games to play')
+    parser.add_argument('--ticks', type=int, default=2000,
+        help='number of time steps per game')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+        help='numbers of worker processes to try')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed for the games')
+    args = parser.parse_args()
+    base_rate = None
+    for num_workers in args.workers:
+        with RolloutRunner(args.games, args.ticks, num_workers) as runner:
+            rate = runner.run(args.seed)
+        if base_rate is None:
+            base_rate = rate / num_workers
+        efficiency = rate / (base_rate * num_workers)
+        print('{:3d} workers: {:10.0f} ticks/sec, efficiency {:.2f}'.format(
+            num_workers, rate, efficiency))
+
+
+if __name__ == '__main__':
+    main()